@@ -0,0 +1,301 @@
+import json
+import logging
+import math
+import os
+import queue
+import socket
+import threading
+import urllib.request
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sampler import sampler
+
+logger = logging.getLogger(__name__)
+
+# JSON-файл с правилами (список объектов, см. rule_from_dict) и адрес
+# вебхука для уведомлений; без вебхука уведомления пишутся в лог
+RULES_FILE = os.environ.get('MONITOR_ALERT_RULES')
+WEBHOOK_URL = os.environ.get('MONITOR_ALERT_WEBHOOK')
+HISTORY_SIZE = 1000
+
+
+class Rule:
+    """Статический порог: score — само значение метрики.
+
+    Срабатывает, когда score держится выше threshold (ниже при
+    above=False) for_samples замеров подряд, и снимается, только когда
+    score вернётся за clear. Разрыв между threshold и clear (гистерезис)
+    не даёт тревоге мигать на границе.
+    """
+    kind = 'threshold'
+
+    def __init__(self, name: str, metric: str, threshold: float, clear: Optional[float] = None,
+                 above: bool = True, for_samples: int = 1, hosts: Optional[Iterable[str]] = None):
+        self.name = name
+        self.metric = metric
+        self.threshold = threshold
+        self.clear = threshold if clear is None else clear
+        self.above = above
+        self.for_samples = for_samples
+        self.hosts = set(hosts) if hosts else None
+
+    def score(self, state: dict, timestamp: float, value: float) -> Optional[float]:
+        return value
+
+    def breached(self, score: float) -> bool:
+        return score > self.threshold if self.above else score < self.threshold
+
+    def cleared(self, score: float) -> bool:
+        return score <= self.clear if self.above else score >= self.clear
+
+
+class RateRule(Rule):
+    """Скорость изменения метрики в единицах в секунду."""
+    kind = 'rate'
+
+    def score(self, state: dict, timestamp: float, value: float) -> Optional[float]:
+        prev = state.get('prev')
+        state['prev'] = (timestamp, value)
+        if prev is None or timestamp <= prev[0]:
+            return None
+        return (value - prev[1]) / (timestamp - prev[0])
+
+
+class ZScoreRule(Rule):
+    """Отклонение от среднего за последние window замеров в сигмах.
+
+    Среднее и сумма квадратов отклонений окна обновляются по Уэлфорду
+    (со сдвигом окна: новое значение заменяет самое старое) и раз в
+    window замеров пересчитываются по самому окну, так что накопленная
+    ошибка округления не растёт со временем — даже на больших значениях
+    вроде скорости сети в байтах. В среднем расчёт стоит O(1).
+    """
+    kind = 'zscore'
+
+    def __init__(self, name: str, metric: str, threshold: float, window: int = 60, **kwargs):
+        super().__init__(name, metric, threshold, **kwargs)
+        self.window = window
+
+    def score(self, state: dict, timestamp: float, value: float) -> Optional[float]:
+        values = state.get('values')
+        if values is None:
+            values = state['values'] = deque()
+            state['mean'] = state['m2'] = 0.0
+            state['updates'] = 0
+        mean, m2 = state['mean'], state['m2']
+        z = None
+        if len(values) == self.window:
+            variance = m2 / self.window
+            z = (value - mean) / math.sqrt(variance) if variance > 1e-12 else 0.0
+            old = values.popleft()
+            values.append(value)
+            state['updates'] += 1
+            if state['updates'] >= self.window:
+                state['updates'] = 0
+                new_mean = math.fsum(values) / self.window
+                m2 = math.fsum((v - new_mean) ** 2 for v in values)
+            else:
+                new_mean = mean + (value - old) / self.window
+                m2 += (value - old) * (value - new_mean + old - mean)
+        else:
+            values.append(value)
+            new_mean = mean + (value - mean) / len(values)
+            m2 += (value - mean) * (value - new_mean)
+        state['mean'], state['m2'] = new_mean, m2
+        return z
+
+
+RULE_KINDS = {rule.kind: rule for rule in (Rule, RateRule, ZScoreRule)}
+
+
+def rule_from_dict(data: dict) -> Rule:
+    """{"kind": "threshold" | "rate" | "zscore", "name": ..., "metric": ..., ...}"""
+    data = dict(data)
+    return RULE_KINDS[data.pop('kind', 'threshold')](**data)
+
+
+DEFAULT_RULES = [
+    Rule('cpu_high', 'cpu', 90, clear=80, for_samples=5),
+    Rule('ram_high', 'ram', 90, clear=85, for_samples=3),
+    Rule('disk_full', 'disk_usage', 90, clear=88),
+    ZScoreRule('cpu_anomaly', 'cpu', 4, clear=2, window=60),
+]
+
+
+class Alert(NamedTuple):
+    rule: str
+    kind: str
+    host: str
+    metric: str
+    state: str  # 'firing' или 'resolved'
+    value: float
+    score: float
+    timestamp: float
+
+
+class _RuleState:
+    __slots__ = ('firing', 'streak', 'data', 'since')
+
+    def __init__(self):
+        self.firing = False
+        self.streak = 0
+        self.data: dict = {}
+        self.since: Optional[float] = None
+
+
+class AlertEngine:
+    """Инкрементальная проверка правил на потоке замеров.
+
+    На каждый замер проверяются только правила его метрик, каждое за O(1):
+    нужное состояние (предыдущее значение, среднее окна, серия нарушений)
+    хранится по паре (правило, машина) — по самому объекту правила, так
+    что правила с одинаковым именем (например, предупреждение и авария
+    cpu_high) не делят состояние. Уведомление отправляется только
+    при смене состояния — повторные нарушения уже сработавшего правила
+    не дублируются. Доставка идёт в отдельном потоке через очередь, так
+    что медленный вебхук не задерживает сборщик.
+
+    Кадры машин парка (submit) тоже проверяет отдельный поток: они ждут
+    в ограниченной очереди, а блокировка берётся на каждую строку, так
+    что большой кадр не задерживает ни запрос /ingest, ни сборщик.
+    """
+
+    def __init__(self, rules: Iterable[Rule] = (), sinks: Iterable = (), queue_size: int = 10_000,
+                 inbox_size: int = 1000):
+        self.rules: Dict[str, List[Rule]] = {}
+        for rule in rules:
+            self.add_rule(rule)
+        self.sinks = list(sinks)
+        self.history: deque = deque(maxlen=HISTORY_SIZE)
+        self.dropped = 0
+        self.dropped_frames = 0
+        self._states: Dict[Tuple[Rule, str], _RuleState] = {}
+        self._lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._inbox: queue.Queue = queue.Queue(maxsize=inbox_size)
+        self._ingest_thread: Optional[threading.Thread] = None
+
+    def add_rule(self, rule: Rule):
+        self.rules.setdefault(rule.metric, []).append(rule)
+
+    def observe(self, host: str, timestamp: float, values: Dict[str, float]):
+        with self._lock:
+            for metric, value in values.items():
+                if value is None or value != value:  # NaN — нет данных
+                    continue
+                for rule in self.rules.get(metric, ()):
+                    if rule.hosts is not None and host not in rule.hosts:
+                        continue
+                    state = self._states.get((rule, host))
+                    if state is None:
+                        state = self._states[(rule, host)] = _RuleState()
+                    score = rule.score(state.data, timestamp, value)
+                    if score is None:
+                        continue
+                    if not state.firing:
+                        state.streak = state.streak + 1 if rule.breached(score) else 0
+                        if state.streak >= rule.for_samples:
+                            state.firing, state.since = True, timestamp
+                            self._notify(Alert(rule.name, rule.kind, host, metric, 'firing', value, score, timestamp))
+                    elif rule.cleared(score):
+                        state.firing, state.streak, state.since = False, 0, None
+                        self._notify(Alert(rule.name, rule.kind, host, metric, 'resolved', value, score, timestamp))
+
+    def submit(self, host: str, columns: List[str], rows: List[list]) -> bool:
+        """Поставить строки кадра [timestamp, *values] в очередь на проверку.
+
+        Не ждёт: если очередь полна, кадр отбрасывается (dropped_frames)
+        и возвращается False.
+        """
+        try:
+            self._inbox.put_nowait((host, columns, rows))
+        except queue.Full:
+            self.dropped_frames += 1
+            return False
+        if self._ingest_thread is None:
+            self._ingest_thread = threading.Thread(target=self._ingest, name='alert-ingest', daemon=True)
+            self._ingest_thread.start()
+        return True
+
+    def _ingest(self):
+        while True:
+            host, columns, rows = self._inbox.get()
+            try:
+                for timestamp, *values in rows:
+                    self.observe(host, timestamp, dict(zip(columns, values)))
+            except Exception:
+                logger.exception('Не удалось проверить правила для кадра %s', host)
+            self._inbox.task_done()
+
+    def active(self) -> List[dict]:
+        with self._lock:
+            return [{'rule': rule.name, 'host': host, 'since': state.since}
+                    for (rule, host), state in self._states.items() if state.firing]
+
+    def _notify(self, alert: Alert):
+        self.history.append(alert)
+        try:
+            self._queue.put_nowait(alert)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='alert-notifier', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            alert = self._queue.get()
+            for sink in self.sinks:
+                try:
+                    sink(alert)
+                except Exception:
+                    logger.exception('Не удалось отправить уведомление')
+            self._queue.task_done()
+
+    def flush(self):
+        """Дождаться проверки принятых кадров и доставки всех уведомлений."""
+        self._inbox.join()
+        self._queue.join()
+
+
+def log_sink(alert: Alert):
+    level = logging.WARNING if alert.state == 'firing' else logging.INFO
+    logger.log(level, 'Тревога %s [%s] на %s: %s = %.2f (score %.2f)',
+               alert.rule, alert.state, alert.host, alert.metric, alert.value, alert.score)
+
+
+class WebhookSink:
+    """POST уведомления в виде JSON на url."""
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self, alert: Alert):
+        request = urllib.request.Request(self.url, data=json.dumps(alert._asdict()).encode(), method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+def load_rules(path: Optional[str] = RULES_FILE) -> List[Rule]:
+    if not path:
+        return list(DEFAULT_RULES)
+    with open(path, encoding='utf-8') as f:
+        return [rule_from_dict(data) for data in json.load(f)]
+
+
+HOSTNAME = socket.gethostname()
+
+
+def sample_values(sample) -> Dict[str, float]:
+    return {'cpu': sample.cpu_total, 'ram': sample.memory.percent, 'disk_usage': sample.disk.percent,
+            'bytes_sent': sample.upload_speed, 'bytes_recv': sample.download_speed}
+
+
+# Общий движок: замеры этой машины и кадры агентов парка
+engine = AlertEngine(load_rules(), [log_sink] + ([WebhookSink(WEBHOOK_URL)] if WEBHOOK_URL else []))
+sampler.subscribe(lambda sample: engine.observe(HOSTNAME, sample.timestamp, sample_values(sample)))
@@ -1,103 +1,145 @@
-from dash import Dash, Output, Input, html, dcc
-import pandas as pd
-import plotly.express as px
+from dash import Dash, Output, Input, State, html, dcc, no_update
+import plotly.graph_objects as go
 import psutil
-import numpy as np
 import platform
 import time
+import json
+import urllib.request
+from datetime import datetime
+
+from history import HistoryBuffer
+import fleet
+from processes import tracker
+from sampler import sampler
+from tsdb import metrics_store
 
 app = Dash(__name__)
 
 CPU_COUNT = psutil.cpu_count()
 
-# Инициализация DataFrame с историей значений CPU, RAM, диска и сети
-history = pd.DataFrame()
-for i in range(CPU_COUNT):
-    history[f'cpu{i + 1}'] = [np.nan] * 100
-history['ram'] = [np.nan] * 100
-history['disk_usage'] = [np.nan] * 100
-history['bytes_sent'] = [np.nan] * 100
-history['bytes_recv'] = [np.nan] * 100
+# Дашборд рисует сырой уровень общего хранилища истории
+history = metrics_store.raw
 
-prev_bytes_sent = psutil.net_io_counters().bytes_sent
-prev_bytes_recv = psutil.net_io_counters().bytes_recv
-prev_time = time.time()
+sampler.start()
+tracker.start()
+
+# Графики: заголовок и колонки истории (для CPU колонки зависят от выбранных ядер)
+GRAPHS = {
+    'graph_cpu': ('График загрузки процессора (CPU)', None),
+    'graph_memory': ('График использования RAM', ['ram']),
+    'graph_disk': ('График использования диска', ['disk_usage']),
+    'graph_network': ('Сетевая активность', ['bytes_sent', 'bytes_recv']),
+}
+
+
+def cpu_columns(selected_cpus):
+    return [f'cpu{i + 1}' for i in range(CPU_COUNT) if str(i + 1) in selected_cpus]
+
+
+def to_datetimes(timestamps):
+    return [datetime.fromtimestamp(ts) for ts in timestamps]
+
+
+def build_figure(graph_id, selected_cpus, snapshot=None, upto=None):
+    """Полный график по накопленной истории — только при загрузке страницы
+    или смене набора ядер.
+
+    snapshot — снимок истории (по умолчанию свежий), upto — сколько
+    замеров уже учтено у клиента: график строится ровно по ним, чтобы
+    следующие тики дописали остальные точки без пропусков и повторов.
+    """
+    title, columns = GRAPHS[graph_id]
+    columns = columns or cpu_columns(selected_cpus)
+    count, timestamps, rows = snapshot or history.snapshot()
+    upto = count if upto is None else min(upto, count)
+    start = history.depth - min(count, history.depth)
+    end = history.depth - (count - upto)
+    x = to_datetimes(timestamps[start:end])
+    figure = go.Figure([go.Scatter(x=x, y=rows[start:end, history.columns.index(column)],
+                                   name=column, mode='lines', line_shape='spline')
+                        for column in columns])
+    figure.update_layout(title_text=title, uirevision=graph_id)
+    if graph_id == 'graph_network':
+        figure.update_layout(yaxis_title='Скорость (Б/с)', legend_title='Тип данных')
+    return figure
+
+
+def extend_data(graph_id, selected_cpus, x, rows, max_points=None):
+    """Только новые точки для Graph.extendData: x и rows — новые строки снимка истории.
+
+    max_points ограничивает длину рядов на клиенте (по умолчанию глубина
+    истории); max_points=len(rows) заменяет ряды целиком.
+    """
+    _, columns = GRAPHS[graph_id]
+    columns = columns or cpu_columns(selected_cpus)
+    indexes = [history.columns.index(column) for column in columns]
+    return (dict(x=[x] * len(columns), y=[rows[:, i].tolist() for i in indexes]),
+            list(range(len(columns))), max_points or history.depth)
+
+
+# Длинные диапазоны берутся из минутных и часовых агрегатов
+# и прореживаются до HISTORY_POINTS точек
+HISTORY_RANGES = {
+    '1h': ('Последний час', 3600),
+    '1d': ('Последние сутки', 24 * 3600),
+    '7d': ('Последняя неделя', 7 * 24 * 3600),
+    '30d': ('Последние 30 дней', 30 * 24 * 3600),
+}
+HISTORY_POINTS = 500
+
+
+def update_history_figure(n, range_key, metric):
+    _, seconds = HISTORY_RANGES[range_key]
+    end = time.time()
+    series = metrics_store.query(metric, start=end - seconds, end=end, max_points=HISTORY_POINTS)
+    figure = go.Figure([go.Scatter(x=to_datetimes(series['timestamps']), y=series['values'],
+                                   name=metric, mode='lines')])
+    figure.update_layout(title_text=f"История: {metric} (разрешение: {series['resolution']})",
+                         uirevision=f'{range_key}:{metric}')
+    return figure
+
+
+# Процессы, больше всего нагружающие систему
+PROCESS_COLUMNS = ['PID', 'Процесс', 'CPU, %', 'RSS, MB', 'Ввод-вывод, КБ/с']
 
-# Определение callback функции для обновления данных и построения графиков
-def register_callbacks(app):
-    @app.callback(
-        Output("status", "children"),
-        Output('graph_cpu', 'figure'),
-        Output('cpu_info', 'children'),
-        Output('graph_memory', 'figure'),
-        Output('ram_info', 'children'),
-        Output('graph_disk', 'figure'),
-        Output('disk_info', 'children'),  # Добавлено для информации о диске
-        Output('graph_network', 'figure'),
-        Output("network_speeds", "children"),
-        Input("timer", "n_intervals"),
-        Input('cpu_checklist', 'value')  # Добавляем input для checklist
-    )
-    def update_status(n, selected_cpus):
-        global history, prev_bytes_sent, prev_bytes_recv, prev_time
-
-        # Получаем текущие данные о системе
-        cpu = psutil.cpu_percent(percpu=True)
-        ram = psutil.virtual_memory()
-        disk = psutil.disk_usage('/')
-        net_io = psutil.net_io_counters()
-
-        current_time = time.time()
-        elapsed_time = current_time - prev_time
-
-        # Подсчет скорости передачи данных в сети
-        upload_speed = (net_io.bytes_sent - prev_bytes_sent) / elapsed_time
-        download_speed = (net_io.bytes_recv - prev_bytes_recv) / elapsed_time
-
-        # Обновляем предыдущие значения
-        prev_bytes_sent = net_io.bytes_sent
-        prev_bytes_recv = net_io.bytes_recv
-        prev_time = current_time
-
-        # Обновление истории данных
-        history = history.shift(periods=-1)
-        history.iloc[-1, :CPU_COUNT] = cpu
-        history.iloc[-1, CPU_COUNT] = ram.percent
-        history.iloc[-1, CPU_COUNT + 1] = disk.percent  # Обновляем данные о диске
-        history.iloc[-1, CPU_COUNT + 2] = upload_speed
-        history.iloc[-1, CPU_COUNT + 3] = download_speed
-
-        # Создание графиков
-        fig_cpu = px.line(history.reset_index(), x=history.index, y=[f'cpu{i + 1}' for i in range(CPU_COUNT) if str(i + 1) in selected_cpus],
-                          line_shape='spline')
-        fig_cpu.update_layout(title_text='График загрузки процессора (CPU)')
-
-        fig_memory = px.line(history.reset_index(), x=history.index, y=['ram'], line_shape='spline')
-        fig_memory.update_layout(title_text='График использования RAM')
-
-        # График использования диска
-        fig_disk = px.line(history.reset_index(), x=history.index, y=['disk_usage'], line_shape='spline')
-        fig_disk.update_layout(title_text='График использования диска')
-
-        # График сетевой активности
-        fig_network = px.line(history.reset_index(), x=history.index, y=['bytes_sent', 'bytes_recv'], line_shape='spline',
-                              labels={'value': 'Скорость (Б/с)', 'variable': 'Тип данных'}, title='Сетевая активность')
-
-        # Текстовые данные о скорости сети
-        network_speeds_text = f"""
-            Скорость отправки: {upload_speed:.2f} Б/с
-            Скорость загрузки: {download_speed:.2f} Б/с
-        """
 
-        # Информация о процессоре
-        cpu_info = {
-            "Производитель": platform.processor(),
-            "Архитектура": platform.architecture()[0],
-            "Частота": f"{psutil.cpu_freq().max:.2f} MHz" if psutil.cpu_freq() else "N/A",
-            "Количество ядер": CPU_COUNT
-        }
+def update_processes(n, sort):
+    rows = [html.Tr([html.Td(stat.pid), html.Td(stat.name), html.Td(f'{stat.cpu_percent:.1f}'),
+                     html.Td(f'{stat.rss / 1024 ** 2:.1f}'), html.Td(f'{stat.io_rate / 1024:.1f}')])
+            for stat in tracker.top(10, sort)]
+    return html.Table([html.Tr([html.Th(column) for column in PROCESS_COLUMNS]), *rows])
 
-        cpu_info_text = f"""
+
+# Сводка по парку с центрального коллектора (если задан MONITOR_COLLECTOR_URL)
+def update_fleet(n):
+    if not fleet.COLLECTOR_URL:
+        return "Коллектор не настроен"
+    request = urllib.request.Request(fleet.COLLECTOR_URL.rstrip('/') + '/fleet',
+                                     headers={'Authorization': fleet.auth_header(fleet.COLLECTOR_AUTH)})
+    try:
+        with urllib.request.urlopen(request, timeout=2) as response:
+            summary = json.loads(response.read())
+    except OSError as e:
+        return f"Коллектор недоступен: {e}"
+    ram = summary['rollups']['ram']
+    cpu = summary['rollups']['cpu']
+    header = html.Div(f"Машин на связи: {summary['online']} из {summary['hosts']}"
+                      + (f"; CPU в среднем {cpu['mean']:.1f}%, p95 RAM {ram['p95']:.1f}%" if cpu and ram else ''))
+    rows = [html.Tr([html.Td(host['host']), html.Td(f"{host['cpu']:.1f}")]) for host in summary['top_cpu']]
+    return [header, html.Table([html.Tr([html.Th('Машина'), html.Th('CPU, %')]), *rows])]
+
+
+# Информация о процессоре не меняется, поэтому считается один раз
+def cpu_info_text():
+    cpu_freq = psutil.cpu_freq()
+    cpu_info = {
+        "Производитель": platform.processor(),
+        "Архитектура": platform.architecture()[0],
+        "Частота": f"{cpu_freq.max:.2f} MHz" if cpu_freq else "N/A",
+        "Количество ядер": CPU_COUNT
+    }
+
+    return f"""
             Информация о процессоре:
                 Производитель: {cpu_info['Производитель']}
                 Архитектура: {cpu_info['Архитектура']}
@@ -105,8 +147,55 @@ def register_callbacks(app):
                 Количество ядер: {cpu_info['Количество ядер']}
         """
 
-        # Информация о RAM
-        ram_info_text = f"""
+
+# Каждую секунду клиенту уходят только новые точки графиков (extendData),
+# а не четыре полных графика со всей историей
+def update_status(n, last_count, selected_cpus):
+    # Один снимок на тик: все графики и счётчик получают одни и те же строки
+    count, timestamps, rows = history.snapshot()
+    last_count = last_count or 0
+    # У клиента больше замеров, чем в истории, — сервер перезапущен:
+    # ряды графиков заменяются всей текущей историей
+    resync = count < last_count
+    new_rows = min(count if resync else count - last_count, history.depth)
+    upload_speed, download_speed = rows[-1][-2:]
+
+    # Текстовые данные о скорости сети: сумма и по интерфейсам
+    # (сглаженные значения общего расчёта сборщика)
+    latest = sampler.buffer.latest()
+    rates = latest.net_rates if latest is not None else None
+    interfaces = ''.join(f"""
+                {name}: отправка {rate.sent_smoothed:.2f} Б/с, загрузка {rate.recv_smoothed:.2f} Б/с"""
+                         for name, rate in sorted((rates or {}).items()))
+    network_speeds_text = f"""
+            Скорость отправки: {upload_speed:.2f} Б/с
+            Скорость загрузки: {download_speed:.2f} Б/с{interfaces}
+        """
+
+    if new_rows <= 0:
+        return f"Интервалы: {n}", no_update, no_update, no_update, no_update, network_speeds_text, no_update
+    x = to_datetimes(timestamps[-new_rows:])
+    max_points = new_rows if resync else None
+    extends = [extend_data(graph_id, selected_cpus, x, rows[-new_rows:], max_points) for graph_id in GRAPHS]
+    return (f"Интервалы: {n}", *extends, network_speeds_text, count)
+
+
+# График CPU перестраивается по тем же замерам, что уже есть у клиента
+# (last_count), иначе следующий тик продублировал бы новые точки
+def update_cpu_figure(selected_cpus, last_count):
+    return build_figure('graph_cpu', selected_cpus, upto=last_count)
+
+
+# Объём памяти и диска меняется медленно — обновляется по отдельному таймеру
+def update_info(n):
+    sample = sampler.latest()
+    if sample is None:  # сборщик ещё не снял замер
+        return "Нет данных о памяти", "Нет данных о диске"
+    ram = sample.memory
+    disk = sample.disk
+
+    # Информация о RAM
+    ram_info_text = f"""
             Информация об оперативной памяти:
                 Всего памяти: {ram.total / (1024 ** 3):.2f} GB
                 Использовано памяти: {ram.used / (1024 ** 3):.2f} GB
@@ -114,8 +203,8 @@ def register_callbacks(app):
                 Процент использования: {ram.percent}%
         """
 
-        # Информация о диске
-        disk_info_text = f"""
+    # Информация о диске
+    disk_info_text = f"""
             Информация о диске:
                 Всего пространства: {disk.total / (1024 ** 3):.2f} GB
                 Использовано: {disk.used / (1024 ** 3):.2f} GB
@@ -123,29 +212,96 @@ def register_callbacks(app):
                 Процент использования: {disk.percent}%
         """
 
-        return f"Интервалы: {n}", fig_cpu, cpu_info_text, fig_memory, ram_info_text, fig_disk, disk_info_text, fig_network, network_speeds_text
+    return ram_info_text, disk_info_text
+
+
+# Определение callback функций для обновления данных и построения графиков
+def register_callbacks(app):
+    app.callback(
+        Output("status", "children"),
+        Output('graph_cpu', 'extendData'),
+        Output('graph_memory', 'extendData'),
+        Output('graph_disk', 'extendData'),
+        Output('graph_network', 'extendData'),
+        Output("network_speeds", "children"),
+        Output('last_count', 'data'),
+        Input("timer", "n_intervals"),
+        State('last_count', 'data'),
+        State('cpu_checklist', 'value')
+    )(update_status)
+    app.callback(
+        Output('graph_cpu', 'figure'),
+        Input('cpu_checklist', 'value'),
+        State('last_count', 'data'),
+        prevent_initial_call=True
+    )(update_cpu_figure)
+    app.callback(
+        Output('ram_info', 'children'),
+        Output('disk_info', 'children'),
+        Input('info_timer', 'n_intervals')
+    )(update_info)
+    app.callback(
+        Output('process_table', 'children'),
+        Input('info_timer', 'n_intervals'),
+        Input('process_sort', 'value')
+    )(update_processes)
+    app.callback(
+        Output('fleet_panel', 'children'),
+        Input('info_timer', 'n_intervals')
+    )(update_fleet)
+    app.callback(
+        Output('graph_history', 'figure'),
+        Input('history_timer', 'n_intervals'),
+        Input('history_range', 'value'),
+        Input('history_metric', 'value')
+    )(update_history_figure)
 
 register_callbacks(app)
 
-# Макет приложения
-app.layout = html.Div([
-    html.Div(id="status"),
-    dcc.Checklist(
-        id='cpu_checklist',
-        options=[{'label': f'Ядро {i + 1}', 'value': str(i + 1)} for i in range(CPU_COUNT)],
-        value=[str(i + 1) for i in range(CPU_COUNT)],  # По умолчанию отображаем все ядра
-        inline=True
-    ),
-    dcc.Graph(id='graph_cpu'),
-    html.Div(id='cpu_info'),
-    dcc.Graph(id='graph_memory'),
-    html.Div(id='ram_info'),
-    dcc.Graph(id='graph_disk'),  # Добавлен график диска
-    html.Div(id='disk_info'),  # Добавлен блок для информации о диске
-    dcc.Graph(id='graph_network'),
-    html.Div(id="network_speeds"),
-    dcc.Interval(id='timer', interval=1000)  # Обновление каждую секунду
-])
+CPU_INFO_TEXT = cpu_info_text()
+
+
+# Макет строится при каждой загрузке страницы, чтобы графики сразу
+# содержали накопленную историю
+def serve_layout():
+    selected_cpus = [str(i + 1) for i in range(CPU_COUNT)]  # По умолчанию отображаем все ядра
+    # Один снимок на все графики и счётчик: замеры, пришедшие во время
+    # построения, клиент получит следующим тиком
+    snapshot = history.snapshot()
+    return html.Div([
+        html.Div(id="status"),
+        dcc.Checklist(
+            id='cpu_checklist',
+            options=[{'label': f'Ядро {i + 1}', 'value': str(i + 1)} for i in range(CPU_COUNT)],
+            value=selected_cpus,
+            inline=True
+        ),
+        dcc.Graph(id='graph_cpu', figure=build_figure('graph_cpu', selected_cpus, snapshot)),
+        html.Div(CPU_INFO_TEXT, id='cpu_info'),
+        dcc.Graph(id='graph_memory', figure=build_figure('graph_memory', selected_cpus, snapshot)),
+        html.Div(id='ram_info'),
+        dcc.Graph(id='graph_disk', figure=build_figure('graph_disk', selected_cpus, snapshot)),
+        html.Div(id='disk_info'),
+        dcc.Graph(id='graph_network', figure=build_figure('graph_network', selected_cpus, snapshot)),
+        html.Div(id="network_speeds"),
+        dcc.RadioItems(id='process_sort', value='cpu', inline=True,
+                       options=[{'label': 'По CPU', 'value': 'cpu'}, {'label': 'По памяти', 'value': 'rss'},
+                                {'label': 'По вводу-выводу', 'value': 'io'}]),
+        html.Div(id='process_table'),
+        html.Div(id='fleet_panel'),
+        dcc.Dropdown(id='history_range', value='1d', clearable=False,
+                     options=[{'label': label, 'value': key} for key, (label, _) in HISTORY_RANGES.items()]),
+        dcc.Dropdown(id='history_metric', value='ram', clearable=False,
+                     options=[{'label': column, 'value': column} for column in metrics_store.columns]),
+        dcc.Graph(id='graph_history'),
+        dcc.Store(id='last_count', data=snapshot[0]),  # сколько замеров уже есть у клиента
+        dcc.Interval(id='timer', interval=1000),  # Обновление каждую секунду
+        dcc.Interval(id='info_timer', interval=10_000),
+        dcc.Interval(id='history_timer', interval=60_000)  # агрегаты меняются раз в минуту
+    ])
+
+
+app.layout = serve_layout
 
 
 if __name__ == '__main__':
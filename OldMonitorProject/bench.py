@@ -0,0 +1,224 @@
+"""Замеры производительности монитора.
+
+Запуск из каталога OldMonitorProject, например::
+
+    python bench.py tick --depths 100 3600
+    python bench.py archive --rows 2592000
+    python bench.py alerts --rules 1000 --hosts 100
+    python bench.py metrics --routes 20 --hosts 100
+    python bench.py profiling --repeat 2000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+
+def timed(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_tick(depths, repeat: int):
+    """Время сервера и объём ответа на один тик дашборда:
+    пересборка четырёх графиков целиком против extendData."""
+    import pandas as pd
+    import plotly
+    import plotly.express as px
+
+    import app
+
+    def encode(outputs):
+        return json.dumps(outputs, cls=plotly.utils.PlotlyJSONEncoder)
+
+    selected = [str(i + 1) for i in range(app.CPU_COUNT)]
+    print(f"{'depth':>7} {'rebuild ms':>11} {'rebuild B':>10} {'extend ms':>10} {'extend B':>9}")
+    for depth in depths:
+        app.history = app.HistoryBuffer(app.history.columns, depth)
+        now = time.time()
+        for i in range(depth):
+            app.history.append(now - depth + i, np.random.rand(len(app.history.columns)) * 100)
+
+        def rebuild():
+            frame = pd.DataFrame(app.history.view(), columns=app.history.columns)
+            figures = [
+                px.line(frame.reset_index(), x=frame.index, y=app.cpu_columns(selected), line_shape='spline'),
+                px.line(frame.reset_index(), x=frame.index, y=['ram'], line_shape='spline'),
+                px.line(frame.reset_index(), x=frame.index, y=['disk_usage'], line_shape='spline'),
+                px.line(frame.reset_index(), x=frame.index, y=['bytes_sent', 'bytes_recv'], line_shape='spline'),
+            ]
+            return encode(figures)
+
+        def extend():
+            return encode(app.update_status(1, app.history.count - 1, selected)[1:5])
+
+        print(f'{depth:>7} {timed(rebuild, repeat) * 1000:>11.2f} {len(rebuild()):>10} '
+              f'{timed(extend, repeat) * 1000:>10.3f} {len(extend()):>9}')
+
+
+def bench_archive(rows: int, columns: int):
+    """Запись rows замеров в сегменты, время открытия архива и сканов."""
+    import tempfile
+
+    from segments import SegmentStore
+
+    names = [f'c{i}' for i in range(columns)]
+    with tempfile.TemporaryDirectory() as directory:
+        store = SegmentStore(directory, names, retention=float('inf'))
+        row = np.random.rand(columns)
+        start = time.perf_counter()
+        for i in range(rows):
+            store.append(1_700_000_000 + i, row)
+        store.close()
+        write = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store = SegmentStore(directory, names, retention=float('inf'))
+        opened = time.perf_counter() - start
+
+        day = (1_700_000_000 + rows - 86_400, 1_700_000_000 + rows)
+        scan = timed(lambda: store.scan(*day), 20)
+        column = timed(lambda: store.column('c0', *day), 20)
+        print(f'rows={rows} segments={len(store.segments)} write={rows / write:,.0f} rows/s '
+              f'open={opened * 1000:.2f} ms scan(1d)={scan * 1000:.3f} ms column(1d)={column * 1000:.2f} ms')
+        store.close()
+
+
+def bench_alerts(rules: int, hosts: int, samples: int):
+    """Проверка rules правил на замерах hosts машин."""
+    from alerts import AlertEngine, RateRule, Rule, ZScoreRule
+
+    metrics = ['cpu', 'ram', 'disk_usage', 'bytes_sent', 'bytes_recv']
+    kinds = [lambda i: Rule(f'r{i}', metrics[i % 5], 90 + i % 10, clear=80),
+             lambda i: RateRule(f'r{i}', metrics[i % 5], 50, clear=10),
+             lambda i: ZScoreRule(f'r{i}', metrics[i % 5], 4, clear=2, window=60)]
+    engine = AlertEngine([kinds[i % 3](i) for i in range(rules)])
+    values = np.random.rand(samples, len(metrics)) * 100
+    start = time.perf_counter()
+    for i, row in enumerate(values):
+        engine.observe(f'host-{i % hosts}', float(i // hosts), dict(zip(metrics, row.tolist())))
+    elapsed = time.perf_counter() - start
+    print(f'rules={rules} hosts={hosts} samples={samples} '
+          f'{elapsed / samples * 1e6:.1f} us/sample {elapsed / samples / rules * 1e9:.0f} ns/rule '
+          f'alerts={len(engine.history)}')
+
+
+def bench_metrics(routes: int, hosts: int, repeat: int):
+    """Время отрисовки /metrics: routes маршрутов по три статуса и hosts машин парка."""
+    import fleet
+    import metrics
+    from sampler import sampler
+
+    requests = metrics.RequestMetrics()
+    for i in range(routes):
+        for status in (200, 404, 500):
+            for seconds in np.random.rand(100).tolist():
+                requests.observe('GET', f'/route/{i}/{{id}}', status, seconds)
+    store = fleet.FleetStore()
+    now = time.time()
+    for i in range(hosts):
+        store.ingest({'host': f'host-{i:04d}', 'rows': [[now, *np.random.rand(len(fleet.COLUMNS)).tolist()]]})
+    sample = sampler.latest()
+    host = metrics.HostMetrics()
+
+    def render():
+        return metrics.render(host.lines(sample), requests.render(metrics.HTTP_PREFIX),
+                              metrics.fleet_metrics(store, fleet.COLUMNS))
+
+    lines = render().count('\n')
+    print(f'routes={routes} hosts={hosts} lines={lines} '
+          f'render={timed(render, repeat) * 1e3:.3f} ms '
+          f'host={timed(lambda: metrics.host_metrics(sample), repeat) * 1e6:.0f} us (uncached) '
+          f'requests={timed(lambda: requests.render(metrics.HTTP_PREFIX), repeat) * 1e3:.3f} ms '
+          f'fleet={timed(lambda: metrics.fleet_metrics(store, fleet.COLUMNS), repeat) * 1e3:.3f} ms')
+
+
+def profiled_copy(app):
+    """Те же маршруты и прослойки, что у app, плюс профилирование."""
+    from fastapi import FastAPI
+    from fastapi.routing import APIRoute
+
+    import profiling
+
+    copy = FastAPI()
+    copy.router.route_class = profiling.ProfiledRoute
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            copy.add_api_route(route.path, route.endpoint, response_model=route.response_model,
+                               methods=route.methods, name=route.name)
+    copy.user_middleware = list(app.user_middleware)
+    copy.add_middleware(profiling.ProfilingMiddleware, profiler=profiling.RequestProfiler())
+    return copy
+
+
+def bench_profiling(repeat: int):
+    """Задержка запросов API без профилирования и с ним.
+
+    Запросы идут прямо в ASGI-приложения, без HTTP и тестового клиента,
+    чтобы накладные расходы не терялись на фоне транспорта. Приложения
+    обслуживают запросы по очереди, сравниваются медианы — так дрейф
+    общей машины почти не влияет на результат.
+    """
+    from fleet import COLLECTOR_AUTH, auth_header
+    from fastapi_server import app
+
+    apps = {'off': app, 'on': profiled_copy(app)}
+    headers = [(b'host', b'bench'), (b'authorization', auth_header(COLLECTOR_AUTH).encode())]
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        pass
+
+    def scope(path):
+        return {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+                'root_path': '', 'headers': headers, 'client': ('127.0.0.1', 1), 'server': ('bench', 80)}
+
+    async def run():
+        print(f"{'request':<16} {'off us':>8} {'on us':>8} {'overhead':>9}")
+        for path in ('/cpu', '/memory', '/history/ram'):
+            times = {name: [] for name in apps}
+            for i in range(repeat + repeat // 10):
+                for name, asgi in apps.items():
+                    start = time.perf_counter()
+                    await asgi(scope(path), receive, send)
+                    if i >= repeat // 10:  # прогрев
+                        times[name].append(time.perf_counter() - start)
+            off, on = (sorted(times[name])[len(times[name]) // 2] for name in ('off', 'on'))
+            print(f'{path:<16} {off * 1e6:>8.1f} {on * 1e6:>8.1f} {(on / off - 1) * 100:>8.1f}%')
+
+    asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('benchmark', choices=['tick', 'archive', 'alerts', 'metrics', 'profiling'])
+    parser.add_argument('--depths', type=int, nargs='+', default=[100, 3600])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--rows', type=int, default=604_800)
+    parser.add_argument('--columns', type=int, default=20)
+    parser.add_argument('--rules', type=int, default=1000)
+    parser.add_argument('--hosts', type=int, default=100)
+    parser.add_argument('--samples', type=int, default=10_000)
+    parser.add_argument('--routes', type=int, default=20)
+    args = parser.parse_args()
+    if args.benchmark == 'tick':
+        bench_tick(args.depths, args.repeat)
+    elif args.benchmark == 'archive':
+        bench_archive(args.rows, args.columns)
+    elif args.benchmark == 'alerts':
+        bench_alerts(args.rules, args.hosts, args.samples)
+    elif args.benchmark == 'metrics':
+        bench_metrics(args.routes, args.hosts, args.repeat * 10)
+    elif args.benchmark == 'profiling':
+        bench_profiling(args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import Counter
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, NamedTuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from sampler import SAMPLE_INTERVAL
+
+# Время жизни ответа (секунды); по умолчанию совпадает с интервалом опроса
+CACHE_TTL = float(os.environ.get('MONITOR_CACHE_TTL', str(SAMPLE_INTERVAL)))
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    last_modified: float  # когда содержимое последний раз менялось
+    bucket: int
+
+
+def encode(content) -> bytes:
+    # Так же, как JSONResponse в FastAPI
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(',', ':')).encode('utf-8')
+
+
+class ResponseCache:
+    """Готовые JSON-ответы эндпоинтов, по одному на интервал ttl.
+
+    Ответ действует до конца своего интервала времени, поэтому все клиенты
+    в пределах интервала получают одни и те же байты без обращения к psutil
+    и без сериализации. Одновременные промахи по одному ключу ждут одно
+    вычисление; оно идёт отдельной задачей, так что отмена запроса,
+    который его начал (клиент отключился), не задевает остальных. ETag — хеш тела, Last-Modified — момент, когда тело
+    последний раз изменилось, так что условный запрос получает 304.
+    """
+
+    def __init__(self, ttl: float = CACHE_TTL):
+        self.ttl = ttl
+        self._entries: Dict[str, CachedResponse] = {}
+        self._pending: Dict[str, asyncio.Task] = {}
+        self.stats: Dict[str, Counter] = {}
+
+    def _count(self, key: str, event: str):
+        self.stats.setdefault(key, Counter())[event] += 1
+
+    async def get(self, key: str, compute: Callable[[], Awaitable]) -> CachedResponse:
+        bucket = int(time.time() // self.ttl) if self.ttl > 0 else None
+        entry = self._entries.get(key)
+        if entry is not None and bucket is not None and entry.bucket == bucket:
+            self._count(key, 'hits')
+            return entry
+        pending = self._pending.get(key)
+        if pending is not None:
+            self._count(key, 'hits')
+        else:
+            self._count(key, 'misses')
+            pending = self._pending[key] = asyncio.ensure_future(self._compute(key, compute, entry, bucket))
+            # Ошибку получают ждущие запросы; если все они отменены, не логировать её как потерянную
+            pending.add_done_callback(lambda task: task.cancelled() or task.exception())
+        # Отмена вызывающего снимает только его ожидание, не общее вычисление
+        return await asyncio.shield(pending)
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable], entry, bucket) -> CachedResponse:
+        try:
+            body = encode(await compute())
+            etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+            last_modified = entry.last_modified if entry is not None and entry.etag == etag else time.time()
+            entry = CachedResponse(body, etag, last_modified, bucket)
+            self._entries[key] = entry
+            return entry
+        finally:
+            del self._pending[key]
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """Счётчики попаданий, промахов и ответов 304 по эндпоинтам."""
+        return {key: {'hits': counter['hits'], 'misses': counter['misses'],
+                      'not_modified': counter['not_modified']}
+                for key, counter in self.stats.items()}
+
+    async def respond(self, request: Request, key: str, compute: Callable[[], Awaitable]) -> Response:
+        entry = await self.get(key, compute)
+        headers = {
+            'ETag': entry.etag,
+            'Last-Modified': formatdate(entry.last_modified, usegmt=True),
+            'Cache-Control': 'no-cache',
+        }
+        if not_modified(request, entry):
+            self._count(key, 'not_modified')
+            return Response(status_code=304, headers=headers)
+        return Response(entry.body, media_type='application/json', headers=headers)
+
+
+def not_modified(request: Request, entry: CachedResponse) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        return entry.etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')] \
+            or if_none_match.strip() == '*'
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(entry.last_modified) <= since
+    return False
+
+
+response_cache = ResponseCache()
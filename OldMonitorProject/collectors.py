@@ -0,0 +1,149 @@
+import asyncio
+import inspect
+import math
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+
+import psutil
+
+from sampler import sampler
+
+# Число потоков для блокирующих вызовов psutil и таймауты (секунды):
+# на один раздел диска и на сбор одной подсистемы целиком
+WORKERS = int(os.environ.get('MONITOR_COLLECTOR_WORKERS', '8'))
+PARTITION_TIMEOUT = float(os.environ.get('MONITOR_PARTITION_TIMEOUT', '0.5'))
+COLLECT_TIMEOUT = float(os.environ.get('MONITOR_COLLECT_TIMEOUT', '2.0'))
+
+# Ограниченный пул: зависший вызов psutil занимает поток пула,
+# а не поток обработки запросов
+executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='collector')
+
+# Незавершённые вызовы disk_usage по точкам монтирования. Пока вызов для
+# раздела не вернулся, новый не запускается, иначе зависшее сетевое
+# хранилище постепенно заняло бы все потоки пула
+_pending_usage: Dict[str, Future] = {}
+
+
+async def run(fn, *args, timeout: Optional[float] = COLLECT_TIMEOUT):
+    loop = asyncio.get_running_loop()
+    return await asyncio.wait_for(loop.run_in_executor(executor, fn, *args), timeout)
+
+
+class NoSample(Exception):
+    """Сборщик ещё не снял ни одного замера (например, сразу после запуска)."""
+
+
+def latest_sample():
+    sample = sampler.latest()
+    if sample is None:
+        raise NoSample("Нет ни одного замера")
+    return sample
+
+
+def cpu_info() -> dict:
+    sample = latest_sample()
+    return {
+        "cpu_percent": sample.cpu_percent,
+        "cpu_count": psutil.cpu_count(logical=True),
+        "cpu_freq": sample.cpu_freq
+    }
+
+
+def memory_info() -> dict:
+    memory = psutil.virtual_memory()
+    return {
+        "total": memory.total,
+        "used": memory.used,
+        "available": memory.available,
+        "percent": memory.percent
+    }
+
+
+def _finite(value: float) -> Optional[float]:
+    return None if math.isnan(value) else value
+
+
+def network_info() -> dict:
+    # Счётчики и скорости из последнего замера сборщика: число клиентов
+    # не влияет ни на показания, ни на число вызовов psutil
+    sample = latest_sample()
+    net_io = sample.net_io
+    return {
+        "bytes_sent": net_io.bytes_sent,
+        "bytes_recv": net_io.bytes_recv,
+        "packets_sent": net_io.packets_sent,
+        "packets_recv": net_io.packets_recv,
+        "upload_speed": _finite(sample.upload_speed),
+        "download_speed": _finite(sample.download_speed),
+        "interfaces": {name: rate._asdict() for name, rate in (sample.net_rates or {}).items()},
+    }
+
+
+def summary_info() -> dict:
+    sample = latest_sample()
+    return {
+        "cpu": sample.cpu_total,
+        "memory": sample.memory.percent,
+        "disk": sample.disk.percent,
+        "network": sample.net_io._asdict()
+    }
+
+
+async def partition_usage(mountpoint: str):
+    future = _pending_usage.get(mountpoint)
+    if future is None:
+        future = executor.submit(psutil.disk_usage, mountpoint)
+        _pending_usage[mountpoint] = future
+        future.add_done_callback(lambda _: _pending_usage.pop(mountpoint, None))
+    try:
+        usage = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), PARTITION_TIMEOUT)
+    except PermissionError:
+        return "Доступ запрещён"
+    except (asyncio.TimeoutError, OSError):
+        return "Нет ответа"
+    return {
+        "total": usage.total,
+        "used": usage.used,
+        "free": usage.free,
+        "percent": usage.percent
+    }
+
+
+async def disk_info() -> dict:
+    # Разделы опрашиваются параллельно, у каждого свой таймаут
+    partitions = await run(psutil.disk_partitions)
+    usages = await asyncio.gather(*(partition_usage(partition.mountpoint) for partition in partitions))
+    return {partition.device: usage for partition, usage in zip(partitions, usages)}
+
+
+COLLECTORS = {
+    'cpu': cpu_info,
+    'memory': memory_info,
+    'disk': disk_info,
+    'network': network_info,
+    'summary': summary_info,
+}
+
+
+async def collect_one(name: str):
+    collector = COLLECTORS[name]
+    if inspect.iscoroutinefunction(collector):
+        return await collector()
+    return await run(collector)
+
+
+async def _collect_or_none(name: str):
+    try:
+        return await collect_one(name)
+    except (asyncio.TimeoutError, NoSample):
+        return None
+
+
+async def collect(names: Iterable[str]) -> dict:
+    """Собрать несколько подсистем одновременно. Подсистема, которая
+    не уложилась в таймаут или для которой ещё нет замера, возвращает
+    None, остальные не ждут её; прочие ошибки не скрываются."""
+    names = list(dict.fromkeys(names))
+    results = await asyncio.gather(*(_collect_or_none(name) for name in names))
+    return dict(zip(names, results))
@@ -1,74 +1,247 @@
-from fastapi import FastAPI, Depends
-from fastapi.responses import RedirectResponse
-import psutil
+import asyncio
+from typing import List, Literal, Optional
 
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, RedirectResponse, StreamingResponse
 
-from security import authorize
+
+import alerts
+import collectors
+import fleet
+import metrics
+import profiling
+from cache import response_cache
+from processes import tracker
+from security import TOKEN_TTL, authorize, issue_token
+from streaming import TOPICS, broadcaster
+from sampler import sampler
+from tsdb import AGGREGATES, metrics_store
 app = FastAPI()
+sampler.start()
+tracker.start()
+
+# Гистограммы задержек всех запросов для /metrics
+request_metrics = metrics.RequestMetrics()
+app.add_middleware(metrics.MetricsMiddleware, metrics=request_metrics)
+host_metrics = metrics.HostMetrics()
+
+# MONITOR_PROFILING=1: время каждого запроса по фазам (разбор и зависимости,
+# обработчик, сериализация) и медленные запросы со стеком; см. /admin/profile
+if profiling.ENABLED:
+    profiling.install(app, profiling.profiler)
+
+# Коллектор: история машин парка, присылающих кадры на /ingest
+fleet_store = fleet.FleetStore()
+
+# Режим агента: если задан адрес коллектора, замеры этой машины
+# отправляются туда кадрами
+if fleet.COLLECTOR_URL:
+    fleet.Agent(fleet.COLLECTOR_URL).start(sampler)
+
+
+# Короткоживущий токен для заголовка Authorization: Bearer вместо
+# повторной передачи логина и пароля
+@app.post("/token")
+async def create_token(username: str = Depends(authorize)):
+    return {"access_token": issue_token(username), "token_type": "bearer", "expires_in": TOKEN_TTL}
+
+
+# Блокирующие вызовы psutil выполняются в ограниченном пуле collectors,
+# поэтому цикл событий не ждёт медленные подсистемы. Пока у сборщика
+# нет ни одного замера, отвечаем 503
+async def collect_or_504(name: str):
+    try:
+        return await collectors.collect_one(name)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Сбор метрик не уложился в таймаут")
+    except collectors.NoSample:
+        raise HTTPException(status_code=503, detail="Нет данных: сборщик ещё не снял замер")
 
 
 # Пример API для получения информации о CPU с авторизацией
+# Загрузка CPU берётся из последнего замера фонового сборщика,
+# поэтому запрос не ждёт окно измерения
 @app.get("/cpu")
-def get_cpu_info(username: str = Depends(authorize)):
-    cpu_info = {
-        "cpu_percent": psutil.cpu_percent(interval=1, percpu=True),
-        "cpu_count": psutil.cpu_count(logical=True),
-        "cpu_freq": psutil.cpu_freq()._asdict() if psutil.cpu_freq() else None
-    }
-    return cpu_info
+async def get_cpu_info(username: str = Depends(authorize)):
+    return await collect_or_504('cpu')
+
+# Ответы /memory, /disk и /network кешируются на MONITOR_CACHE_TTL секунд:
+# в пределах интервала клиенты получают готовые байты, а при совпадении
+# ETag или Last-Modified — 304 без тела
+async def cached_or_504(request: Request, name: str):
+    try:
+        return await response_cache.respond(request, name, lambda: collectors.collect_one(name))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Сбор метрик не уложился в таймаут")
+    except collectors.NoSample:
+        raise HTTPException(status_code=503, detail="Нет данных: сборщик ещё не снял замер")
+
 
 # Пример API для получения информации о RAM с авторизацией
 @app.get("/memory")
-def get_memory_info(username: str = Depends(authorize)):
-    memory = psutil.virtual_memory()
-    memory_info = {
-        "total": memory.total,
-        "used": memory.used,
-        "available": memory.available,
-        "percent": memory.percent
-    }
-    return memory_info
+async def get_memory_info(request: Request, username: str = Depends(authorize)):
+    return await cached_or_504(request, 'memory')
 
-# Пример API для информации о дисках с авторизацией
+# Пример API для информации о дисках с авторизацией.
+# Разделы опрашиваются параллельно; раздел, не ответивший за
+# MONITOR_PARTITION_TIMEOUT, помечается "Нет ответа"
 @app.get("/disk")
-def get_disk_info(username: str = Depends(authorize)):
-    disk_partitions = psutil.disk_partitions()
-    disk_info = {}
-    for partition in disk_partitions:
-        try:
-            usage = psutil.disk_usage(partition.mountpoint)
-            disk_info[partition.device] = {
-                "total": usage.total,
-                "used": usage.used,
-                "free": usage.free,
-                "percent": usage.percent
-            }
-        except PermissionError:
-            disk_info[partition.device] = "Доступ запрещён"
-    return disk_info
+async def get_disk_info(request: Request, username: str = Depends(authorize)):
+    return await cached_or_504(request, 'disk')
 
 # Пример API для информации о сети с авторизацией
 @app.get("/network")
-def get_network_info(username: str = Depends(authorize)):
-    net_io = psutil.net_io_counters()
-    network_info = {
-        "bytes_sent": net_io.bytes_sent,
-        "bytes_recv": net_io.bytes_recv,
-        "packets_sent": net_io.packets_sent,
-        "packets_recv": net_io.packets_recv,
-    }
-    return network_info
+async def get_network_info(request: Request, username: str = Depends(authorize)):
+    return await cached_or_504(request, 'network')
+
+# Счётчики кеша ответов
+@app.get("/cache/stats")
+async def get_cache_stats(username: str = Depends(authorize)):
+    return response_cache.snapshot()
 
 # Общая сводка состояния системы с авторизацией
 @app.get("/summary")
-def get_system_summary(username: str = Depends(authorize)):
-    summary = {
-        "cpu": psutil.cpu_percent(interval=1),
-        "memory": psutil.virtual_memory().percent,
-        "disk": psutil.disk_usage('/').percent,
-        "network": psutil.net_io_counters()._asdict()
+async def get_system_summary(username: str = Depends(authorize)):
+    return await collect_or_504('summary')
+
+# Любой набор подсистем за один запрос, например /snapshot?include=cpu&include=disk.
+# Подсистемы собираются одновременно; не уложившаяся в таймаут возвращается как null
+@app.get("/snapshot")
+async def get_snapshot(include: Optional[List[Literal['cpu', 'memory', 'disk', 'network', 'summary']]] = Query(None),
+                       username: str = Depends(authorize)):
+    return await collectors.collect(include or collectors.COLLECTORS)
+
+# Топ-N процессов по CPU, памяти (RSS) или скорости ввода-вывода с авторизацией.
+# Список обновляется фоновым сборщиком раз в MONITOR_PROCESS_INTERVAL секунд
+@app.get("/processes")
+async def get_top_processes(n: int = Query(10, ge=1, le=1000),
+                            sort: Literal['cpu', 'rss', 'io'] = 'cpu',
+                            username: str = Depends(authorize)):
+    if tracker.timestamp is None:
+        await collectors.run(tracker.refresh, timeout=None)
+    return {
+        "timestamp": tracker.timestamp,
+        "processes": [stat._asdict() for stat in tracker.top(n, sort)],
     }
-    return summary
+
+# Поток замеров (Server-Sent Events) с авторизацией, например
+# /stream?topics=cpu. Все подписчики получают замеры одного фонового
+# сборщика; медленный клиент теряет старые сообщения, а не тормозит остальных
+HEARTBEAT_INTERVAL = 15
+
+
+@app.get("/stream")
+async def stream_metrics(topics: Optional[List[Literal['cpu', 'memory', 'disk', 'network', 'summary']]] = Query(None),
+                         limit: Optional[int] = Query(None, ge=1),
+                         username: str = Depends(authorize)):
+    subscription = broadcaster.subscribe(topics or TOPICS)
+
+    async def events():
+        sent = 0
+        try:
+            yield 'retry: 3000\n\n'
+            # limit — сколько замеров отдать до закрытия потока (для разовых клиентов)
+            while limit is None or sent < limit:
+                try:
+                    yield await subscription.get(HEARTBEAT_INTERVAL)
+                    sent += 1
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(events(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Список метрик, доступных в истории
+@app.get("/history")
+def get_history_metrics(username: str = Depends(authorize)):
+    return {"metrics": metrics_store.columns, "aggregates": list(AGGREGATES)}
+
+# История метрики за диапазон [start, end] (unix-время) с авторизацией.
+# Уровень хранения выбирается по длине диапазона, ряд прореживается до points точек
+@app.get("/history/{metric}")
+def get_metric_history(metric: str,
+                       start: Optional[float] = None,
+                       end: Optional[float] = None,
+                       points: int = Query(500, ge=3, le=10_000),
+                       agg: Literal['min', 'max', 'mean', 'last'] = 'mean',
+                       resolution: Optional[Literal['raw', 'minute', 'hour', 'disk']] = None,
+                       username: str = Depends(authorize)):
+    if metric not in metrics_store.columns:
+        raise HTTPException(status_code=404, detail="Метрика не найдена")
+    try:
+        return metrics_store.query(metric, start=start, end=end, max_points=points,
+                                   agg=agg, resolution=resolution)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def ingest_body(body: bytes):
+    frame = fleet.decode_frame(body)
+    return frame['host'], fleet_store.ingest(frame).tolist()
+
+
+# Приём кадров от агентов (JSON, сжатый zlib) с авторизацией.
+# Распаковка и проверка строк идут в пуле потоков, а правила проверяет
+# поток движка тревог, так что большой кадр не держит цикл событий
+@app.post("/ingest")
+async def ingest_frame(request: Request, username: str = Depends(authorize)):
+    body = await request.body()
+    try:
+        host, rows = await run_in_threadpool(ingest_body, body)
+    except fleet.FrameError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Правила видят те же проверенные строки, что попали в историю
+    alerts.engine.submit(host, fleet.COLUMNS, rows)
+    return {"accepted": len(rows)}
+
+# Сводка по парку: число машин, средние и перцентили, машины с наибольшей нагрузкой
+@app.get("/fleet")
+async def get_fleet_summary(n: int = Query(10, ge=1, le=1000), username: str = Depends(authorize)):
+    return fleet_store.summary(n)
+
+# История одной машины парка
+@app.get("/fleet/{host}")
+async def get_host_history(host: str, username: str = Depends(authorize)):
+    if host not in fleet_store.hosts:
+        raise HTTPException(status_code=404, detail="Машина не найдена")
+    return fleet_store.history(host)
+
+# Сработавшие сейчас правила и последние уведомления
+@app.get("/alerts")
+async def get_alerts(limit: int = Query(50, ge=0, le=alerts.HISTORY_SIZE), username: str = Depends(authorize)):
+    recent = list(alerts.engine.history)[-limit:] if limit else []
+    return {
+        "active": alerts.engine.active(),
+        "recent": [alert._asdict() for alert in recent],
+        "dropped": alerts.engine.dropped,
+    }
+
+# Метрики для Prometheus с авторизацией: последний замер сборщика,
+# задержки запросов, кеш ответов, тревоги и машины парка
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(username: str = Depends(authorize)):
+    body = metrics.render(
+        host_metrics.lines(sampler.buffer.latest()),
+        request_metrics.render(metrics.HTTP_PREFIX),
+        metrics.cache_metrics(response_cache.snapshot()),
+        metrics.alert_metrics(alerts.engine),
+        metrics.fleet_metrics(fleet_store, fleet.COLUMNS),
+    )
+    return PlainTextResponse(body, media_type=metrics.CONTENT_TYPE)
+
+# Отчёт профилировщика с авторизацией: гистограммы по маршрутам и фазам,
+# медленные запросы со стеком и профилем
+@app.get("/admin/profile")
+async def get_profile(username: str = Depends(authorize)):
+    return {"enabled": profiling.ENABLED, **profiling.profiler.report()}
+
+# Очистка отчёта профилировщика с авторизацией
+@app.post("/admin/profile/reset")
+async def reset_profile(username: str = Depends(authorize)):
+    profiling.profiler.reset()
+    return {"message": "Отчёт профилировщика очищен"}
 
 # API для перенаправления на дашборд
 @app.get("/dashboard")
@@ -0,0 +1,315 @@
+"""Сбор метрик с нескольких машин: агент и центральный коллектор.
+
+Агент копит замеры своего сборщика и отправляет их пачками (кадрами) на
+/ingest коллектора. Кадр — JSON, сжатый zlib. Коллектор хранит историю
+каждой машины в кольцевом буфере и считает сводки по всему парку.
+
+Агент на этой машине::
+
+    python fleet.py agent --collector http://collector:8000
+
+Нагрузочная проверка коллектора синтетическими агентами::
+
+    python fleet.py simulate --collector http://127.0.0.1:8000 --agents 50
+"""
+import argparse
+import base64
+import heapq
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from history import HistoryBuffer
+
+logger = logging.getLogger(__name__)
+
+# Адрес коллектора для режима агента и дашборда, учётные данные "имя:пароль"
+COLLECTOR_URL = os.environ.get('MONITOR_COLLECTOR_URL')
+COLLECTOR_AUTH = os.environ.get('MONITOR_COLLECTOR_AUTH', 'user:password')
+# Замеров в одном кадре и глубина истории каждой машины на коллекторе
+BATCH_SIZE = int(os.environ.get('MONITOR_AGENT_BATCH', '10'))
+HOST_HISTORY = int(os.environ.get('MONITOR_HOST_HISTORY', '3600'))
+# Сколько машин коллектор готов помнить. Буфер машины занимает
+# 2 * HOST_HISTORY * (len(COLUMNS) + 1) * 8 байт (~345 КБ при 3600 строках),
+# так что по умолчанию парк из 1000 машин укладывается в ~350 МБ;
+# для большего парка уменьшайте MONITOR_HOST_HISTORY
+MAX_HOSTS = int(os.environ.get('MONITOR_MAX_HOSTS', '1000'))
+# Машина считается на связи, если присылала данные за последние OFFLINE_AFTER секунд
+OFFLINE_AFTER = float(os.environ.get('MONITOR_OFFLINE_AFTER', '60'))
+# Предел размера распакованного кадра, защита от zip-бомб
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+FRAME_MEDIA_TYPE = 'application/x-monitor-frame'
+COLUMNS = ['cpu', 'ram', 'disk_usage', 'bytes_sent', 'bytes_recv']
+
+
+class FrameError(ValueError):
+    pass
+
+
+def sample_row(sample) -> List[float]:
+    return [sample.timestamp, sample.cpu_total, sample.memory.percent, sample.disk.percent,
+            sample.upload_speed, sample.download_speed]
+
+
+def encode_frame(host: str, rows: Sequence[Sequence[float]]) -> bytes:
+    frame = {'host': host, 'columns': COLUMNS, 'rows': [list(row) for row in rows]}
+    return zlib.compress(json.dumps(frame, separators=(',', ':')).encode(), 6)
+
+
+def decode_frame(body: bytes) -> dict:
+    decompressor = zlib.decompressobj()
+    try:
+        data = decompressor.decompress(body, MAX_FRAME_SIZE)
+        if decompressor.unconsumed_tail:
+            raise FrameError('Кадр больше допустимого размера')
+        frame = json.loads(data)
+    except (zlib.error, ValueError) as e:
+        raise FrameError(f'Повреждённый кадр: {e}') from e
+    if not isinstance(frame, dict) or not isinstance(frame.get('host'), str) \
+            or frame.get('columns') != COLUMNS or not isinstance(frame.get('rows'), list):
+        raise FrameError('Неверный формат кадра')
+    return frame
+
+
+def frame_rows(frame: dict) -> np.ndarray:
+    """Строки кадра массивом float (N, 1 + len(COLUMNS)), по возрастанию времени.
+
+    Строка — метка времени и значение каждой колонки, все числа; другая
+    форма или тип значений — FrameError.
+    """
+    width = len(COLUMNS) + 1
+    if not frame['rows']:
+        return np.empty((0, width))
+    try:
+        rows = np.asarray(frame['rows'])
+    except ValueError as e:  # строки разной длины
+        raise FrameError(f'Неверные строки кадра: {e}') from e
+    if rows.ndim != 2 or rows.shape[1] != width:
+        raise FrameError(f'Строка кадра — список из {width} чисел')
+    if rows.dtype.kind not in 'iuf':
+        raise FrameError('Значения в строках кадра должны быть числами')
+    rows = rows.astype(float)
+    if not np.isfinite(rows[:, 0]).all():
+        raise FrameError('Неверная метка времени в кадре')
+    return rows[np.argsort(rows[:, 0], kind='stable')]
+
+
+class FleetStore:
+    """История по машинам и сводки по парку.
+
+    Для каждой машины — HistoryBuffer с колонками COLUMNS; кадр целиком
+    проверяется и только потом записывается в буфер одним блоком. Машин
+    не больше max_hosts. Сводки считаются по последним строкам машин,
+    которые на связи.
+    """
+
+    def __init__(self, depth: int = HOST_HISTORY, max_hosts: int = MAX_HOSTS):
+        self.depth = depth
+        self.max_hosts = max_hosts
+        self.hosts: Dict[str, HistoryBuffer] = {}
+        self.last_seen: Dict[str, float] = {}
+        self.ingested = 0
+        self._lock = threading.Lock()
+
+    def ingest(self, frame: dict) -> np.ndarray:
+        """Записать кадр; возвращает его проверенные строки (см. frame_rows)."""
+        host = frame['host']
+        rows = frame_rows(frame)
+        if not len(rows):  # пустой кадр не регистрирует машину и не отмечает её на связи
+            return rows
+        buffer = self.hosts.get(host)
+        if buffer is None:
+            with self._lock:
+                buffer = self.hosts.get(host)
+                if buffer is None:
+                    if len(self.hosts) >= self.max_hosts:
+                        raise FrameError(f'Коллектор уже принимает данные от {self.max_hosts} машин')
+                    buffer = self.hosts[host] = HistoryBuffer(COLUMNS, self.depth)
+        buffer.extend(rows[:, 0], rows[:, 1:])
+        self.last_seen[host] = time.time()
+        self.ingested += len(rows)
+        return rows
+
+    def online(self, now: Optional[float] = None) -> List[str]:
+        now = time.time() if now is None else now
+        return [host for host, seen in list(self.last_seen.items()) if now - seen <= OFFLINE_AFTER]
+
+    def latest(self, hosts: Sequence[str]) -> np.ndarray:
+        return np.array([self.hosts[host].latest() for host in hosts]).reshape(-1, len(COLUMNS))
+
+    def top(self, column: str, n: int = 10) -> List[dict]:
+        hosts = self.online()
+        values = self.latest(hosts)[:, COLUMNS.index(column)]
+        best = heapq.nlargest(n, ((value, host) for value, host in zip(values.tolist(), hosts)
+                                  if value == value))  # NaN пропускаем
+        return [{'host': host, column: value} for value, host in best]
+
+    def summary(self, n: int = 10) -> dict:
+        hosts = self.online()
+        latest = self.latest(hosts)
+        rollups = {}
+        for i, column in enumerate(COLUMNS):
+            values = latest[:, i]
+            values = values[~np.isnan(values)]
+            rollups[column] = ({'mean': float(values.mean()), 'p50': float(np.percentile(values, 50)),
+                                'p95': float(np.percentile(values, 95)), 'max': float(values.max())}
+                               if len(values) else None)
+        return {
+            'hosts': len(self.hosts),
+            'online': len(hosts),
+            'ingested': self.ingested,
+            'rollups': rollups,
+            'top_cpu': self.top('cpu', n),
+            'top_ram': self.top('ram', n),
+        }
+
+    def history(self, host: str) -> dict:
+        buffer = self.hosts[host]
+        count, timestamps, rows = buffer.snapshot()
+        start = buffer.depth - min(count, buffer.depth)
+        rows = rows[start:]
+        return {
+            'host': host,
+            'timestamps': timestamps[start:].tolist(),
+            **{column: [None if value != value else value for value in rows[:, i].tolist()]
+               for i, column in enumerate(COLUMNS)},
+        }
+
+
+def auth_header(auth: str) -> str:
+    return 'Basic ' + base64.b64encode(auth.encode()).decode()
+
+
+def post_frame(url: str, body: bytes, auth: str = COLLECTOR_AUTH, timeout: float = 5.0):
+    request = urllib.request.Request(url.rstrip('/') + '/ingest', data=body, method='POST', headers={
+        'Content-Type': FRAME_MEDIA_TYPE,
+        'Authorization': auth_header(auth),
+    })
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+class Agent:
+    """Отправляет замеры сборщика на коллектор кадрами по batch_size строк.
+
+    Отправка идёт в отдельном потоке, поэтому сборщик не ждёт сеть. Пока
+    коллектор недоступен, кадры копятся в очереди до max_pending, затем
+    самые старые выбрасываются.
+    """
+
+    def __init__(self, url: str, host: Optional[str] = None, batch_size: int = BATCH_SIZE,
+                 auth: str = COLLECTOR_AUTH, max_pending: int = 360):
+        self.url = url
+        self.host = host or socket.gethostname()
+        self.batch_size = batch_size
+        self.auth = auth
+        self.sent = 0
+        self.dropped = 0
+        self._rows: List[List[float]] = []
+        self._frames: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, sampler):
+        sampler.subscribe(self.on_sample)
+        self._thread = threading.Thread(target=self._run, name='metrics-agent', daemon=True)
+        self._thread.start()
+        sampler.start()
+
+    def on_sample(self, sample):
+        self._rows.append(sample_row(sample))
+        if len(self._rows) >= self.batch_size:
+            frame, self._rows = encode_frame(self.host, self._rows), []
+            while True:
+                try:
+                    self._frames.put_nowait(frame)
+                    break
+                except queue.Full:
+                    try:
+                        self._frames.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+
+    def _run(self):
+        backoff = 1.0
+        while True:
+            frame = self._frames.get()
+            while True:
+                try:
+                    post_frame(self.url, frame, self.auth)
+                    self.sent += 1
+                    backoff = 1.0
+                    break
+                except urllib.error.HTTPError as e:
+                    if 400 <= e.code < 500 and e.code != 429:
+                        # Коллектор отверг кадр; повтор не поможет
+                        logger.error('Коллектор отклонил кадр: %s', e)
+                        self.dropped += 1
+                        break
+                    logger.warning('Ошибка коллектора (%s), повтор через %.0f с', e, backoff)
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, 60.0)
+                except OSError as e:
+                    logger.warning('Коллектор недоступен (%s), повтор через %.0f с', e, backoff)
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, 60.0)
+
+
+def simulate(url: str, agents: int, duration: float, batch_size: int, auth: str):
+    """Синтетические агенты: каждый шлёт кадры подряд, без пауз."""
+    stop = time.perf_counter() + duration
+    counts = [0] * agents
+
+    def run(index: int):
+        host = f'sim-{index:04d}'
+        rng = np.random.default_rng(index)
+        while time.perf_counter() < stop:
+            now = time.time()
+            rows = [[now - batch_size + i, *rng.random(len(COLUMNS)) * 100] for i in range(batch_size)]
+            post_frame(url, encode_frame(host, rows), auth)
+            counts[index] += batch_size
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(agents)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    print(f'agents={agents} batch={batch_size} samples={sum(counts)} '
+          f'rate={sum(counts) / elapsed:,.0f} samples/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('mode', choices=['agent', 'simulate'])
+    parser.add_argument('--collector', default=COLLECTOR_URL or 'http://127.0.0.1:8000')
+    parser.add_argument('--auth', default=COLLECTOR_AUTH)
+    parser.add_argument('--host')
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE)
+    parser.add_argument('--agents', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+    if args.mode == 'agent':
+        from sampler import sampler
+        logging.basicConfig(level=logging.INFO)
+        Agent(args.collector, args.host, args.batch, args.auth).start(sampler)
+        while True:
+            time.sleep(3600)
+    else:
+        simulate(args.collector, args.agents, args.duration, args.batch, args.auth)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import threading
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+
+class HistoryBuffer:
+    """Кольцевой буфер истории метрик на заранее выделенном массиве NumPy.
+
+    Каждая строка пишется дважды: в позицию i и i + depth. Благодаря
+    этому последние depth строк в хронологическом порядке всегда лежат
+    в массиве подряд, и view() возвращает срез без копирования.
+    Добавление строки стоит O(число колонок), память не растёт.
+    """
+
+    def __init__(self, columns: Sequence[str], depth: int):
+        self.columns: List[str] = list(columns)
+        self.depth = depth
+        self._data = np.full((2 * depth, len(self.columns)), np.nan)
+        self._timestamps = np.full(2 * depth, np.nan)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return min(self._count, self.depth)
+
+    @property
+    def count(self) -> int:
+        """Сколько строк записано за всё время."""
+        return self._count
+
+    def append(self, timestamp: float, row: Sequence[float]):
+        with self._lock:
+            i = self._count % self.depth
+            self._data[i] = row
+            self._data[i + self.depth] = row
+            self._timestamps[i] = self._timestamps[i + self.depth] = timestamp
+            self._count += 1
+
+    def extend(self, timestamps: Sequence[float], rows: np.ndarray):
+        """Добавить несколько строк одной записью в массив."""
+        timestamps = np.asarray(timestamps, dtype=float)
+        rows = np.asarray(rows, dtype=float)
+        # Из длинной пачки в буфер попадут только последние depth строк
+        skipped = max(0, len(rows) - self.depth)
+        with self._lock:
+            positions = (self._count + skipped + np.arange(len(rows) - skipped)) % self.depth
+            self._data[positions] = self._data[positions + self.depth] = rows[skipped:]
+            self._timestamps[positions] = self._timestamps[positions + self.depth] = timestamps[skipped:]
+            self._count += len(rows)
+
+    def view(self) -> np.ndarray:
+        """Последние depth строк, от старых к новым (незаполненные — NaN)."""
+        start = self._count % self.depth
+        return self._data[start:start + self.depth]
+
+    def snapshot(self) -> Tuple[int, np.ndarray, np.ndarray]:
+        """Счётчик строк, метки времени и view() по одному значению счётчика.
+
+        timestamps() и view() читают счётчик каждый сам, и запись между
+        ними сдвигает одно относительно другого. Новые строки затирают
+        снимок с самых старых, так что его хвост остаётся верным.
+        """
+        with self._lock:
+            count = self._count
+        start = count % self.depth
+        return count, self._timestamps[start:start + self.depth], self._data[start:start + self.depth]
+
+    def timestamps(self) -> np.ndarray:
+        start = self._count % self.depth
+        return self._timestamps[start:start + self.depth]
+
+    def series(self, name: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Метки времени и значения колонки name по заполненной части буфера.
+
+        Обе копии снимаются под блокировкой записи, поэтому относятся к
+        одним и тем же строкам.
+        """
+        index = self.columns.index(name)
+        with self._lock:
+            end = self._count % self.depth + self.depth
+            start = end - min(self._count, self.depth)
+            return self._timestamps[start:end].copy(), self._data[start:end, index].copy()
+
+    def column(self, name: str) -> np.ndarray:
+        return self.view()[:, self.columns.index(name)]
+
+    def latest(self) -> np.ndarray:
+        return self._data[(self._count - 1) % self.depth + self.depth]
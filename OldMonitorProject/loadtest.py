@@ -0,0 +1,68 @@
+"""Нагрузочный тест API монитора: N клиентов опрашивают эндпоинт в цикле.
+
+Против запущенного сервера::
+
+    python loadtest.py --url http://127.0.0.1:8000 --path /snapshot --clients 1000
+
+Без сервера, через ASGI-транспорт в том же процессе::
+
+    python loadtest.py --in-process --path /summary --clients 1000
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+import numpy as np
+
+
+async def poller(client: httpx.AsyncClient, path: str, deadline: float, latencies: list, errors: list):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            response = await client.get(path)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(args):
+    if args.in_process:
+        from fastapi_server import app
+        transport = httpx.ASGITransport(app=app)
+        base_url = 'http://monitor'
+    else:
+        transport = None
+        base_url = args.url
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    latencies, errors = [], []
+    async with httpx.AsyncClient(base_url=base_url, transport=transport, limits=limits,
+                                 auth=(args.user, args.password), timeout=30) as client:
+        await client.get(args.path)  # прогрев: первый замер сборщика
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(poller(client, args.path, deadline, latencies, errors)
+                               for _ in range(args.clients)))
+        elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+    print(f'{args.path}: clients={args.clients} requests={len(latencies)} '
+          f'rps={len(latencies) / elapsed:,.0f} errors={len(errors)} '
+          f'p50={np.percentile(latencies, 50):.1f} ms p99={np.percentile(latencies, 99):.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--path', default='/summary')
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--user', default='user')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--in-process', action='store_true')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Метрики в текстовом формате Prometheus для /metrics.
+
+Показатели машины берутся из последнего замера фонового сборщика, так что
+запрос не вызывает psutil. Текст по замеру строится один раз и
+переиспользуется до следующего замера. Задержки запросов API копит
+MetricsMiddleware в гистограммах по (метод, шаблон маршрута, статус);
+гистограммы и разметка рядов — общие с demo_exam, из instrumentation.metrics.
+"""
+from typing import Dict, List, Optional
+
+import shared  # noqa: F401  (корень репозитория в sys.path)
+from instrumentation.metrics import (CONTENT_TYPE, MetricsMiddleware, RequestMetrics,  # noqa: F401
+                                     escape, family, labels, number, render)
+
+PREFIX = 'monitor'
+# Ряды задержек запросов API: monitor_http_request_duration_seconds и т.д.
+HTTP_PREFIX = f'{PREFIX}_http'
+
+
+def host_metrics(sample, prefix: str = PREFIX) -> List[str]:
+    """Показатели машины по одному замеру сборщика."""
+    memory, disk = sample.memory, sample.disk
+    rates = sample.net_rates or {}
+    pernic = sample.net_pernic or {}
+    return [
+        *family(f'{prefix}_sample_timestamp_seconds', 'gauge', 'Время последнего замера.',
+                [('', sample.timestamp)]),
+        *family(f'{prefix}_cpu_percent', 'gauge', 'Загрузка CPU по ядрам, %.',
+                [(labels(cpu=i), value) for i, value in enumerate(sample.cpu_percent)]
+                + [('cpu="total"', sample.cpu_total)]),
+        *family(f'{prefix}_memory_bytes', 'gauge', 'Оперативная память, байты.',
+                [('state="total"', memory.total), ('state="available"', memory.available),
+                 ('state="used"', memory.used)]),
+        *family(f'{prefix}_memory_percent', 'gauge', 'Занятая оперативная память, %.', [('', memory.percent)]),
+        *family(f'{prefix}_disk_bytes', 'gauge', 'Корневой раздел, байты.',
+                [('state="total"', disk.total), ('state="used"', disk.used), ('state="free"', disk.free)]),
+        *family(f'{prefix}_disk_percent', 'gauge', 'Занятое место на корневом разделе, %.', [('', disk.percent)]),
+        *family(f'{prefix}_network_bytes_total', 'counter', 'Байт передано через интерфейс.',
+                [(labels(interface=name, direction=direction), value)
+                 for name, counters in pernic.items()
+                 for direction, value in (('sent', counters.bytes_sent), ('recv', counters.bytes_recv))]),
+        *family(f'{prefix}_network_rate_bytes', 'gauge', 'Сглаженная скорость интерфейса, байт/с.',
+                [(labels(interface=name, direction=direction), value)
+                 for name, rate in rates.items()
+                 for direction, value in (('sent', rate.sent_smoothed), ('recv', rate.recv_smoothed))]),
+    ]
+
+
+class HostMetrics:
+    """Текст показателей машины, построенный один раз на замер."""
+
+    def __init__(self):
+        self._timestamp: Optional[float] = None
+        self._lines: List[str] = []
+
+    def lines(self, sample) -> List[str]:
+        if sample is None:
+            return []
+        if sample.timestamp != self._timestamp:
+            # Присваивание списка атомарно: параллельный запрос увидит старый или новый текст
+            self._lines, self._timestamp = host_metrics(sample), sample.timestamp
+        return self._lines
+
+
+def cache_metrics(stats: Dict[str, Dict[str, int]], prefix: str = PREFIX) -> List[str]:
+    return family(f'{prefix}_response_cache_total', 'counter', 'Обращения к кешу ответов.',
+                  [(labels(endpoint=key, result=result), count)
+                   for key, counters in stats.items() for result, count in counters.items()])
+
+
+def alert_metrics(engine, prefix: str = PREFIX) -> List[str]:
+    return [
+        *family(f'{prefix}_alerts_firing', 'gauge', 'Сработавшие правила.',
+                [(labels(rule=alert['rule'], host=alert['host']), 1) for alert in engine.active()]),
+        *family(f'{prefix}_alerts_dropped_total', 'counter', 'Уведомления, не поместившиеся в очередь.',
+                [('', engine.dropped)]),
+        *family(f'{prefix}_alerts_frames_dropped_total', 'counter', 'Кадры парка, не поместившиеся в очередь правил.',
+                [('', engine.dropped_frames)]),
+    ]
+
+
+def fleet_metrics(store, columns: List[str], prefix: str = PREFIX) -> List[str]:
+    """Последние значения машин парка, которые на связи."""
+    hosts = store.online()
+    latest = store.latest(hosts).tolist()
+    return [
+        *family(f'{prefix}_fleet_hosts', 'gauge', 'Машины парка.',
+                [('state="known"', len(store.hosts)), ('state="online"', len(hosts))]),
+        *family(f'{prefix}_fleet_ingested_samples_total', 'counter', 'Принято замеров от агентов.',
+                [('', store.ingested)]),
+        *family(f'{prefix}_fleet_value', 'gauge', 'Последнее значение метрики машины парка.',
+                [(f'host="{escape(host)}",metric="{column}"', value)
+                 for host, row in zip(hosts, latest) for column, value in zip(columns, row)]),
+    ]
+
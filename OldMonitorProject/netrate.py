@@ -0,0 +1,88 @@
+import math
+import os
+from typing import Dict, NamedTuple, Optional
+
+# Постоянная времени сглаживания скорости (секунды)
+SMOOTHING = float(os.environ.get('MONITOR_NET_SMOOTHING', '5.0'))
+
+# Счётчики некоторых драйверов 32-битные и переполняются через 4 ГБ
+WRAP_32 = 2 ** 32
+
+
+class InterfaceRate(NamedTuple):
+    """Скорость одного интерфейса, байт/с: мгновенная и сглаженная."""
+    sent: float
+    recv: float
+    sent_smoothed: float
+    recv_smoothed: float
+
+
+def counter_delta(new: int, old: int) -> Optional[int]:
+    """Прирост счётчика с учётом переполнения.
+
+    Если счётчик уменьшился из верхней половины 32-битного диапазона,
+    это переполнение; иначе — сброс (интерфейс пересоздан, драйвер
+    перезагружен), и прирост за этот интервал неизвестен.
+    """
+    if new >= old:
+        return new - old
+    if WRAP_32 // 2 <= old < WRAP_32:
+        return new + WRAP_32 - old
+    return None
+
+
+class NetRateEngine:
+    """Скорость сети по счётчикам psutil.net_io_counters(pernic=True).
+
+    Хранит собственные предыдущие счётчики, поэтому результат не зависит
+    от того, сколько клиентов читают скорость. Сглаживание — EWMA с
+    коэффициентом 1 - exp(-dt / smoothing), т.е. не зависит от интервала
+    опроса. После сброса счётчика интерфейс пропускает один интервал.
+    """
+
+    def __init__(self, smoothing: float = SMOOTHING):
+        self.smoothing = smoothing
+        self.rates: Dict[str, InterfaceRate] = {}
+        self._prev: Dict[str, tuple] = {}
+        self._prev_time: Optional[float] = None
+
+    def update(self, timestamp: float, pernic: Dict[str, object]) -> Dict[str, InterfaceRate]:
+        elapsed = timestamp - self._prev_time if self._prev_time is not None else None
+        rates = {}
+        for name, counters in pernic.items():
+            prev = self._prev.get(name)
+            old = self.rates.get(name)
+            if not elapsed or elapsed <= 0 or prev is None:
+                continue
+            sent = counter_delta(counters.bytes_sent, prev[0])
+            recv = counter_delta(counters.bytes_recv, prev[1])
+            if sent is None or recv is None:
+                if old is not None:
+                    rates[name] = old
+                continue
+            sent, recv = sent / elapsed, recv / elapsed
+            if old is None:
+                rates[name] = InterfaceRate(sent, recv, sent, recv)
+            else:
+                alpha = 1 - math.exp(-elapsed / self.smoothing) if self.smoothing > 0 else 1.0
+                rates[name] = InterfaceRate(sent, recv,
+                                            old.sent_smoothed + alpha * (sent - old.sent_smoothed),
+                                            old.recv_smoothed + alpha * (recv - old.recv_smoothed))
+        # Пропавшие интерфейсы уходят из состояния
+        self._prev = {name: (counters.bytes_sent, counters.bytes_recv) for name, counters in pernic.items()}
+        self._prev_time = timestamp
+        self.rates = rates
+        return rates
+
+    def apply(self, sample):
+        """Замер сборщика со скоростями по его счётчикам net_pernic."""
+        rates = self.update(sample.timestamp, sample.net_pernic or {})
+        upload_speed, download_speed = self.total()
+        return sample._replace(upload_speed=upload_speed, download_speed=download_speed, net_rates=rates)
+
+    def total(self) -> tuple:
+        """Сглаженная суммарная скорость (отправка, приём) по всем интерфейсам."""
+        if not self.rates:
+            return float('nan'), float('nan')
+        return (sum(rate.sent_smoothed for rate in self.rates.values()),
+                sum(rate.recv_smoothed for rate in self.rates.values()))
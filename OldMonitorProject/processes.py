@@ -0,0 +1,104 @@
+import heapq
+import logging
+import os
+import threading
+import time
+from operator import attrgetter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+# Как часто (секунды) обходить список процессов
+PROCESS_INTERVAL = float(os.environ.get('MONITOR_PROCESS_INTERVAL', '5.0'))
+
+# Только нужные атрибуты: process_iter читает их внутри oneshot(),
+# т.е. одним проходом по /proc/<pid> на процесс
+ATTRS = ['pid', 'name', 'create_time', 'cpu_times', 'memory_info', 'io_counters']
+
+SORT_KEYS = {'cpu': 'cpu_percent', 'rss': 'rss', 'io': 'io_rate'}
+
+
+class ProcessStat(NamedTuple):
+    pid: int
+    name: str
+    cpu_percent: float  # за интервал между обходами, 100 = одно ядро
+    rss: int
+    io_rate: float  # байт/с чтения и записи
+
+
+class ProcessTracker:
+    """Статистика процессов по разнице счётчиков между обходами.
+
+    Для каждого PID хранятся время CPU и объём ввода-вывода с прошлого
+    обхода; время создания отличает повторно выданный PID от старого.
+    Обход идёт в собственном фоновом потоке раз в interval секунд, а не в
+    потоке сборщика; под блокировкой только подменяется готовый список.
+    Топ-N выбирается кучей за O(P log N), без сортировки всего списка.
+    """
+
+    def __init__(self, interval: float = PROCESS_INTERVAL):
+        self.interval = interval
+        self.timestamp: Optional[float] = None
+        self._stats: List[ProcessStat] = []
+        self._prev: Dict[int, Tuple[float, float, float]] = {}
+        self._prev_time: Optional[float] = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name='process-tracker', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('Не удалось обойти процессы')
+            if self._stopped.wait(self.interval):
+                return
+
+    def refresh(self):
+        now = time.monotonic()
+        elapsed = now - self._prev_time if self._prev_time is not None else None
+        stats, current = [], {}
+        for process in psutil.process_iter(ATTRS):
+            info = process.info
+            cpu_times, memory, io = info['cpu_times'], info['memory_info'], info['io_counters']
+            if cpu_times is None or memory is None:
+                continue  # процесс завершился или недоступен
+            cpu_time = cpu_times.user + cpu_times.system
+            io_bytes = io.read_bytes + io.write_bytes if io is not None else 0.0
+            pid = info['pid']
+            current[pid] = (info['create_time'], cpu_time, io_bytes)
+            prev = self._prev.get(pid)
+            if elapsed and prev is not None and prev[0] == info['create_time']:
+                cpu_percent = max(0.0, cpu_time - prev[1]) / elapsed * 100
+                io_rate = max(0.0, io_bytes - prev[2]) / elapsed
+            else:
+                cpu_percent = io_rate = 0.0
+            stats.append(ProcessStat(pid, info['name'] or '', cpu_percent, memory.rss, io_rate))
+        with self._lock:
+            # Записи завершившихся процессов уходят вместе со старым словарём
+            self._prev, self._prev_time = current, now
+            self._stats, self.timestamp = stats, time.time()
+
+    def top(self, n: int = 10, sort: str = 'cpu') -> List[ProcessStat]:
+        with self._lock:
+            stats = self._stats
+        return heapq.nlargest(n, stats, key=attrgetter(SORT_KEYS[sort]))
+
+
+# Общий трекер, обходит процессы в своём потоке раз в PROCESS_INTERVAL
+tracker = ProcessTracker()
@@ -0,0 +1,16 @@
+"""Профилирование запросов API монитора (включается MONITOR_PROFILING=1).
+
+Общая реализация — instrumentation.profiling; здесь профилировщик
+монитора с порогом MONITOR_PROFILE_SLOW_MS (миллисекунды) и долей
+профилируемых запросов медленных маршрутов MONITOR_PROFILE_RATE;
+доля разбираемых по фазам запросов остальных маршрутов — MONITOR_PROFILE_SAMPLE.
+Отчёт — profiler.report(), он же /admin/profile.
+"""
+import shared  # noqa: F401  (корень репозитория в sys.path)
+from instrumentation.profiling import (  # noqa: F401
+    HdrHistogram, ProfiledRoute, ProfilingMiddleware, RequestProfiler, enabled, format_profile, install,
+)
+
+PREFIX = 'MONITOR'
+ENABLED = enabled(PREFIX)
+profiler = RequestProfiler.from_env(PREFIX)
@@ -0,0 +1,156 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import psutil
+
+from netrate import InterfaceRate, NetRateEngine
+
+logger = logging.getLogger(__name__)
+
+# Интервал опроса psutil (секунды) и глубина буфера последних замеров
+SAMPLE_INTERVAL = float(os.environ.get('MONITOR_SAMPLE_INTERVAL', '1.0'))
+BUFFER_SIZE = int(os.environ.get('MONITOR_BUFFER_SIZE', '3600'))
+
+
+class Sample(NamedTuple):
+    """Один замер состояния системы."""
+    timestamp: float
+    cpu_percent: List[float]  # загрузка по ядрам
+    cpu_total: float
+    cpu_freq: Optional[dict]
+    memory: object  # psutil.virtual_memory()
+    disk: object  # psutil.disk_usage('/')
+    net_io: object  # сумма по интерфейсам, как psutil.net_io_counters()
+    net_pernic: Optional[dict] = None  # psutil.net_io_counters(pernic=True)
+    upload_speed: float = float('nan')  # сглаженная суммарная скорость, Б/с
+    download_speed: float = float('nan')
+    net_rates: Optional[Dict[str, InterfaceRate]] = None  # по интерфейсам
+
+
+def total_net_io(pernic: dict):
+    # Сумма по интерфейсам — то же, что psutil.net_io_counters() без
+    # pernic, но без второго обхода /proc/net/dev
+    if not pernic:
+        return psutil.net_io_counters()
+    counters = list(pernic.values())
+    return type(counters[0])(*(sum(values) for values in zip(*counters)))
+
+
+def collect_sample() -> Sample:
+    # cpu_percent без interval не блокирует: значение считается
+    # относительно предыдущего вызова, т.е. за интервал опроса
+    freq = psutil.cpu_freq()
+    pernic = psutil.net_io_counters(pernic=True)
+    return Sample(
+        timestamp=time.time(),
+        cpu_percent=psutil.cpu_percent(percpu=True),
+        cpu_total=psutil.cpu_percent(),
+        cpu_freq=freq._asdict() if freq else None,
+        memory=psutil.virtual_memory(),
+        disk=psutil.disk_usage('/'),
+        net_io=total_net_io(pernic),
+        net_pernic=pernic,
+    )
+
+
+class RingBuffer:
+    """Кольцевой буфер фиксированного размера.
+
+    Запись идёт только из потока сборщика; чтение последнего элемента
+    не берёт блокировку и занимает микросекунды.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._items = [None] * size
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return min(self._count, self.size)
+
+    def append(self, item):
+        with self._lock:
+            self._items[self._count % self.size] = item
+            self._count += 1
+
+    def latest(self):
+        count = self._count
+        return self._items[(count - 1) % self.size] if count else None
+
+    def last(self, n: int) -> list:
+        """Последние n элементов в порядке поступления."""
+        with self._lock:
+            n = min(n, len(self))
+            start = self._count - n
+            return [self._items[i % self.size] for i in range(start, self._count)]
+
+
+class Sampler:
+    """Фоновый поток, который раз в interval секунд снимает Sample
+    и складывает его в общий кольцевой буфер."""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL, size: int = BUFFER_SIZE):
+        self.interval = interval
+        self.buffer = RingBuffer(size)
+        # Единственный расчёт скорости сети для дашборда и API
+        self.net_rates = NetRateEngine()
+        self._listeners: List[Callable[[Sample], None]] = []
+        self._ready = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name='metrics-sampler', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def subscribe(self, callback: Callable[[Sample], None]):
+        """callback вызывается в потоке сборщика для каждого нового замера."""
+        self._listeners.append(callback)
+
+    def latest(self, timeout: Optional[float] = None) -> Sample:
+        """Последний замер; при первом обращении ждёт, пока он появится."""
+        self.start()
+        if not self._ready.is_set():
+            self._ready.wait(self.interval * 5 if timeout is None else timeout)
+        return self.buffer.latest()
+
+    def history(self, n: int) -> List[Sample]:
+        return self.buffer.last(n)
+
+    def _run(self):
+        # Первый вызов cpu_percent только запоминает счётчики
+        psutil.cpu_percent(percpu=True)
+        psutil.cpu_percent()
+        next_tick = time.monotonic() + self.interval
+        while not self._stopped.wait(max(0.0, next_tick - time.monotonic())):
+            # Если сбор затянулся, не пытаемся догонять пропущенные тики
+            next_tick = max(next_tick + self.interval, time.monotonic())
+            try:
+                sample = self.net_rates.apply(collect_sample())
+            except Exception:
+                logger.exception('Не удалось снять метрики')
+                continue
+            self.buffer.append(sample)
+            self._ready.set()
+            for callback in list(self._listeners):
+                try:
+                    callback(sample)
+                except Exception:
+                    logger.exception('Ошибка в обработчике замера')
+
+
+# Общий сборщик для API и дашборда
+sampler = Sampler()
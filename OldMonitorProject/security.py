@@ -1,19 +1,206 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
 
 from fastapi import Depends, HTTPException, status
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBasic, HTTPBasicCredentials, HTTPBearer
+from starlette.concurrency import run_in_threadpool
 
-# Простые логин и пароль без хеширования
+# Стойкость хеша паролей, срок жизни записей кеша проверенных учётных
+# данных и токенов (секунды)
+ITERATIONS = int(os.environ.get('MONITOR_PBKDF2_ITERATIONS', '200000'))
+CACHE_TTL = float(os.environ.get('MONITOR_AUTH_CACHE_TTL', '300'))
+CACHE_SIZE = int(os.environ.get('MONITOR_AUTH_CACHE_SIZE', '1024'))
+TOKEN_TTL = int(os.environ.get('MONITOR_TOKEN_TTL', '900'))
+
+# Ключ подписи токенов; если не задан, токены действуют до перезапуска
+TOKEN_SECRET = os.environ.get('MONITOR_TOKEN_SECRET', '').encode() or os.urandom(32)
+
+# Пользователь по умолчанию, если файл пользователей не задан
 VALID_USERNAME = "user"
 VALID_PASSWORD = "password"
 
-security_check = HTTPBasic()
 
-def authorize(credentials: HTTPBasicCredentials = Depends(security_check)):
-    if credentials.username != VALID_USERNAME or credentials.password != VALID_PASSWORD:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Неправильное имя пользователя или пароль",
-            headers={"WWW-Authenticate": "Basic"},
-        )
-    return credentials.username
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def hash_password(password: str, iterations: int = ITERATIONS, salt: Optional[bytes] = None) -> str:
+    """Хеш в формате pbkdf2_sha256$<итерации>$<соль>$<хеш>."""
+    salt = salt or os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f'pbkdf2_sha256${iterations}${_b64encode(salt)}${_b64encode(digest)}'
+
+
+def verify_password(password: str, encoded: str) -> bool:
+    algorithm, iterations, salt, expected = encoded.split('$')
+    if algorithm != 'pbkdf2_sha256':
+        raise ValueError(f'Неизвестный алгоритм хеша: {algorithm}')
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), _b64decode(salt), int(iterations))
+    return hmac.compare_digest(digest, _b64decode(expected))
+
+
+class VerifiedCache:
+    """Недавно проверенные учётные данные: LRU с ограниченным временем жизни.
+
+    Ключ — HMAC от имени и пароля на случайном ключе процесса, так что в
+    памяти не хранятся ни пароли, ни их быстрые хеши. Попадание в кеш
+    стоит одного HMAC вместо полного PBKDF2.
+    """
+
+    def __init__(self, size: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._key = os.urandom(32)
+        self._entries: 'OrderedDict[bytes, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, username: str, password: str) -> bytes:
+        return hmac.new(self._key, f'{username}\0{password}'.encode(), hashlib.sha256).digest()
+
+    def get(self, key: bytes) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            username, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return username
+
+    def put(self, key: bytes, username: str):
+        with self._lock:
+            self._entries[key] = (username, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def discard_user(self, username: str):
+        with self._lock:
+            for key in [key for key, (name, _) in self._entries.items() if name == username]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
 
+class UserStore:
+    """Пользователи и хеши их паролей."""
+
+    def __init__(self, users: Optional[Dict[str, str]] = None):
+        self._users: Dict[str, str] = dict(users or {})
+        self.cache = VerifiedCache()
+        # Смена хеша со сбросом кеша и запись в кеш после проверки не пересекаются
+        self._lock = threading.Lock()
+        # Для неизвестных имён тоже считается PBKDF2, чтобы время ответа
+        # не выдавало, существует ли пользователь
+        self._dummy_hash = hash_password(_b64encode(os.urandom(16)))
+
+    def __contains__(self, username: str) -> bool:
+        return username in self._users
+
+    @classmethod
+    def from_file(cls, path: str) -> 'UserStore':
+        """JSON-файл вида {"имя": "pbkdf2_sha256$..."}."""
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def set_password(self, username: str, password: str):
+        encoded = hash_password(password)
+        with self._lock:
+            self._users[username] = encoded
+            self.cache.discard_user(username)
+
+    def remove(self, username: str):
+        with self._lock:
+            self._users.pop(username, None)
+            self.cache.discard_user(username)
+
+    def check(self, username: str, password: str) -> bool:
+        """Полная проверка пароля (медленно, без кеша)."""
+        encoded = self._users.get(username)
+        matches = verify_password(password, encoded or self._dummy_hash)
+        return matches and encoded is not None
+
+    async def verify(self, username: str, password: str) -> bool:
+        key = self.cache.key(username, password)
+        if self.cache.get(key) is not None:
+            return True
+        encoded = self._users.get(username)
+        # PBKDF2 специально медленный, поэтому не в цикле событий
+        if not await run_in_threadpool(self.check, username, password):
+            return False
+        # Пароль могли сменить, пока шла проверка: кешируем, только если
+        # хеш тот же, что был до неё
+        with self._lock:
+            if self._users.get(username) == encoded:
+                self.cache.put(key, username)
+        return True
+
+
+def issue_token(username: str, ttl: int = TOKEN_TTL) -> str:
+    """Подписанный токен <данные>.<подпись> с именем пользователя и сроком действия."""
+    payload = _b64encode(json.dumps({'sub': username, 'exp': int(time.time()) + ttl}).encode())
+    signature = hmac.new(TOKEN_SECRET, payload.encode(), hashlib.sha256).digest()
+    return f'{payload}.{_b64encode(signature)}'
+
+
+def verify_token(token: str) -> Optional[str]:
+    """Имя пользователя из действующего токена или None."""
+    try:
+        payload, signature = token.split('.')
+        expected = hmac.new(TOKEN_SECRET, payload.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(_b64decode(signature), expected):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    if claims.get('exp', 0) < time.time() or claims.get('sub') not in users:
+        return None
+    return claims['sub']
+
+
+USERS_FILE = os.environ.get('MONITOR_USERS_FILE')
+if USERS_FILE:
+    users = UserStore.from_file(USERS_FILE)
+else:
+    users = UserStore()
+    users.set_password(VALID_USERNAME, VALID_PASSWORD)
+
+security_check = HTTPBasic(auto_error=False)
+bearer_check = HTTPBearer(auto_error=False)
+
+
+def unauthorized() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Неправильное имя пользователя или пароль",
+        headers={"WWW-Authenticate": "Basic"},
+    )
+
+
+# Принимает Basic или Bearer-токен из /token. Повторные запросы с теми же
+# учётными данными проверяются по кешу за микросекунды
+async def authorize(credentials: Optional[HTTPBasicCredentials] = Depends(security_check),
+                    bearer: Optional[HTTPAuthorizationCredentials] = Depends(bearer_check)):
+    if bearer is not None:
+        username = verify_token(bearer.credentials)
+        if username is None:
+            raise unauthorized()
+        return username
+    if credentials is None or not await users.verify(credentials.username, credentials.password):
+        raise unauthorized()
+    return credentials.username
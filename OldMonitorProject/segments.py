@@ -0,0 +1,283 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Заголовок сегмента: сигнатура и JSON со списком колонок, дополненный
+# пробелами до HEADER_SIZE байт. Дальше идут строки фиксированной длины
+MAGIC = b'MONSEG1\n'
+HEADER_SIZE = 4096
+SUFFIX = '.seg'
+
+
+def row_dtype(columns: Sequence[str]) -> np.dtype:
+    return np.dtype([('timestamp', '<f8'), ('values', '<f8', (len(columns),))])
+
+
+def write_header(f, columns: Sequence[str]):
+    header = MAGIC + json.dumps({'columns': list(columns)}).encode()
+    if len(header) > HEADER_SIZE:
+        raise ValueError('Слишком много колонок для заголовка сегмента')
+    f.write(header.ljust(HEADER_SIZE, b' '))
+
+
+def read_header(path: str) -> List[str]:
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if not header.startswith(MAGIC):
+        raise ValueError(f'Не сегмент метрик: {path}')
+    return json.loads(header[len(MAGIC):])['columns']
+
+
+class Segment:
+    """Файл сегмента: строки (timestamp, values[колонки]) подряд после заголовка.
+
+    Число строк определяется по размеру файла, поэтому открытие сегмента
+    не читает данные, а недописанная строка в конце просто не видна.
+    """
+
+    def __init__(self, path: str, columns: Sequence[str]):
+        self.path = path
+        self.columns = list(columns)
+        self.dtype = row_dtype(columns)
+        self.start = float(os.path.basename(path)[:-len(SUFFIX)])
+
+    @property
+    def rows(self) -> int:
+        return max(0, os.path.getsize(self.path) - HEADER_SIZE) // self.dtype.itemsize
+
+    def map(self) -> np.ndarray:
+        """Все строки сегмента как np.memmap (только чтение, без копирования)."""
+        rows = self.rows
+        if not rows:
+            return np.empty(0, dtype=self.dtype)
+        return np.memmap(self.path, dtype=self.dtype, mode='r', offset=HEADER_SIZE, shape=(rows,))
+
+
+class SegmentStore:
+    """Архив замеров на диске в виде append-only сегментов.
+
+    Строки копятся в памяти и дописываются в активный сегмент пачками по
+    batch_size. Сегмент закрывается после rows_per_segment строк, и запись
+    просто переходит в новый файл. Затем фоновый поток удаляет сегменты
+    старше retention секунд и сливает мелкие закрытые сегменты (например,
+    оставшиеся от перезапусков) в один, не задерживая поток сборщика.
+    Чтение идёт через np.memmap: scan() возвращает срезы отображённых файлов.
+    """
+
+    def __init__(self, directory: str, columns: Sequence[str], rows_per_segment: int = 86_400,
+                 batch_size: int = 60, retention: float = 30 * 24 * 3600):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.columns = list(columns)
+        self.dtype = row_dtype(columns)
+        self.rows_per_segment = rows_per_segment
+        self.batch_size = batch_size
+        self.retention = retention
+        self._pending: List[Tuple[float, np.ndarray]] = []
+        self._lock = threading.Lock()
+        # Удаление и слияние сегментов не идут одновременно друг с другом
+        self._maintenance_lock = threading.Lock()
+        self._tasks: queue.Queue = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._active: Optional[Segment] = None
+        self._file = None
+        # При старте читаются только имена файлов и заголовки
+        self.segments: List[Segment] = []
+        for name in sorted(os.listdir(directory), key=lambda name: float(name[:-len(SUFFIX)])
+                           if name.endswith(SUFFIX) else 0.0):
+            if not name.endswith(SUFFIX):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                self.segments.append(Segment(path, read_header(path)))
+            except (ValueError, OSError):
+                logger.exception('Пропущен повреждённый сегмент %s', path)
+        atexit.register(self.close)
+
+    def append(self, timestamp: float, row: Sequence[float]):
+        with self._lock:
+            self._pending.append((timestamp, np.asarray(row, dtype=float)))
+            if len(self._pending) >= self.batch_size:
+                self._write()
+
+    def flush(self):
+        with self._lock:
+            self._write()
+
+    def wait(self):
+        """Дождаться обслуживания всех закрытых к этому моменту сегментов."""
+        self._tasks.join()
+
+    def close(self):
+        with self._lock:
+            self._write()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            self._tasks.put(None)
+            worker.join()
+        atexit.unregister(self.close)
+
+    def _write(self):
+        if not self._pending:
+            return
+        rows = np.empty(len(self._pending), dtype=self.dtype)
+        rows['timestamp'] = [timestamp for timestamp, _ in self._pending]
+        rows['values'] = [row for _, row in self._pending]
+        self._pending = []
+        while len(rows):
+            if self._file is None:
+                self._open(rows['timestamp'][0])
+            room = self.rows_per_segment - self._active.rows
+            self._file.write(rows[:room].tobytes())
+            self._file.flush()
+            rows = rows[room:]
+            if self._active.rows >= self.rows_per_segment:
+                self._seal()
+
+    def _open(self, start: float):
+        # После перезапуска пишем в новый сегмент: старый мог оборваться
+        # на середине строки, а число строк считается по размеру файла.
+        # Имя — время первой строки; если такой сегмент уже есть (сдвиг
+        # часов, перезапуск в ту же секунду), берём следующее свободное
+        # имя, а не затираем закрытый сегмент
+        while True:
+            path = os.path.join(self.directory, f'{start:.6f}{SUFFIX}')
+            try:
+                self._file = open(path, 'xb')
+                break
+            except FileExistsError:
+                start = float(f'{start:.6f}') + 1e-6
+        write_header(self._file, self.columns)
+        self._active = Segment(path, self.columns)
+        self.segments.append(self._active)
+
+    def _seal(self):
+        # Вызывается под _lock из append: только закрываем файл, остальное
+        # делает фоновый поток
+        self._file.close()
+        self._file = None
+        self._active = None
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._maintain, name='segment-maintenance', daemon=True)
+            self._worker.start()
+        self._tasks.put(True)
+
+    def _maintain(self):
+        while True:
+            task = self._tasks.get()
+            try:
+                if task is None:
+                    return
+                self.expire()
+                self.compact()
+            except OSError:
+                logger.exception('Не удалось обслужить сегменты в %s', self.directory)
+            finally:
+                self._tasks.task_done()
+
+    def expire(self, now: Optional[float] = None):
+        """Удалить сегменты, все строки которых старше retention."""
+        cutoff = (time.time() if now is None else now) - self.retention
+        with self._maintenance_lock, self._lock:
+            # Конец сегмента — начало следующего
+            while len(self.segments) > 1 and self.segments[1].start < cutoff:
+                os.remove(self.segments.pop(0).path)
+
+    def compact(self):
+        """Слить подряд идущие мелкие закрытые сегменты с одинаковыми колонками.
+
+        Закрытые сегменты не меняются, поэтому слитый файл пишется без
+        блокировки записи; под ней только подменяются файлы и список.
+        """
+        with self._maintenance_lock:
+            with self._lock:
+                sealed = [segment for segment in self.segments if segment is not self._active]
+            self._compact(sealed)
+
+    def _compact(self, sealed: List[Segment]):
+        groups, group = [], []
+        for segment in sealed:
+            if group and (segment.columns != group[0].columns
+                          or sum(s.rows for s in group) + segment.rows > self.rows_per_segment):
+                groups.append(group)
+                group = []
+            group.append(segment)
+        groups.append(group)
+        for group in groups:
+            if len(group) < 2:
+                continue
+            path = group[0].path
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                write_header(f, group[0].columns)
+                for segment in group:
+                    f.write(segment.map().tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with self._lock:
+                os.replace(tmp_path, path)
+                for segment in group[1:]:
+                    os.remove(segment.path)
+                    self.segments.remove(segment)
+
+    def scan(self, start: float, end: float) -> List[np.ndarray]:
+        """Строки с timestamp в [start, end]: по срезу memmap на каждый
+        подходящий сегмент, без копирования данных."""
+        views = []
+        # Под блокировкой, чтобы сжатие не удалило сегмент до его отображения
+        with self._lock:
+            self._write()
+            for i, segment in enumerate(self.segments):
+                segment_end = self.segments[i + 1].start if i + 1 < len(self.segments) else float('inf')
+                if segment.start > end or segment_end < start:
+                    continue
+                if segment.columns != self.columns:
+                    logger.warning('Сегмент %s с другим набором колонок пропущен', segment.path)
+                    continue
+                rows = segment.map()
+                timestamps = rows['timestamp']
+                lo = np.searchsorted(timestamps, start, side='left')
+                hi = np.searchsorted(timestamps, end, side='right')
+                if hi > lo:
+                    views.append(rows[lo:hi])
+        return views
+
+    def column(self, name: str, start: float, end: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Временные метки и значения одной колонки за диапазон."""
+        index = self.columns.index(name)
+        views = self.scan(start, end)
+        if not views:
+            return np.empty(0), np.empty(0)
+        return (np.concatenate([view['timestamp'] for view in views]),
+                np.concatenate([view['values'][:, index] for view in views]))
+
+    def tail(self, n: int) -> np.ndarray:
+        """Последние n строк архива (копия)."""
+        parts, needed = [], n
+        with self._lock:
+            self._write()
+            for segment in reversed(self.segments):
+                if needed <= 0 or segment.columns != self.columns:
+                    break
+                rows = segment.map()[-needed:]
+                parts.append(rows)
+                needed -= len(rows)
+            if not parts:
+                return np.empty(0, dtype=self.dtype)
+            return np.concatenate(parts[::-1])
+
+    @property
+    def oldest(self) -> Optional[float]:
+        return self.segments[0].start if self.segments else None
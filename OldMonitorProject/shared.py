@@ -0,0 +1,11 @@
+"""Пакет instrumentation из корня репозитория, общий с demo_exam.
+
+Монитор запускается из своего каталога с плоскими импортами, поэтому
+корень репозитория добавляется в sys.path при импорте этого модуля.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
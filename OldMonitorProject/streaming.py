@@ -0,0 +1,137 @@
+import asyncio
+import json
+import math
+import threading
+from typing import Dict, Iterable, Optional, Set
+
+from sampler import Sample, sampler
+
+TOPICS = ('cpu', 'memory', 'disk', 'network', 'summary')
+
+# Сколько сообщений может ждать медленный клиент; дальше самые старые
+# выбрасываются, чтобы отставший клиент получал свежие данные
+QUEUE_SIZE = 16
+
+
+def json_safe(value):
+    """Заменить NaN и бесконечности на None: JSON.parse в браузере не
+    принимает голые NaN и Infinity, которые пишет json.dumps."""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    return value
+
+
+def sample_topics(sample: Sample) -> Dict[str, dict]:
+    return {
+        'cpu': {
+            'cpu_percent': sample.cpu_percent,
+            'cpu_total': sample.cpu_total,
+            'cpu_freq': sample.cpu_freq,
+        },
+        'memory': {
+            'total': sample.memory.total,
+            'used': sample.memory.used,
+            'available': sample.memory.available,
+            'percent': sample.memory.percent,
+        },
+        'disk': {
+            'total': sample.disk.total,
+            'used': sample.disk.used,
+            'free': sample.disk.free,
+            'percent': sample.disk.percent,
+        },
+        'network': {
+            **sample.net_io._asdict(),
+            'upload_speed': sample.upload_speed,
+            'download_speed': sample.download_speed,
+        },
+        'summary': {
+            'cpu': sample.cpu_total,
+            'memory': sample.memory.percent,
+            'disk': sample.disk.percent,
+        },
+    }
+
+
+class Subscription:
+    """Очередь сообщений одного клиента в его цикле событий."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, topics: Iterable[str], size: int = QUEUE_SIZE):
+        self.loop = loop
+        self.topics = tuple(dict.fromkeys(topics))
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+        self.dropped = 0
+
+    def put(self, message: str):
+        # Вызывается в цикле событий клиента через call_soon_threadsafe
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout: Optional[float] = None) -> str:
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class Broadcaster:
+    """Раздаёт каждый замер сборщика всем подписчикам.
+
+    JSON каждой темы кодируется один раз на замер, сообщение подписчика
+    склеивается из готовых фрагментов нужных ему тем. Сборщик ничего не
+    ждёт: сообщения передаются в циклы событий клиентов без блокировки.
+    """
+
+    def __init__(self):
+        self._subscriptions: Set[Subscription] = set()
+        self._lock = threading.Lock()
+        self.seq = 0
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def subscribe(self, topics: Iterable[str], size: int = QUEUE_SIZE) -> Subscription:
+        subscription = Subscription(asyncio.get_running_loop(), topics, size)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, sample: Sample):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        if not subscriptions:
+            return
+        self.seq += 1
+        fragments = {topic: json.dumps(json_safe(value), allow_nan=False)
+                     for topic, value in sample_topics(sample).items()}
+        messages: Dict[tuple, str] = {}
+        by_loop: Dict[asyncio.AbstractEventLoop, list] = {}
+        for subscription in subscriptions:
+            message = messages.get(subscription.topics)
+            if message is None:
+                body = ','.join(f'"{topic}":{fragments[topic]}' for topic in subscription.topics)
+                message = messages[subscription.topics] = \
+                    f'id: {self.seq}\ndata: {{"timestamp":{sample.timestamp},{body}}}\n\n'
+            by_loop.setdefault(subscription.loop, []).append((subscription, message))
+        # Один переход в каждый цикл событий на замер, а не на клиента
+        for loop, deliveries in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_deliver, deliveries)
+            except RuntimeError:  # цикл уже закрыт
+                for subscription, _ in deliveries:
+                    self.unsubscribe(subscription)
+
+
+def _deliver(deliveries):
+    for subscription, message in deliveries:
+        subscription.put(message)
+
+broadcaster = Broadcaster()
+sampler.subscribe(broadcaster.publish)
@@ -67,3 +67,724 @@ def test_dashboard_redirect(auth_headers):
     response = client.get("/dashboard", auth=auth_headers['valid'])
     assert response.status_code == 307  # Проверим, что происходит перенаправление (код 307)
     assert response.headers["location"] == "http://127.0.0.1:8050"  # Проверим, что перенаправление идет на дашборд
+
+def test_cpu_does_not_block(auth_headers):
+    import time
+    client.get("/cpu", auth=auth_headers['valid'])
+    start = time.perf_counter()
+    for _ in range(5):
+        response = client.get("/summary", auth=auth_headers['valid'])
+        assert response.status_code == 200
+    assert time.perf_counter() - start < 1  # раньше каждый запрос ждал 1 секунду
+
+def test_ring_buffer():
+    from sampler import RingBuffer
+    buffer = RingBuffer(3)
+    assert buffer.latest() is None
+    for i in range(5):
+        buffer.append(i)
+    assert buffer.latest() == 4
+    assert buffer.last(10) == [2, 3, 4]
+    assert len(buffer) == 3
+
+def test_history_buffer_ordered_view():
+    import numpy as np
+    from history import HistoryBuffer
+    history = HistoryBuffer(['a', 'b'], 3)
+    assert np.isnan(history.view()).all()
+    for i in range(5):
+        history.append(float(i), [i, i * 10])
+    view = history.view()
+    assert view.tolist() == [[2, 20], [3, 30], [4, 40]]
+    assert view.base is not None  # срез, а не копия
+    assert history.column('b').tolist() == [20, 30, 40]
+    assert history.timestamps().tolist() == [2.0, 3.0, 4.0]
+    assert history.latest().tolist() == [4, 40]
+
+def test_history_buffer_snapshot_matches_count():
+    from history import HistoryBuffer
+    history = HistoryBuffer(['a'], 3)
+    for i in range(4):
+        history.append(float(i), [i])
+    count, timestamps, rows = history.snapshot()
+    history.append(4.0, [4])
+    assert count == 4
+    assert timestamps[-2:].tolist() == [2.0, 3.0]
+    assert rows[-2:, 0].tolist() == [2, 3]
+
+    partial = HistoryBuffer(['a', 'b'], 4)
+    partial.append(1.0, [1, 10])
+    partial.append(2.0, [2, 20])
+    timestamps, values = partial.series('b')
+    assert timestamps.tolist() == [1.0, 2.0] and values.tolist() == [10, 20]
+    timestamps, values = history.series('a')
+    assert timestamps.tolist() == [2.0, 3.0, 4.0] and values.tolist() == [2, 3, 4]
+
+def test_dashboard_tick_sends_only_new_points():
+    import app
+    from history import HistoryBuffer
+    app.history = HistoryBuffer(app.history.columns, 10)
+    for i in range(12):
+        app.history.append(1_700_000_000 + i, [float(i)] * len(app.history.columns))
+    selected = [str(i + 1) for i in range(app.CPU_COUNT)]
+
+    outputs = app.update_status(1, 10, selected)
+    data, traces, max_points = outputs[1]
+    assert data['y'] == [[10.0, 11.0]] * app.CPU_COUNT
+    assert traces == list(range(app.CPU_COUNT)) and max_points == 10
+    assert outputs[-1] == 12
+
+    outputs = app.update_status(2, 12, selected)
+    assert outputs[1] is app.no_update
+
+    figure = app.build_figure('graph_network', selected)
+    assert [len(trace.y) for trace in figure.data] == [10, 10]
+
+    # Клиент пережил перезапуск сервера: его счётчик больше, чем в истории
+    outputs = app.update_status(3, 500, selected)
+    data, traces, max_points = outputs[1]
+    assert data['y'][0] == [float(i) for i in range(2, 12)] and max_points == 10
+    assert outputs[-1] == 12
+
+    # Перестроенный график CPU содержит ровно замеры клиента, остальное дошлёт тик
+    figure = app.update_cpu_figure(selected, 11)
+    assert list(figure.data[0].y) == [float(i) for i in range(2, 11)]
+    assert app.update_status(4, 11, selected)[1][0]['y'][0] == [11.0]
+
+def test_tiered_store_rollups():
+    import numpy as np
+    from tsdb import TieredStore
+    store = TieredStore(['a'], raw_size=10, minute_size=10, hour_size=10)
+    start = 1_700_000_000 // 3600 * 3600
+    for i in range(2 * 3600 + 61):
+        store.append(start + i, [float(i % 60)])
+    timestamps, means = store.minute.series('a', 'mean')
+    assert len(timestamps) == 10 and (np.diff(timestamps) == 60).all()
+    assert means.tolist() == [29.5] * 10
+    assert store.minute.series('a', 'max')[1].tolist() == [59.0] * 10
+    assert store.hour.series('a', 'min')[1].tolist() == [0.0, 0.0]
+    assert store.hour.series('a', 'last')[1].tolist() == [59.0, 59.0]
+    assert len(store.raw) == 10
+
+    budget = store.nbytes
+    for i in range(3600):
+        store.append(start + 3 * 3600 + i, [1.0])
+    assert store.nbytes == budget
+
+def test_lttb_keeps_extremes():
+    import numpy as np
+    from tsdb import lttb
+    x = np.arange(10_000, dtype=float)
+    y = np.zeros_like(x)
+    y[1234], y[7777] = 100, -100
+    dx, dy = lttb(x, y, 50)
+    assert len(dx) == 50 and dx[0] == 0 and dx[-1] == 9999
+    assert 100 in dy and -100 in dy
+
+def test_get_metric_history(auth_headers):
+    response = client.get("/history/ram", params={"points": 10}, auth=auth_headers['valid'])
+    assert response.status_code == 200
+    history = response.json()
+    assert history["resolution"] in ("raw", "minute", "hour")
+    assert len(history["values"]) <= 10
+    assert client.get("/history/nope", auth=auth_headers['valid']).status_code == 404
+    assert client.get("/history/ram", auth=auth_headers['invalid']).status_code == 401
+
+def test_segment_store_roundtrip(tmp_path):
+    import numpy as np
+    from segments import SegmentStore
+    store = SegmentStore(str(tmp_path), ['a', 'b'], rows_per_segment=100, batch_size=7,
+                         retention=float('inf'))
+    for i in range(250):
+        store.append(1000.0 + i, [i, -i])
+    store.close()
+
+    reopened = SegmentStore(str(tmp_path), ['a', 'b'], rows_per_segment=100)
+    assert [segment.rows for segment in reopened.segments] == [100, 100, 50]
+    views = reopened.scan(1090.0, 1110.0)
+    assert [len(view) for view in views] == [10, 11]
+    assert isinstance(views[0].base, np.memmap) or isinstance(views[0], np.memmap)
+    timestamps, values = reopened.column('b', 1098.0, 1101.0)
+    assert timestamps.tolist() == [1098.0, 1099.0, 1100.0, 1101.0]
+    assert values.tolist() == [-98.0, -99.0, -100.0, -101.0]
+    assert reopened.tail(3)['timestamp'].tolist() == [1247.0, 1248.0, 1249.0]
+
+def test_segment_store_never_overwrites_existing_segment(tmp_path):
+    from segments import SegmentStore
+    for restart in range(3):
+        # После перезапуска первая строка снова с тем же временем
+        store = SegmentStore(str(tmp_path), ['a'], batch_size=1, retention=float('inf'))
+        store.append(1000.0, [restart])
+        store.close()
+    reopened = SegmentStore(str(tmp_path), ['a'], retention=float('inf'))
+    assert [segment.rows for segment in reopened.segments] == [1, 1, 1]
+    assert reopened.tail(3)['values'][:, 0].tolist() == [0.0, 1.0, 2.0]
+
+def test_segment_store_compaction_and_retention(tmp_path):
+    from segments import SegmentStore
+    for run in range(3):  # три перезапуска — три мелких сегмента
+        store = SegmentStore(str(tmp_path), ['a'], rows_per_segment=100, batch_size=1)
+        for i in range(20):
+            store.append(1000.0 + run * 20 + i, [i])
+        store.close()
+    store = SegmentStore(str(tmp_path), ['a'], rows_per_segment=100)
+    assert len(store.segments) == 3
+    store.compact()
+    assert [segment.rows for segment in store.segments] == [60]
+    assert store.column('a', 0, 2000)[0].tolist() == [1000.0 + i for i in range(60)]
+
+    import time
+    start = time.time()
+    store = SegmentStore(str(tmp_path / 'recent'), ['a'], rows_per_segment=10, batch_size=1, retention=100)
+    for i in range(30):
+        store.append(start + i, [i])
+    assert len(store.segments) == 3
+    store.expire(now=start + 125)  # первые два сегмента целиком старше 100 секунд
+    assert store.oldest == float(f'{start + 20:.6f}')
+
+def test_segment_store_maintains_sealed_segments_in_background(tmp_path):
+    import threading
+    from segments import SegmentStore
+    for run in range(2):
+        store = SegmentStore(str(tmp_path), ['a'], rows_per_segment=100, batch_size=1)
+        for i in range(20):
+            store.append(1000.0 + run * 20 + i, [i])
+        store.close()
+    store = SegmentStore(str(tmp_path), ['a'], rows_per_segment=100, batch_size=1,
+                         retention=float('inf'))
+    threads = []
+    compact = store.compact
+    store.compact = lambda: (threads.append(threading.current_thread()), compact())
+    for i in range(100):
+        store.append(2000.0 + i, [i])
+    store.wait()
+    assert threads and threading.current_thread() not in threads
+    assert [segment.rows for segment in store.segments] == [40, 100]
+    store.close()
+
+def test_tiered_store_reads_archive_after_restart(tmp_path):
+    from segments import SegmentStore
+    from tsdb import TieredStore
+    archive = SegmentStore(str(tmp_path), ['a'], retention=float('inf'))
+    store = TieredStore(['a'], raw_size=10, minute_size=10, hour_size=10, archive=archive)
+    for i in range(1000):
+        store.append(1_700_000_000 + i, [float(i)])
+    archive.close()
+
+    restarted = TieredStore(['a'], raw_size=10, minute_size=10, hour_size=10,
+                            archive=SegmentStore(str(tmp_path), ['a'], retention=float('inf')))
+    assert restarted.raw.column('a').tolist() == [float(i) for i in range(990, 1000)]
+    history = restarted.query('a', start=1_700_000_000, end=1_700_000_999, max_points=1000)
+    assert history['resolution'] == 'disk'
+    assert history['values'] == [float(i) for i in range(1000)]
+
+def test_snapshot_returns_requested_subset(auth_headers):
+    response = client.get("/snapshot", params={"include": ["memory", "network"]}, auth=auth_headers['valid'])
+    assert response.status_code == 200
+    snapshot = response.json()
+    assert set(snapshot) == {"memory", "network"}
+    assert "percent" in snapshot["memory"] and "bytes_sent" in snapshot["network"]
+    assert set(client.get("/snapshot", auth=auth_headers['valid']).json()) == {
+        "cpu", "memory", "disk", "network", "summary"}
+    assert client.get("/snapshot", params={"include": "gpu"}, auth=auth_headers['valid']).status_code == 422
+
+def test_no_sample_yet_returns_503(auth_headers, monkeypatch):
+    from sampler import sampler
+    monkeypatch.setattr(sampler, "latest", lambda timeout=None: None)
+    for url in ("/cpu", "/summary"):
+        assert client.get(url, auth=auth_headers['valid']).status_code == 503
+    snapshot = client.get("/snapshot", params={"include": ["cpu", "memory"]}, auth=auth_headers['valid']).json()
+    assert snapshot["cpu"] is None and "percent" in snapshot["memory"]
+
+def test_collect_hides_only_timeouts(monkeypatch):
+    import asyncio
+    import collectors
+
+    async def slow():
+        raise asyncio.TimeoutError
+
+    async def broken():
+        raise RuntimeError("ошибка в сборщике")
+
+    monkeypatch.setitem(collectors.COLLECTORS, 'slow', slow)
+    monkeypatch.setitem(collectors.COLLECTORS, 'broken', broken)
+    assert asyncio.run(collectors.collect(['slow', 'memory']))['slow'] is None
+    with pytest.raises(RuntimeError):
+        asyncio.run(collectors.collect(['slow', 'broken']))
+
+def test_disk_partition_timeout(auth_headers, monkeypatch):
+    import threading
+    import time
+    import collectors
+    release = threading.Event()
+    real_disk_usage = collectors.psutil.disk_usage
+
+    def hanging_disk_usage(path):
+        release.wait(5)  # как зависшее сетевое хранилище
+        return real_disk_usage(path)
+
+    from cache import response_cache
+    monkeypatch.setattr(response_cache, 'ttl', 0)  # без кеша ответов
+    monkeypatch.setattr(collectors, 'PARTITION_TIMEOUT', 0.1)
+    monkeypatch.setattr(collectors.psutil, 'disk_usage', hanging_disk_usage)
+    try:
+        start = time.perf_counter()
+        response = client.get("/disk", auth=auth_headers['valid'])
+        assert response.status_code == 200
+        assert set(response.json().values()) == {"Нет ответа"}
+        assert time.perf_counter() - start < 1
+    finally:
+        release.set()
+
+def test_stream_sends_filtered_samples(auth_headers):
+    import json
+    with client.stream("GET", "/stream", params={"topics": "cpu", "limit": 1}, auth=auth_headers['valid']) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        for line in response.iter_lines():
+            if line.startswith("data: "):
+                event = json.loads(line[len("data: "):])
+                break
+    assert set(event) == {"timestamp", "cpu"}
+    assert "cpu_percent" in event["cpu"]
+    assert client.get("/stream", auth=auth_headers['invalid']).status_code == 401
+
+def test_broadcaster_drops_oldest_for_slow_client():
+    import asyncio
+    import sampler as sampler_module
+    from streaming import Broadcaster
+
+    async def scenario():
+        broadcaster = Broadcaster()
+        slow = broadcaster.subscribe(['memory'], size=2)
+        fast = broadcaster.subscribe(['cpu', 'memory'], size=10)
+        for _ in range(5):
+            broadcaster.publish(sampler_module.collect_sample())
+        await asyncio.sleep(0)  # доставка идёт через call_soon_threadsafe
+        assert slow.queue.qsize() == 2 and slow.dropped == 3
+        assert fast.queue.qsize() == 5
+        assert (await slow.get()).startswith('id: 4\n')
+        broadcaster.unsubscribe(slow)
+        assert len(broadcaster) == 1
+
+    asyncio.run(scenario())
+
+def test_broadcaster_writes_strict_json_for_every_topic():
+    import asyncio
+    import json
+    import sampler as sampler_module
+    from streaming import Broadcaster
+
+    async def scenario():
+        broadcaster = Broadcaster()
+        subscription = broadcaster.subscribe(['cpu', 'memory', 'disk', 'network', 'summary'])
+        sample = sampler_module.collect_sample()
+        nan = float('nan')
+        sample = sample._replace(cpu_total=nan, cpu_percent=[nan, float('inf')], upload_speed=nan,
+                                 memory=sample.memory._replace(percent=nan))
+        broadcaster.publish(sample)
+        await asyncio.sleep(0)
+        message = await subscription.get()
+        payload = json.loads(message.split('data: ', 1)[1], parse_constant=lambda token: 1 / 0)
+        assert payload['cpu']['cpu_total'] is None and payload['cpu']['cpu_percent'] == [None, None]
+        assert payload['memory']['percent'] is None and payload['summary']['memory'] is None
+        assert payload['network']['upload_speed'] is None
+
+    asyncio.run(scenario())
+
+def test_process_tracker_top(monkeypatch):
+    import os
+    from processes import ProcessTracker
+    tracker = ProcessTracker()
+    tracker.refresh()
+    sum(i * i for i in range(2_000_000))  # немного нагрузим текущий процесс
+    tracker.refresh()
+    top = tracker.top(5, 'cpu')
+    assert len(top) <= 5
+    assert [stat.cpu_percent for stat in top] == sorted((stat.cpu_percent for stat in top), reverse=True)
+    assert os.getpid() in [stat.pid for stat in top]
+    assert tracker.top(1, 'rss')[0].rss == max(stat.rss for stat in tracker._stats)
+
+def test_process_tracker_walks_on_own_thread():
+    import threading
+    import time
+    from processes import ProcessTracker
+    tracker = ProcessTracker(interval=0.05)
+    threads = []
+    refresh = tracker.refresh
+    tracker.refresh = lambda: (threads.append(threading.current_thread().name), refresh())
+    tracker.start()
+    deadline = time.monotonic() + 10
+    while len(threads) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    tracker.stop()
+    assert set(threads) == {'process-tracker'} and len(threads) >= 2
+    assert tracker.timestamp is not None and tracker.top(1)
+
+def test_get_top_processes(auth_headers):
+    response = client.get("/processes", params={"n": 3, "sort": "rss"}, auth=auth_headers['valid'])
+    assert response.status_code == 200
+    processes = response.json()["processes"]
+    assert 0 < len(processes) <= 3
+    assert set(processes[0]) == {"pid", "name", "cpu_percent", "rss", "io_rate"}
+    assert [p["rss"] for p in processes] == sorted((p["rss"] for p in processes), reverse=True)
+    assert client.get("/processes", params={"sort": "gpu"}, auth=auth_headers['valid']).status_code == 422
+
+def test_password_hash_and_cache():
+    import asyncio
+    from security import UserStore, hash_password, verify_password
+    encoded = hash_password("secret", iterations=1000)
+    assert encoded.startswith("pbkdf2_sha256$1000$") and "secret" not in encoded
+    assert verify_password("secret", encoded) and not verify_password("Secret", encoded)
+
+    store = UserStore()
+    store.set_password("admin", "secret")
+    calls = []
+    check = store.check
+    store.check = lambda *args: calls.append(args) or check(*args)
+    assert asyncio.run(store.verify("admin", "secret"))
+    assert asyncio.run(store.verify("admin", "secret"))
+    assert len(calls) == 1  # второй раз — из кеша
+    assert not asyncio.run(store.verify("admin", "wrong"))
+    assert not asyncio.run(store.verify("nobody", "secret"))
+    store.set_password("admin", "changed")
+    assert not asyncio.run(store.verify("admin", "secret"))
+
+    # Смена пароля во время проверки: старый пароль не попадает в кеш
+    store.check = lambda *args: (check(*args), store.set_password("admin", "newer"))[0]
+    assert asyncio.run(store.verify("admin", "changed"))
+    store.check = check
+    assert not asyncio.run(store.verify("admin", "changed"))
+    assert asyncio.run(store.verify("admin", "newer"))
+
+def test_token_auth(auth_headers):
+    response = client.post("/token", auth=auth_headers['valid'])
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+    assert client.get("/cpu", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+    assert client.get("/cpu", headers={"Authorization": f"Bearer {token}x"}).status_code == 401
+    assert client.post("/token", auth=auth_headers['invalid']).status_code == 401
+    response = client.get("/cpu")
+    assert response.status_code == 401
+    assert response.headers["www-authenticate"] == "Basic"
+
+def test_cached_responses_and_conditional_requests(auth_headers, monkeypatch):
+    from cache import response_cache
+    monkeypatch.setattr(response_cache, 'ttl', 3600)
+    response_cache._entries.clear()
+    first = client.get("/memory", auth=auth_headers['valid'])
+    assert first.status_code == 200 and "percent" in first.json()
+    etag = first.headers["etag"]
+    assert "last-modified" in first.headers
+
+    before = response_cache.snapshot()["memory"]
+    second = client.get("/memory", auth=auth_headers['valid'])
+    assert second.content == first.content and second.headers["etag"] == etag
+
+    response = client.get("/memory", headers={"If-None-Match": etag}, auth=auth_headers['valid'])
+    assert response.status_code == 304 and response.content == b""
+    response = client.get("/memory", headers={"If-Modified-Since": first.headers["last-modified"]},
+                          auth=auth_headers['valid'])
+    assert response.status_code == 304
+    assert client.get("/memory", headers={"If-None-Match": '"other"'}, auth=auth_headers['valid']).status_code == 200
+
+    stats = client.get("/cache/stats", auth=auth_headers['valid']).json()["memory"]
+    assert stats["hits"] == before["hits"] + 4 and stats["misses"] == before["misses"]
+    assert stats["not_modified"] == before["not_modified"] + 2
+
+def test_response_cache_single_flight():
+    import asyncio
+    from cache import ResponseCache
+
+    async def scenario():
+        cache = ResponseCache(ttl=60)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"value": 1}
+
+        entries = await asyncio.gather(*(cache.get("key", compute) for _ in range(20)))
+        assert len(calls) == 1
+        assert len({entry.body for entry in entries}) == 1
+        assert cache.snapshot()["key"] == {"hits": 19, "misses": 1, "not_modified": 0}
+
+    asyncio.run(scenario())
+
+def test_response_cache_survives_cancelled_first_caller():
+    import asyncio
+    from cache import ResponseCache
+
+    async def scenario():
+        cache = ResponseCache(ttl=60)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            return {"value": 1}
+
+        first = asyncio.ensure_future(cache.get("key", compute))
+        await asyncio.sleep(0)
+        others = [asyncio.ensure_future(cache.get("key", compute)) for _ in range(3)]
+        await asyncio.sleep(0)
+        first.cancel()  # клиент, начавший вычисление, отключился
+        entries = await asyncio.gather(*others)
+        assert first.cancelled() and len(calls) == 1
+        assert [entry.body for entry in entries] == [b'{"value":1}'] * 3
+        assert (await cache.get("key", compute)).body == b'{"value":1}' and len(calls) == 1
+
+    asyncio.run(scenario())
+
+def test_net_rate_engine_wrap_reset_and_smoothing():
+    from collections import namedtuple
+    from netrate import NetRateEngine, WRAP_32
+    Counters = namedtuple('Counters', 'bytes_sent bytes_recv')
+    engine = NetRateEngine(smoothing=0)
+    assert engine.update(0.0, {'eth0': Counters(WRAP_32 - 100, 0)}) == {}
+    rates = engine.update(1.0, {'eth0': Counters(50, 1000), 'lo': Counters(0, 0)})
+    assert rates['eth0'].sent == 150 and rates['eth0'].recv == 1000  # переполнение 32 бит
+    assert 'lo' not in rates  # новый интерфейс — нужен второй замер
+    rates = engine.update(3.0, {'eth0': Counters(10, 1000), 'lo': Counters(400, 400)})
+    assert rates['eth0'].sent == 150  # сброс: прежняя скорость, без скачка
+    assert rates['lo'].sent == 200
+    assert engine.total() == (350, 1200)
+
+    smoothed = NetRateEngine(smoothing=10)
+    smoothed.update(0.0, {'eth0': Counters(0, 0)})
+    smoothed.update(1.0, {'eth0': Counters(100, 0)})
+    rate = smoothed.update(2.0, {'eth0': Counters(1100, 0)})['eth0']
+    assert rate.sent == 1000 and 100 < rate.sent_smoothed < 300
+
+def test_network_rates_do_not_depend_on_viewers(auth_headers):
+    import sampler as sampler_module
+    from cache import response_cache
+    response_cache._entries.clear()
+    calls = []
+    real = sampler_module.psutil.net_io_counters
+    sampler_module.psutil.net_io_counters = lambda *args, **kwargs: calls.append(1) or real(*args, **kwargs)
+    try:
+        for _ in range(5):
+            network = client.get("/network", auth=auth_headers['valid']).json()
+    finally:
+        sampler_module.psutil.net_io_counters = real
+    assert calls == []  # API читает общий замер, а не psutil
+    assert "interfaces" in network and "bytes_sent" in network
+
+def test_history_buffer_extend_wraps():
+    import numpy as np
+    from history import HistoryBuffer
+    history = HistoryBuffer(['a'], 4)
+    history.append(0.0, [0])
+    history.extend([1.0, 2.0, 3.0, 4.0, 5.0], np.arange(1, 6).reshape(-1, 1))
+    assert history.view().ravel().tolist() == [2, 3, 4, 5]
+    assert history.timestamps().tolist() == [2.0, 3.0, 4.0, 5.0]
+    assert history.count == 6 and history.latest().tolist() == [5]
+
+def test_fleet_ingest_and_rollups(auth_headers):
+    import json
+    import time
+    import zlib
+    import fleet
+    from fastapi_server import fleet_store
+    now = time.time()
+    for i in range(20):
+        rows = [[now - 1, i, i * 5, 50, 0, 0], [now, i * 2, i * 5, 50, 0, 0]]
+        response = client.post("/ingest", content=fleet.encode_frame(f"node-{i:02d}", rows),
+                               headers={"Content-Type": fleet.FRAME_MEDIA_TYPE}, auth=auth_headers['valid'])
+        assert response.json() == {"accepted": 2}
+    summary = client.get("/fleet", params={"n": 3}, auth=auth_headers['valid']).json()
+    assert summary["online"] >= 20
+    assert [host["host"] for host in summary["top_cpu"]][:3] == ["node-19", "node-18", "node-17"]
+    assert summary["rollups"]["ram"]["p95"] >= 85
+    history = client.get("/fleet/node-03", auth=auth_headers['valid']).json()
+    assert history["cpu"] == [3.0, 6.0]
+    assert client.post("/ingest", content=b"garbage", auth=auth_headers['valid']).status_code == 400
+    for rows in ([now, 1, 2, 3, 4, 5], [[now, "95", 2, 3, 4, 5]]):
+        body = zlib.compress(json.dumps({"host": "bad-node", "columns": fleet.COLUMNS, "rows": rows}).encode())
+        response = client.post("/ingest", content=body, auth=auth_headers['valid'])
+        assert response.status_code == 400
+    assert "bad-node" not in fleet_store.hosts
+    assert client.post("/ingest", content=fleet.encode_frame("x", []), auth=auth_headers['invalid']).status_code == 401
+    assert client.get("/fleet/unknown", auth=auth_headers['valid']).status_code == 404
+    assert fleet_store.hosts["node-00"].count == 2
+
+def test_fleet_store_rejects_malformed_rows_and_extra_hosts():
+    import pytest
+    import fleet
+    store = fleet.FleetStore(depth=10, max_hosts=2)
+    good = [[1.0, 10, 20, 30, 0, 0]]
+    for rows in ([1, 2, 3, 4, 5, 6], [[1, 2, 3], [4, 5, 6]], [[1, 2, 3, 4, 5, 6], [1, 2, 3]],
+                 [[1.0, "95", 20, 30, 0, 0]], [[1.0, None, 20, 30, 0, 0]], [[[1, 2, 3, 4, 5, 6]]],
+                 [[float("nan"), 1, 2, 3, 4, 5]]):
+        with pytest.raises(fleet.FrameError):
+            store.ingest({"host": "a", "rows": rows})
+    assert store.hosts == {} and store.ingested == 0
+    assert store.ingest({"host": "a", "rows": good}).tolist() == [[1.0, 10.0, 20.0, 30.0, 0.0, 0.0]]
+    assert len(store.ingest({"host": "empty", "rows": []})) == 0
+    assert "empty" not in store.hosts and "empty" not in store.last_seen
+    assert len(store.ingest({"host": "b", "rows": good})) == 1
+    with pytest.raises(fleet.FrameError):
+        store.ingest({"host": "c", "rows": good})
+    assert sorted(store.hosts) == ["a", "b"]
+    assert len(store.ingest({"host": "a", "rows": good})) == 1
+
+def test_alert_engine_hysteresis_and_dedup():
+    from alerts import AlertEngine, RateRule, Rule, ZScoreRule
+    received = []
+    engine = AlertEngine([Rule('cpu_high', 'cpu', 90, clear=80, for_samples=2),
+                          RateRule('ram_jump', 'ram', 10, clear=1),
+                          ZScoreRule('net_anomaly', 'bytes_sent', 5, clear=1, window=10)],
+                         [received.append])
+    cpu = [50, 95, 85, 95, 96, 97, 85, 91, 79, 95]
+    for i, value in enumerate(cpu):
+        engine.observe('host', float(i), {'cpu': value})
+    engine.flush()
+    assert [(alert.rule, alert.state, alert.timestamp) for alert in received] == [
+        ('cpu_high', 'firing', 4.0), ('cpu_high', 'resolved', 8.0)]  # 85 и 91 — в полосе гистерезиса
+    assert engine.active() == []
+
+    received.clear()
+    for i, value in enumerate([10, 12, 40, 41, 41]):
+        engine.observe('db', float(i), {'ram': value})
+    for i in range(30):
+        engine.observe('db', float(i), {'bytes_sent': 100.0 + (i % 2) if i != 20 else 1000.0})
+    engine.flush()
+    assert [(alert.rule, alert.state, alert.host) for alert in received] == [
+        ('ram_jump', 'firing', 'db'), ('ram_jump', 'resolved', 'db'),
+        ('net_anomaly', 'firing', 'db'), ('net_anomaly', 'resolved', 'db')]
+
+def test_zscore_rule_stays_exact_on_large_values():
+    import random
+    import statistics
+    from alerts import ZScoreRule
+    rule = ZScoreRule('net_anomaly', 'bytes_recv', 4, window=60)
+    state, values = {}, []
+    generator = random.Random(1)
+    for i in range(20_000):
+        # Скорость сети ~1e9 Б/с со скачками уровня, на которых копится ошибка округления
+        value = 5e8 + generator.gauss(0, 1000) + (4e8 if i // 5000 % 2 else 0)
+        z = rule.score(state, float(i), value)
+        values.append(value)
+    window = values[-61:-1]
+    expected = (values[-1] - statistics.fmean(window)) / statistics.pstdev(window)
+    assert abs(z - expected) < 1e-6
+
+def test_alert_rules_with_same_name_keep_separate_state():
+    from alerts import AlertEngine, Rule
+    received = []
+    engine = AlertEngine([Rule('cpu_high', 'cpu', 80, clear=70), Rule('cpu_high', 'cpu', 95, clear=90)],
+                         [received.append])
+    for i, value in enumerate([85, 97, 92, 75, 60]):
+        engine.observe('host', float(i), {'cpu': value})
+    engine.flush()
+    assert [(alert.state, alert.timestamp) for alert in received] == [
+        ('firing', 0.0), ('firing', 1.0), ('resolved', 3.0), ('resolved', 4.0)]
+
+def test_alert_engine_checks_fleet_frames_on_own_thread():
+    import time
+    from alerts import AlertEngine, Rule
+    received = []
+    engine = AlertEngine([Rule('cpu_high', 'cpu', 90)], [received.append], inbox_size=1)
+    with engine._lock:  # поток правил занят: submit не ждёт, лишние кадры отбрасываются
+        assert engine.submit('node', ['cpu', 'ram'], [[1.0, 95, 10]])
+        while not engine._inbox.empty():
+            time.sleep(0.01)
+        assert engine.submit('node', ['cpu', 'ram'], [[2.0, 50, 10], [3.0, 99, 10]])
+        assert not engine.submit('node', ['cpu', 'ram'], [[4.0, 99, 10]])
+    engine.flush()
+    assert engine.dropped_frames == 1
+    assert [(alert.state, alert.timestamp) for alert in received] == [('firing', 1.0), ('resolved', 2.0),
+                                                                      ('firing', 3.0)]
+
+def test_alert_rules_per_host_state(auth_headers):
+    import time
+    import alerts
+    import fleet
+    now = time.time()
+    for host in ("hot-node", "cold-node"):
+        value = 99 if host == "hot-node" else 10
+        rows = [[now + i, 1, 1, value, 0, 0] for i in range(3)]
+        client.post("/ingest", content=fleet.encode_frame(host, rows), auth=auth_headers['valid'])
+    alerts.engine.flush()
+    active = client.get("/alerts", auth=auth_headers['valid']).json()["active"]
+    assert {"rule": "disk_full", "host": "hot-node", "since": now} in active
+    assert all(alert["host"] != "cold-node" for alert in active)
+
+def test_metrics_endpoint(auth_headers):
+    import time
+    import fleet
+    assert client.get("/metrics").status_code == 401
+    client.get("/cpu", auth=auth_headers['valid'])
+    rows = [[time.time(), 12.5, 40, 50, 0, 0]]
+    client.post("/ingest", content=fleet.encode_frame("metrics-node", rows), auth=auth_headers['valid'])
+    response = client.get("/metrics", auth=auth_headers['valid'])
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.text.splitlines()
+    assert any(line.startswith('monitor_cpu_percent{cpu="total"} ') for line in lines)
+    assert any(line.startswith('monitor_memory_percent ') for line in lines)
+    assert 'monitor_fleet_value{host="metrics-node",metric="cpu"} 12.5' in lines
+    labels = 'method="GET",route="/cpu",status="200"'
+    assert any(line.startswith(f'monitor_http_requests_total{{{labels}}} ') for line in lines)
+    assert any(line.startswith(f'monitor_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} ')
+               for line in lines)
+
+def test_host_metrics_rendered_once_per_sample():
+    import metrics
+    from sampler import sampler
+    sample = sampler.latest()
+    host = metrics.HostMetrics()
+    first = host.lines(sample)
+    assert host.lines(sample) is first
+    assert host.lines(sample._replace(timestamp=sample.timestamp + 1)) is not first
+    assert metrics.number(float('nan')) == 'NaN'
+
+def test_profile_endpoint(auth_headers):
+    assert client.get("/admin/profile").status_code == 401
+    assert client.post("/admin/profile/reset").status_code == 401
+    report = client.get("/admin/profile", auth=auth_headers['valid']).json()
+    assert report["enabled"] is False
+    assert report["routes"] == []
+    assert client.post("/admin/profile/reset", auth=auth_headers['valid']).status_code == 200
+
+def test_profiling_phases_and_blocked_loop():
+    import time
+    from fastapi import FastAPI
+    import profiling
+    # Без выборки: разбираются только запросы маршрутов, которые уже были медленными
+    profiler = profiling.RequestProfiler(slow_threshold=0.05, profile_rate=1.0, sample_rate=0.0)
+    profiled = FastAPI()
+    profiling.install(profiled, profiler)
+
+    @profiled.get("/blocking")
+    async def blocking_endpoint():
+        time.sleep(0.12)  # блокирует цикл событий, как медленный вызов psutil
+        return {"ok": True}
+
+    @profiled.get("/items/{id}")
+    def get_item(id: int):
+        return {"id": id}
+
+    profiled_client = TestClient(profiled)
+    for _ in range(2):
+        assert profiled_client.get("/blocking").json() == {"ok": True}
+    assert profiled_client.get("/items/1").json() == {"id": 1}
+    assert profiled_client.get("/missing").status_code == 404
+
+    report = profiler.report()
+    routes = {route["route"]: route for route in report["routes"]}
+    assert routes["/blocking"]["total"]["count"] == 2
+    assert routes["/blocking"]["handler"]["count"] == 1
+    assert routes["/blocking"]["handler"]["p50_ms"] >= 120
+    assert routes["/items/{id}"]["total"]["count"] == 1
+    assert routes["/items/{id}"]["validation"]["count"] == 0
+    assert routes["<unmatched>"]["handler"]["count"] == 0
+    slow = report["slow"]
+    assert [entry["route"] for entry in slow] == ["/blocking", "/blocking"]
+    assert slow[0]["stack"] is None and slow[0]["phases_ms"] == {}
+    assert "blocking_endpoint" in slow[1]["stack"]
+    assert slow[1]["phases_ms"]["handler"] >= 120
+    # Асинхронный обработчик делит поток с другими запросами — cProfile для него не включается
+    assert slow[0]["profile"] is None and slow[1]["profile"] is None
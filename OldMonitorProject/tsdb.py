@@ -0,0 +1,209 @@
+import os
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import psutil
+
+from history import HistoryBuffer
+from sampler import sampler
+from segments import SegmentStore
+
+# Глубина каждого уровня в строках. По умолчанию: час сырых замеров,
+# неделя минутных и год часовых агрегатов
+RAW_SIZE = int(os.environ.get('MONITOR_HISTORY_SIZE', '3600'))
+MINUTE_SIZE = int(os.environ.get('MONITOR_MINUTE_SIZE', str(7 * 24 * 60)))
+HOUR_SIZE = int(os.environ.get('MONITOR_HOUR_SIZE', str(365 * 24)))
+
+# Каталог архива сырых замеров на диске (если не задан, история живёт
+# только в памяти) и срок хранения архива в днях
+DATA_DIR = os.environ.get('MONITOR_DATA_DIR')
+RETENTION_DAYS = float(os.environ.get('MONITOR_RETENTION_DAYS', '30'))
+
+AGGREGATES = ('min', 'max', 'mean', 'last')
+
+
+def metric_columns(cpu_count: int) -> List[str]:
+    return ([f'cpu{i + 1}' for i in range(cpu_count)]
+            + ['ram', 'disk_usage', 'bytes_sent', 'bytes_recv'])
+
+
+def sample_row(sample) -> List[float]:
+    return list(sample.cpu_percent) + [sample.memory.percent, sample.disk.percent,
+                                       sample.upload_speed, sample.download_speed]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Прореживание Largest-Triangle-Three-Buckets.
+
+    Из каждой корзины остаётся точка, образующая наибольший треугольник
+    с предыдущей выбранной точкой и средним следующей корзины, поэтому
+    пики и провалы сохраняются, а не усредняются.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x, y
+    every = (n - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a])
+                      - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return x[selected], y[selected]
+
+
+class RollupTier:
+    """Уровень агрегатов с шагом step секунд.
+
+    Открытая корзина копится в нескольких векторах (O(число колонок)
+    на замер); при переходе в следующую корзину min/max/mean/last
+    записываются одной строкой в кольцевой буфер фиксированной глубины.
+    """
+
+    def __init__(self, columns: Sequence[str], step: int, depth: int):
+        self.step = step
+        self.columns = list(columns)
+        self.buffer = HistoryBuffer([f'{column}:{agg}' for agg in AGGREGATES for column in columns], depth)
+        self._bucket: Optional[float] = None
+        self._reset()
+
+    def _reset(self):
+        n = len(self.columns)
+        self._min = np.full(n, np.nan)
+        self._max = np.full(n, np.nan)
+        self._sum = np.zeros(n)
+        self._counts = np.zeros(n)
+        self._last = np.full(n, np.nan)
+
+    def add(self, timestamp: float, mins, maxs, sums, counts, last):
+        """Добавить в корзину частичный агрегат; возвращает агрегат
+        закрытой корзины (для следующего уровня) или None."""
+        bucket = timestamp // self.step * self.step
+        closed = None
+        if self._bucket is not None and bucket != self._bucket:
+            closed = self.flush()
+        self._bucket = bucket
+        self._min = np.fmin(self._min, mins)
+        self._max = np.fmax(self._max, maxs)
+        self._sum += sums
+        self._counts += counts
+        self._last = np.where(np.isnan(last), self._last, last)
+        return closed
+
+    def flush(self):
+        if self._bucket is None:
+            return None
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self._sum / self._counts
+        self.buffer.append(self._bucket, np.concatenate([self._min, self._max, mean, self._last]))
+        closed = (self._bucket, self._min, self._max, self._sum, self._counts, self._last)
+        self._bucket = None
+        self._reset()
+        return closed
+
+    def series(self, column: str, agg: str = 'mean') -> Tuple[np.ndarray, np.ndarray]:
+        return self.buffer.series(f'{column}:{agg}')
+
+
+class TieredStore:
+    """История метрик в трёх разрешениях: сырые замеры, минуты и часы.
+
+    Все уровни — заранее выделенные кольцевые буферы, поэтому объём
+    памяти задаётся глубинами уровней и не растёт со временем. Если задан
+    archive, сырые замеры дублируются на диск, а диапазоны старше
+    агрегатов в памяти читаются оттуда.
+    """
+
+    def __init__(self, columns: Sequence[str], raw_size: int = RAW_SIZE,
+                 minute_size: int = MINUTE_SIZE, hour_size: int = HOUR_SIZE,
+                 archive: Optional[SegmentStore] = None):
+        self.columns = list(columns)
+        self.raw = HistoryBuffer(self.columns, raw_size)
+        self.minute = RollupTier(self.columns, 60, minute_size)
+        self.hour = RollupTier(self.columns, 3600, hour_size)
+        self.archive = archive
+        self._lock = threading.Lock()
+        if archive is not None:
+            # Поднимаем с диска только хвост для сырого уровня, поэтому
+            # старт не зависит от объёма архива
+            for row in archive.tail(raw_size):
+                self.raw.append(row['timestamp'], row['values'])
+
+    @property
+    def nbytes(self) -> int:
+        """Память, занятая буферами всех уровней."""
+        return sum(buffer._data.nbytes + buffer._timestamps.nbytes
+                   for buffer in (self.raw, self.minute.buffer, self.hour.buffer))
+
+    def append(self, timestamp: float, row: Sequence[float]):
+        row = np.asarray(row, dtype=float)
+        counts = (~np.isnan(row)).astype(float)
+        with self._lock:
+            self.raw.append(timestamp, row)
+            if self.archive is not None:
+                self.archive.append(timestamp, row)
+            closed = self.minute.add(timestamp, row, row, np.nan_to_num(row), counts, row)
+            if closed is not None:
+                self.hour.add(*closed)
+
+    def add_sample(self, sample):
+        self.append(sample.timestamp, sample_row(sample))
+
+    def series(self, resolution: str, column: str, agg: str = 'mean') -> Tuple[np.ndarray, np.ndarray]:
+        if resolution == 'raw':
+            return self.raw.series(column)
+        return getattr(self, resolution).series(column, agg)
+
+    def pick_resolution(self, start: float) -> str:
+        """Самый подробный уровень, история которого покрывает start."""
+        oldest = None
+        for resolution in ('raw', 'minute', 'hour'):
+            timestamps, _ = self.series(resolution, self.columns[0])
+            if len(timestamps) and timestamps[0] <= start:
+                return resolution
+            if len(timestamps):
+                oldest = timestamps[0] if oldest is None else min(oldest, timestamps[0])
+        if self.archive is not None and self.archive.oldest is not None \
+                and (oldest is None or self.archive.oldest < oldest):
+            return 'disk'
+        return 'hour'
+
+    def query(self, column: str, start: Optional[float] = None, end: Optional[float] = None,
+              max_points: int = 500, agg: str = 'mean', resolution: Optional[str] = None) -> dict:
+        """Ряд метрики за [start, end], не длиннее max_points точек."""
+        if column not in self.columns:
+            raise KeyError(column)
+        if agg not in AGGREGATES:
+            raise ValueError(f'Неизвестный агрегат: {agg}')
+        if resolution == 'disk' and self.archive is None:
+            raise ValueError('Архив на диске не настроен')
+        end = time.time() if end is None else end
+        start = end - 3600 if start is None else start
+        resolution = resolution or self.pick_resolution(start)
+        if resolution == 'disk':
+            timestamps, values = self.archive.column(column, start, end)
+        else:
+            timestamps, values = self.series(resolution, column, agg)
+        mask = (timestamps >= start) & (timestamps <= end) & ~np.isnan(values)
+        timestamps, values = lttb(timestamps[mask], values[mask], max_points)
+        return {
+            'metric': column,
+            'resolution': resolution,
+            'agg': None if resolution in ('raw', 'disk') else agg,
+            'timestamps': timestamps.tolist(),
+            'values': values.tolist(),
+        }
+
+
+# Общее хранилище, пополняется фоновым сборщиком
+COLUMNS = metric_columns(psutil.cpu_count())
+metrics_store = TieredStore(COLUMNS, archive=SegmentStore(DATA_DIR, COLUMNS, retention=RETENTION_DAYS * 86_400)
+                            if DATA_DIR else None)
+sampler.subscribe(metrics_store.add_sample)
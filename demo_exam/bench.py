@@ -0,0 +1,222 @@
+"""Benchmarks for the item store.
+
+Run from the repository root, for example::
+
+    python -m demo_exam.bench search --sizes 10000 100000 1000000
+    python -m demo_exam.bench bulk --sizes 1000000
+    python -m demo_exam.bench memory --sizes 1000000
+    python -m demo_exam.bench serialize --sizes 1000 100000
+    python -m demo_exam.bench profiling --sizes 10000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import tracemalloc
+
+from .columnar import ColumnarItemStore
+from .store import ItemStore
+
+WORDS = ['red', 'green', 'blue', 'book', 'magazine', 'novel', 'guide', 'atlas',
+         'poster', 'comic', 'deluxe', 'pocket', 'vintage', 'signed', 'limited',
+         'edition', 'classic', 'modern', 'history', 'science', 'travel', 'cook']
+CATEGORIES = ['Book', 'Magazine', 'Comic', 'Poster', 'Atlas']
+
+
+def make_items(count: int, seed: int = 0):
+    rnd = random.Random(seed)
+    for id in range(1, count + 1):
+        yield {
+            'id': id,
+            'title': ' '.join(rnd.choices(WORDS, k=3)) + f' {id}',
+            'description': ' '.join(rnd.choices(WORDS, k=8)),
+            'category': rnd.choice(CATEGORIES),
+            'price': float(rnd.randint(1, 1000)),
+            'discount': rnd.choice([None, 5.0, 10.0, 15.0]),
+            'quantity': rnd.randint(0, 100),
+        }
+
+
+def timed(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_search(sizes, repeat: int):
+    queries = ['vintage atlas', 'signed', '4242', 'cook poster 1']
+    print(f"{'items':>10} {'query':>15} {'linear ms':>10} {'index ms':>10} {'speedup':>8}")
+    for size in sizes:
+        store = ItemStore()
+        for item in make_items(size):
+            store.add(item)
+        catalog = store.all()
+        for query in queries:
+            q = query.lower()
+            linear = timed(lambda: [item for item in catalog if q in item['title'].lower()], repeat)
+            indexed = timed(lambda: store.filter(title=query), repeat)
+            assert store.filter(title=query) == [item for item in catalog if q in item['title'].lower()]
+            print(f'{size:>10} {query:>15} {linear * 1000:>10.2f} {indexed * 1000:>10.2f} '
+                  f'{linear / indexed:>7.1f}x')
+
+
+def bench_bulk(sizes, batch: int):
+    from fastapi.testclient import TestClient
+
+    from . import main as api
+
+    client = TestClient(api.app)
+    print(f"{'items':>10} {'single items/s':>15} {'bulk items/s':>13} {'speedup':>8}")
+    for size in sizes:
+        rows = [{k: v for k, v in item.items() if k != 'id'} for item in make_items(size)]
+        single_rows = rows[:min(size, 5_000)]
+        api.items = api.ItemStore()
+        start = time.perf_counter()
+        for row in single_rows:
+            client.post('/items', json=row)
+        single_rate = len(single_rows) / (time.perf_counter() - start)
+
+        api.items = api.ItemStore()
+        start = time.perf_counter()
+        for i in range(0, size, batch):
+            body = '\n'.join(json.dumps(row) for row in rows[i:i + batch])
+            client.post('/items/bulk', content=body, headers={'content-type': 'application/x-ndjson'})
+        bulk_rate = size / (time.perf_counter() - start)
+        assert len(api.items) == size
+        print(f'{size:>10} {single_rate:>15.0f} {bulk_rate:>13.0f} {bulk_rate / single_rate:>7.1f}x')
+
+
+def bench_memory(sizes):
+    def dict_list(rows):
+        return list(rows)
+
+    def build(store_class):
+        def fill(rows):
+            store = store_class()
+            for row in rows:
+                store.add(row)
+            return store
+        return fill
+
+    layouts = [('dict list', dict_list), ('ItemStore', build(ItemStore)),
+               ('columnar', build(ColumnarItemStore))]
+    print(f"{'items':>10} {'layout':>10} {'MiB':>9} {'bytes/item':>11}")
+    for size in sizes:
+        for name, fill in layouts:
+            rows = make_items(size)
+            tracemalloc.start()
+            catalog = fill(rows)
+            used, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del catalog
+            print(f'{size:>10} {name:>10} {used / 2 ** 20:>9.1f} {used / size:>11.0f}')
+
+
+def bench_serialize(sizes, repeat: int):
+    from fastapi.testclient import TestClient
+
+    from . import main as api
+    from . import serialization
+
+    client = TestClient(api.app)
+    print(f"{'items':>10} {'validated ms':>13} {'fast ms':>9} {'speedup':>8}")
+    for size in sizes:
+        api.items = api.ItemStore()
+        for item in make_items(size):
+            api.items.add(item)
+        results = {}
+        for fast in (False, True):
+            serialization.FAST_SERIALIZATION = fast
+            results[fast] = timed(lambda: client.get('/items'), repeat)
+        print(f'{size:>10} {results[False] * 1000:>13.2f} {results[True] * 1000:>9.2f} '
+              f'{results[False] / results[True]:>7.1f}x')
+
+
+REQUESTS = [('/items/1', b''), ('/items', b'after_id=5000&limit=20'), ('/items', b'limit=1000')]
+
+
+def profiled_copy(app):
+    """The same routes and middleware as app, with profiling installed."""
+    from fastapi import FastAPI
+    from fastapi.routing import APIRoute
+
+    from . import profiling
+
+    copy = FastAPI()
+    copy.router.route_class = profiling.ProfiledRoute
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            copy.add_api_route(route.path, route.endpoint, response_model=route.response_model,
+                               methods=route.methods, name=route.name)
+    copy.user_middleware = list(app.user_middleware)
+    copy.add_middleware(profiling.ProfilingMiddleware, profiler=profiling.RequestProfiler())
+    return copy
+
+
+def bench_profiling(size: int, repeat: int):
+    """Request latency without and with profiling.
+
+    Requests go straight to the ASGI apps, without HTTP or a test client,
+    so the overhead is not hidden behind transport costs. The two apps
+    serve alternate requests and medians are compared, which cancels most
+    of the drift of a shared machine.
+    """
+    from . import main as api
+
+    api.items = api.ItemStore()
+    for item in make_items(size):
+        api.items.add(item)
+    apps = {'off': api.app, 'on': profiled_copy(api.app)}
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        pass
+
+    def scope(path, query):
+        return {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query,
+                'root_path': '', 'headers': [(b'host', b'bench')], 'client': ('127.0.0.1', 1),
+                'server': ('bench', 80)}
+
+    async def run():
+        print(f"{'request':<32} {'off us':>8} {'on us':>8} {'overhead':>9}")
+        for path, query in REQUESTS:
+            times = {name: [] for name in apps}
+            for i in range(repeat + repeat // 10):
+                for name, app in apps.items():
+                    start = time.perf_counter()
+                    await app(scope(path, query), receive, send)
+                    if i >= repeat // 10:  # warm-up
+                        times[name].append(time.perf_counter() - start)
+            off, on = (sorted(times[name])[len(times[name]) // 2] for name in ('off', 'on'))
+            request = f'{path}?{query.decode()}'
+            print(f'{request:<32} {off * 1e6:>8.1f} {on * 1e6:>8.1f} {(on / off - 1) * 100:>8.1f}%')
+
+    asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('benchmark', choices=['search', 'bulk', 'memory', 'serialize', 'profiling'])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--batch', type=int, default=10_000)
+    args = parser.parse_args()
+    if args.benchmark == 'search':
+        bench_search(args.sizes, args.repeat)
+    elif args.benchmark == 'bulk':
+        bench_bulk(args.sizes, args.batch)
+    elif args.benchmark == 'memory':
+        bench_memory(args.sizes)
+    elif args.benchmark == 'serialize':
+        bench_serialize(args.sizes, args.repeat)
+    elif args.benchmark == 'profiling':
+        bench_profiling(args.sizes[0], args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import json
+from typing import Any, List, Tuple
+
+from fastapi import HTTPException
+from pydantic import TypeAdapter, ValidationError
+
+NDJSON = 'application/x-ndjson'
+
+
+def parse_rows(body: bytes, content_type: str | None) -> Tuple[List[Tuple[int, Any]], List[dict]]:
+    """Split a JSON array or NDJSON body into ``(index, row)`` pairs.
+
+    NDJSON lines that are not valid JSON are reported as row errors;
+    a malformed JSON array rejects the whole request.
+    """
+    rows, errors = [], []
+    if content_type and content_type.split(';')[0].strip() == NDJSON:
+        for index, line in enumerate(body.splitlines()):
+            if not line.strip():
+                continue
+            try:
+                rows.append((index, json.loads(line)))
+            except ValueError as e:
+                errors.append({'index': index, 'detail': f'Invalid JSON: {e}'})
+        return rows, errors
+    try:
+        data = json.loads(body)
+    except ValueError as e:
+        raise HTTPException(400, f'Invalid JSON: {e}')
+    if not isinstance(data, list):
+        raise HTTPException(422, 'Expected a JSON array')
+    return list(enumerate(data)), errors
+
+
+def validate_rows(adapter: TypeAdapter, rows: List[Tuple[int, Any]]) -> Tuple[List[Tuple[int, Any]], List[dict]]:
+    """Validate rows against a ``TypeAdapter`` over a list of models.
+
+    The whole batch is validated in one call; only when that fails are
+    rows revalidated one by one to report which of them are invalid.
+    """
+    try:
+        values = adapter.validate_python([row for _, row in rows])
+        return [(index, value) for (index, _), value in zip(rows, values)], []
+    except ValidationError:
+        pass
+    valid, errors = [], []
+    for index, row in rows:
+        try:
+            valid.append((index, adapter.validate_python([row])[0]))
+        except ValidationError as e:
+            detail = [{**error, 'loc': error['loc'][1:]}
+                      for error in e.errors(include_url=False, include_context=False)]
+            errors.append({'index': index, 'detail': detail})
+    return valid, errors
@@ -0,0 +1,224 @@
+"""Columnar item layout for large catalogs.
+
+``ColumnarItemStore`` keeps ``ItemBase`` fields in NumPy columns instead
+of one dict per item and only builds dicts for the rows a response
+needs. Range filters run as vectorized masks rather than through the
+secondary indexes of ``ItemStore``, which this layout does not keep.
+NumPy is optional and only required when this store is used.
+"""
+import sys
+import threading
+from typing import Dict, Iterator, List, Set
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from .store import ItemStore
+
+_MISSING = object()
+
+
+class ColumnarTable:
+    """A ``dict``-like id -> item mapping backed by NumPy columns.
+
+    Rows live in append-only slots. Deleted slots are masked out and
+    reclaimed by compaction once they make up half of the table. Row
+    reads hold ``lock`` so they never observe a resize or compaction
+    half-way through.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.lock = threading.RLock()
+        self._slots: Dict[int, int] = {}
+        self._size = 0
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.live = np.zeros(capacity, dtype=bool)
+        self.price = np.zeros(capacity, dtype=np.float64)
+        self.discount = np.zeros(capacity, dtype=np.float64)
+        self.no_discount = np.zeros(capacity, dtype=bool)
+        self.quantity = np.zeros(capacity, dtype=np.int64)
+        self.category = np.zeros(capacity, dtype=np.int32)
+        self.titles: List[str | None] = []
+        self.descriptions: List[str | None] = []
+        self.categories: List[str] = []
+        self._category_codes: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, id: int) -> bool:
+        return id in self._slots
+
+    def __getitem__(self, id: int) -> dict:
+        with self.lock:
+            return self._row(self._slots[id])
+
+    def __setitem__(self, id: int, item: dict):
+        with self.lock:
+            self._set(id, item)
+
+    def _set(self, id: int, item: dict):
+        slot = self._slots.get(id)
+        if slot is None:
+            slot = self._append()
+            self._slots[id] = slot
+        self.ids[slot] = id
+        self.price[slot] = item['price']
+        self.no_discount[slot] = item['discount'] is None
+        self.discount[slot] = 0.0 if item['discount'] is None else item['discount']
+        self.quantity[slot] = item['quantity']
+        self.category[slot] = self._category_code(item['category'])
+        self.titles[slot] = item['title']
+        self.descriptions[slot] = item['description']
+        self.live[slot] = True
+
+    def get(self, id: int, default=None):
+        with self.lock:
+            slot = self._slots.get(id)
+            return default if slot is None else self._row(slot)
+
+    def pop(self, id: int, default=_MISSING):
+        with self.lock:
+            slot = self._slots.pop(id, None)
+            if slot is None:
+                if default is _MISSING:
+                    raise KeyError(id)
+                return default
+            item = self._row(slot)
+            self.live[slot] = False
+            self.titles[slot] = self.descriptions[slot] = None
+            if len(self._slots) * 2 < self._size and self._size > 1024:
+                self._compact()
+            return item
+
+    def values(self) -> Iterator[dict]:
+        with self.lock:
+            return iter([self._row(slot) for slot in self._slots.values()])
+
+    def items(self) -> Iterator[tuple]:
+        return ((item['id'], item) for item in self.values())
+
+    def rows(self, slots) -> Iterator[dict]:
+        return (self._row(slot) for slot in slots)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def _row(self, slot: int) -> dict:
+        return {
+            'title': self.titles[slot],
+            'description': self.descriptions[slot],
+            'category': self.categories[self.category[slot]],
+            'price': float(self.price[slot]),
+            'discount': None if self.no_discount[slot] else float(self.discount[slot]),
+            'quantity': int(self.quantity[slot]),
+            'id': int(self.ids[slot]),
+        }
+
+    def _category_code(self, category: str) -> int:
+        code = self._category_codes.get(category)
+        if code is None:
+            code = len(self.categories)
+            self.categories.append(sys.intern(category))
+            self._category_codes[category] = code
+        return code
+
+    def _append(self) -> int:
+        if self._size == len(self.ids):
+            self._resize(len(self.ids) * 2)
+        self.titles.append(None)
+        self.descriptions.append(None)
+        self._size += 1
+        return self._size - 1
+
+    def _columns(self):
+        return ('ids', 'live', 'price', 'discount', 'no_discount', 'quantity', 'category')
+
+    def _resize(self, capacity: int):
+        for name in self._columns():
+            column = getattr(self, name)
+            resized = np.zeros(capacity, dtype=column.dtype)
+            count = min(len(column), capacity)
+            resized[:count] = column[:count]
+            setattr(self, name, resized)
+
+    def _compact(self):
+        keep = np.flatnonzero(self.live[:self._size])
+        for name in self._columns():
+            column = getattr(self, name)
+            column[:len(keep)] = column[keep]
+            column[len(keep):] = 0
+        self.titles = [self.titles[slot] for slot in keep]
+        self.descriptions = [self.descriptions[slot] for slot in keep]
+        self._size = len(keep)
+        self._slots = {int(id): slot for slot, id in enumerate(self.ids[:self._size])}
+
+
+class ColumnarItemStore(ItemStore):
+    """``ItemStore`` over a ``ColumnarTable`` with vectorized filtering."""
+
+    def __init__(self, *args, **kwargs):
+        if np is None:
+            raise RuntimeError('ColumnarItemStore requires numpy')
+        super().__init__(*args, **kwargs)
+
+    def _new_table(self) -> ColumnarTable:
+        return ColumnarTable()
+
+    def _index(self, item: dict, fields: Set[str] | None = None):
+        pass
+
+    def _unindex(self, item: dict, fields: Set[str] | None = None):
+        pass
+
+    def iter_filter(self,
+                    title: str | None = None,
+                    description: str | None = None,
+                    category: str | None = None,
+                    price_from: float | None = None,
+                    price_to: float | None = None,
+                    discount_from: float | None = None,
+                    discount_to: float | None = None,
+                    quantity_from: float | None = None,
+                    quantity_to: float | None = None,
+                    after_id: int | None = None) -> Iterator[dict]:
+        table = self._items
+        with table.lock:
+            n = table.size
+            mask = table.live[:n].copy()
+            if after_id is not None:
+                mask &= table.ids[:n] > after_id
+            if category:
+                codes = [code for code, name in enumerate(table.categories)
+                         if name.lower() == category.lower()]
+                mask &= np.isin(table.category[:n], codes)
+            if price_from:
+                mask &= table.price[:n] >= price_from
+            if price_to:
+                mask &= table.price[:n] <= price_to
+            slots = np.flatnonzero(mask)
+            if title or description:
+                title = title.lower() if title else title
+                description = description.lower() if description else description
+                slots = np.array([
+                    slot for slot in slots
+                    if (not title or title in table.titles[slot].lower())
+                    and (not description or description in table.descriptions[slot].lower())
+                ], dtype=np.int64)
+            if discount_from or discount_to:
+                # As in ItemStore, an item without a discount never matches a discount bound
+                slots = slots[~table.no_discount[slots]]
+                if discount_from:
+                    slots = slots[table.discount[slots] >= discount_from]
+                if discount_to:
+                    slots = slots[table.discount[slots] <= discount_to]
+            if quantity_from:
+                slots = slots[table.quantity[slots] >= quantity_from]
+            if quantity_to:
+                slots = slots[table.quantity[slots] <= quantity_to]
+            slots = slots[np.argsort(table.ids[slots], kind='stable')]
+            rows = list(table.rows(slots))
+        yield from rows
@@ -1,42 +1,44 @@
+import os
 import uvicorn
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, TypeAdapter
+from typing import Any, List
+from itertools import islice
+
+from instrumentation.metrics import CONTENT_TYPE, MetricsMiddleware, RequestMetrics, gauge
+
+from .bulk import parse_rows, validate_rows
+from .columnar import ColumnarItemStore
+from .persistence import open_backend
+from . import profiling
+from .serialization import stored
+from .store import InsufficientStock, ItemStore
+from .streaming import StreamFormat, stream_items
 
 app = FastAPI()
 
+# Latency histograms of every request, exported on /metrics.
+request_metrics = RequestMetrics()
+app.add_middleware(MetricsMiddleware, metrics=request_metrics)
+
+# DEMO_EXAM_PROFILING=1 times every request phase by phase (validation,
+# handler, serialization) and keeps slow requests; see /admin/profile.
+if profiling.ENABLED:
+    profiling.install(app, profiling.profiler)
+
+# The package uses relative imports: start it from the repository root with
+# "python -m demo_exam.main" (or "uvicorn demo_exam.main:app").
 if __name__ == "__main__":
-    uvicorn.run('main:app', host="127.0.0.1", port=8000, reload=True)
-
-items = [
-    # {
-    #     "id": 1,
-    #     "title": "Book 1",
-    #     "description": "Book 1 description",
-    #     "category": "Book",
-    #     "price": 100.0,
-    #     "discount": None,
-    #     "quantity": 10
-    # },
-    # {
-    #     "id": 2,
-    #     "title": "Book 2",
-    #     "description": "Book 2 description",
-    #     "category": "Book",
-    #     "price": 200.0,
-    #     "discount": 10.0,
-    #     "quantity": 5
-    # },
-    # {
-    #     "id": 3,
-    #     "title": "Magazine 1",
-    #     "description": "Magazine 1 description",
-    #     "category": "Magazine",
-    #     "price": 300.0,
-    #     "discount": None,
-    #     "quantity": 20
-    # }
-]
+    uvicorn.run('demo_exam.main:app', host="127.0.0.1", port=8000, reload=True)
+
+# DEMO_EXAM_STORAGE=wal:<directory> or sqlite:<path> keeps the catalog
+# across restarts; without it items live only in memory.
+# DEMO_EXAM_LAYOUT=columnar trades the secondary indexes for a compact
+# NumPy-backed layout suited to very large catalogs.
+store_class = ColumnarItemStore if os.environ.get('DEMO_EXAM_LAYOUT') == 'columnar' else ItemStore
+items = store_class(backend=open_backend(os.environ.get('DEMO_EXAM_STORAGE')))
 
 
 class ItemBase(BaseModel):
@@ -56,46 +58,95 @@ class Item(ItemBase):
 class SaleResponse(BaseModel):
     message: str
     items: List[Item]
+class SaleRequest(BaseModel):
+    ids: List[int]
 class IncrementResponse(BaseModel):
     items: List[Item]
+class BulkError(BaseModel):
+    index: int
+    detail: Any
+class BulkResponse(BaseModel):
+    items: List[Item]
+    errors: List[BulkError]
+class BulkDeleteResponse(BaseModel):
+    deleted: List[int]
+    errors: List[BulkError]
+
+item_create_list = TypeAdapter(List[ItemCreate])
+item_list = TypeAdapter(List[Item])
+id_list_adapter = TypeAdapter(List[int])
+
 @app.get('/items', response_model=List[Item])
-def get_items():
-    return items
+def get_items(limit: int | None = Query(None, ge=1),
+              after_id: int | None = None,
+              stream: StreamFormat | None = None):
+    if stream is not None:
+        return stream_items(islice(items.scan(after_id), limit), stream)
+    if limit is None and after_id is None:
+        return stored(items.all())
+    return stored(items.page(after_id, limit))
+
+def bulk_create(rows, errors):
+    valid, invalid = validate_rows(item_create_list, rows)
+    created = items.create_many([item.model_dump() for _, item in valid])
+    return {'items': created, 'errors': sorted(errors + invalid, key=lambda e: e['index'])}
+
+def bulk_update(rows, errors):
+    valid, invalid = validate_rows(item_list, rows)
+    updated = items.update_many([(item.id, item.model_dump(exclude={'id'})) for _, item in valid])
+    missing = [{'index': index, 'detail': 'Item not found'}
+               for (index, _), item in zip(valid, updated) if item is None]
+    return {'items': [item for item in updated if item is not None],
+            'errors': sorted(errors + invalid + missing, key=lambda e: e['index'])}
+
+def bulk_delete(rows, errors):
+    valid, invalid = validate_rows(id_list_adapter, rows)
+    deleted = items.delete_many([id for _, id in valid])
+    missing = [{'index': index, 'detail': 'Item not found'}
+               for (index, _), item in zip(valid, deleted) if item is None]
+    return {'deleted': [item['id'] for item in deleted if item is not None],
+            'errors': sorted(errors + invalid + missing, key=lambda e: e['index'])}
+
+@app.post('/items/bulk', response_model=BulkResponse)
+async def create_items(request: Request):
+    rows, errors = parse_rows(await request.body(), request.headers.get('content-type'))
+    return stored(await run_in_threadpool(bulk_create, rows, errors))
+
+@app.put('/items/bulk', response_model=BulkResponse)
+async def change_items(request: Request):
+    rows, errors = parse_rows(await request.body(), request.headers.get('content-type'))
+    return stored(await run_in_threadpool(bulk_update, rows, errors))
+
+@app.delete('/items/bulk', response_model=BulkDeleteResponse)
+async def delete_items(request: Request):
+    rows, errors = parse_rows(await request.body(), request.headers.get('content-type'))
+    return stored(await run_in_threadpool(bulk_delete, rows, errors))
 
 @app.get('/items/{id}', response_model=Item)
 def get_item_by_id(id: int):
-    for item in items:
-        if item['id'] == id:
-            return item
-    raise HTTPException(404, 'Item not found')
+    item = items.get(id)
+    if item is None:
+        raise HTTPException(404, 'Item not found')
+    return stored(item)
 
 @app.post('/items', response_model=Item)
 def create_item(item: ItemCreate):
-    if len(items) == 0:
-        item = Item(id = 1, **item.model_dump()).model_dump()
-    else:
-        item = Item(id = items[-1]['id'] + 1, **item.model_dump()).model_dump()
-    items.append(item)
-    return item
+    return stored(items.create(item.model_dump()))
 
 @app.put('/items/{id}', response_model=Item)
 def change_item(id: int, upd_item: ItemCreate):
-    for item in items:
-        if item['id'] == id:
-            for k, v in upd_item.model_dump().items():
-                item[k] = v
-            return item
-    raise HTTPException(404, 'Item not found')
+    item = items.update(id, upd_item.model_dump())
+    if item is None:
+        raise HTTPException(404, 'Item not found')
+    return stored(item)
 
 @app.delete('/items/{id}')
 def delete_item(id: int):
-    for item in items:
-        if item['id'] == id:
-            items.remove(item)
-            return {"message": "Item deleted"}
-    raise HTTPException(404, 'Item not found')
+    if items.delete(id) is None:
+        raise HTTPException(404, 'Item not found')
+    return {"message": "Item deleted"}
 
-@app.get('/items/filter/', response_model=SaleResponse)
+@app.get('/items/filter/', response_model=List[Item])
 def filter_items(title: str | None = None,
                  description: str | None = None,
                  category: str | None = None,
@@ -104,50 +155,59 @@ def filter_items(title: str | None = None,
                  discount_from: float | None = None,
                  discount_to: float | None = None,
                  quantity_from: float | None = None,
-                 quantity_to: float | None = None):
-    filtered_items = []
-    for item in items:
-        if (
-            (not title or title.lower() in item['title'].lower())
-            and (not description or description.lower() in item['description'].lower())
-            and (not category or category.lower() == item['category'].lower())
-            and (not price_from or price_from <= item['price'])
-            and (not price_to or price_to >= item['price'])
-            and (not discount_from or discount_from <= item['discount'])
-            and (not discount_to or discount_to >= item['discount'])
-            and (not quantity_from or quantity_from <= item['quantity'])
-            and (not quantity_to or quantity_to >= item['quantity'])
-        ):
-            filtered_items.append(item)
-    return filtered_items
+                 quantity_to: float | None = None,
+                 limit: int | None = Query(None, ge=1),
+                 after_id: int | None = None,
+                 stream: StreamFormat | None = None):
+    if stream is not None:
+        rows = items.iter_filter(title, description, category, price_from, price_to,
+                                 discount_from, discount_to, quantity_from, quantity_to, after_id)
+        return stream_items(islice(rows, limit), stream)
+    return stored(items.filter(title, description, category, price_from, price_to,
+                               discount_from, discount_to, quantity_from, quantity_to, after_id, limit))
 
     
-@app.get('/sale/{id}', response_model=SaleResponse)
-def sell_item(id: str):
-    id_list = [int(item_id) for item_id in id.split(',')]
-    sold_items = []
-    for item_id in id_list:
-        for item in items:
-            if item['id'] == item_id:
-                if item['quantity'] > 0:
-                    item['quantity'] -= 1
-                    sold_items.append(item)
-                else:
-                    raise HTTPException(404, 'Item not found')
+def sell(id_list: List[int]):
+    try:
+        sold_items = items.sell(id_list)
+    except InsufficientStock:
+        raise HTTPException(404, 'Item not found')
     if len(sold_items) > 0:
-        return {'message': 'Items sold', 'items': sold_items}
+        return stored({'message': 'Items sold', 'items': sold_items})
     else:
         raise HTTPException(404, 'Item not found')
 
+@app.get('/sale/{id}', response_model=SaleResponse)
+def sell_item(id: str):
+    id_list = [int(item_id) for item_id in id.split(',')]
+    return sell(id_list)
+
+@app.post('/sale', response_model=SaleResponse)
+def sell_items(sale: SaleRequest):
+    return sell(sale.ids)
+
 @app.get('/increment/{id}{quantity}', response_model=IncrementResponse)
 def increment_items(id: str, quantity: str):
     id_list = [int(item_id) for item_id in id.split(',')]
     quantity_list = [int(item_quantity) for item_quantity in quantity.split(',')]
     if len(id_list) != len(quantity_list):
         raise HTTPException(404, 'Item not found')
-    for i in range(len(id_list)):
-        for item in items:
-            if item['id'] == id_list[i]:
-                    item['quantity'] += quantity_list[i]
-                    break
-    return {'items': items}
+    items.increment(list(zip(id_list, quantity_list)))
+    return stored({'items': items.all()})
+
+@app.get('/metrics', response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    lines = request_metrics.render('demo_exam') + gauge('demo_exam_items', 'Items in the catalog.', len(items))
+    return PlainTextResponse('\n'.join(lines) + '\n', media_type=CONTENT_TYPE)
+
+# The profile exposes stacks and cProfile output, so its endpoints exist
+# only while profiling is enabled.
+if profiling.ENABLED:
+    @app.get('/admin/profile', include_in_schema=False)
+    def get_profile():
+        return profiling.profiler.report()
+
+    @app.post('/admin/profile/reset', include_in_schema=False)
+    def reset_profile():
+        profiling.profiler.reset()
+        return {'message': 'Profile reset'}
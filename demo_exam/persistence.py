@@ -0,0 +1,225 @@
+"""Durable storage backends for ``ItemStore``.
+
+The store reports every change as a ``put`` (full item) or ``delete``
+(id) record. Backends queue the records and a single writer thread
+persists them in batches, so request handlers never wait on disk I/O.
+"""
+import atexit
+import json
+import mmap
+import os
+import queue
+import sqlite3
+import threading
+from typing import Callable, List, Tuple
+
+_STOP = object()
+
+
+class Backend:
+    """Base class: a queue of change records drained by a writer thread."""
+
+    def __init__(self):
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._snapshot_source: Callable[[], Tuple[int, List[dict], int]] | None = None
+        self._seq_lock = threading.Lock()
+        self.seq = 0
+
+    def load(self) -> Tuple[List[dict], int]:
+        """Return the stored items and the next id to allocate."""
+        raise NotImplementedError
+
+    def _write(self, records: List[tuple]):
+        raise NotImplementedError
+
+    def _after_write(self):
+        pass
+
+    def start(self, snapshot_source: Callable[[], Tuple[int, List[dict], int]]):
+        self._snapshot_source = snapshot_source
+        self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def append(self, op: str, value):
+        # Called once the change is visible to readers. Stores serialise
+        # changes to one item, and the lock keeps the queue in sequence
+        # order across items.
+        with self._seq_lock:
+            self.seq += 1
+            self._queue.put((self.seq, op, value))
+
+    def flush(self):
+        """Block until every queued record has been written."""
+        self._queue.join()
+
+    def close(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        atexit.unregister(self.close)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [record for record in batch if record is not _STOP]
+            try:
+                if records:
+                    self._write(records)
+                    self._after_write()
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if len(records) < len(batch):
+                return
+
+
+class WALBackend(Backend):
+    """Append-only JSON-lines log with periodic compact snapshots.
+
+    Each queued batch is written and fsynced once (group commit). After
+    ``snapshot_every`` records the writer dumps the store to
+    ``snapshot.jsonl`` and truncates the log. Recovery streams the
+    memory-mapped snapshot and replays the log records newer than it.
+    """
+
+    def __init__(self, directory: str, snapshot_every: int = 100_000):
+        super().__init__()
+        os.makedirs(directory, exist_ok=True)
+        self.snapshot_path = os.path.join(directory, 'snapshot.jsonl')
+        self.log_path = os.path.join(directory, 'wal.jsonl')
+        self.snapshot_every = snapshot_every
+        self._since_snapshot = 0
+        self._covered_seq = 0
+        self._log = None
+
+    def load(self) -> Tuple[List[dict], int]:
+        items, next_id = {}, 1
+        if os.path.exists(self.snapshot_path) and os.path.getsize(self.snapshot_path):
+            with open(self.snapshot_path, 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                header = json.loads(mm.readline())
+                self._covered_seq, next_id = header['seq'], header['next_id']
+                for line in iter(mm.readline, b''):
+                    item = json.loads(line)
+                    items[item['id']] = item
+        seq = self._covered_seq
+        if os.path.exists(self.log_path):
+            with open(self.log_path, 'rb') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # torn write at the tail of the log
+                    if record['seq'] <= self._covered_seq:
+                        continue
+                    seq = record['seq']
+                    if record['op'] == 'put':
+                        items[record['value']['id']] = record['value']
+                        next_id = max(next_id, record['value']['id'] + 1)
+                    else:
+                        items.pop(record['value'], None)
+        self.seq = seq
+        self._log = open(self.log_path, 'ab')
+        return sorted(items.values(), key=lambda item: item['id']), next_id
+
+    def _write(self, records: List[tuple]):
+        lines = [json.dumps({'seq': seq, 'op': op, 'value': value}).encode() + b'\n'
+                 for seq, op, value in records if seq > self._covered_seq]
+        if lines:
+            self._log.write(b''.join(lines))
+            self._log.flush()
+            os.fsync(self._log.fileno())
+        self._since_snapshot += len(lines)
+
+    def _after_write(self):
+        if self._since_snapshot >= self.snapshot_every:
+            self.snapshot()
+
+    def snapshot(self):
+        """Write a compact snapshot and drop the log records it covers."""
+        seq, items, next_id = self._snapshot_source()
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps({'seq': seq, 'next_id': next_id}).encode() + b'\n')
+            for i in range(0, len(items), 10_000):
+                f.write(b''.join(json.dumps(item).encode() + b'\n' for item in items[i:i + 10_000]))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # Records up to seq that are still queued are covered by the
+        # snapshot; anything newer goes to the fresh log.
+        self._covered_seq = seq
+        self._log.close()
+        self._log = open(self.log_path, 'wb')
+        self._since_snapshot = 0
+
+    def close(self):
+        super().close()
+        if self._log is not None and not self._log.closed:
+            self._log.close()
+
+
+class SQLiteBackend(Backend):
+    """Items stored as JSON rows in a local SQLite database."""
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._db = None
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY, data TEXT NOT NULL)')
+        db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        return db
+
+    def load(self) -> Tuple[List[dict], int]:
+        db = self._connect()
+        try:
+            items = [json.loads(data) for data, in db.execute('SELECT data FROM items ORDER BY id')]
+            row = db.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+        finally:
+            db.close()
+        next_id = max([row[0] if row else 1] + [item['id'] + 1 for item in items[-1:]])
+        return items, next_id
+
+    def _write(self, records: List[tuple]):
+        if self._db is None:
+            self._db = self._connect()
+        with self._db:
+            for seq, op, value in records:
+                if op == 'put':
+                    self._db.execute('INSERT OR REPLACE INTO items (id, data) VALUES (?, ?)',
+                                     (value['id'], json.dumps(value)))
+                    self._db.execute("INSERT INTO meta (key, value) VALUES ('next_id', ?) "
+                                     "ON CONFLICT(key) DO UPDATE SET value = max(value, excluded.value)",
+                                     (value['id'] + 1,))
+                else:
+                    self._db.execute('DELETE FROM items WHERE id = ?', (value,))
+
+    def close(self):
+        super().close()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def open_backend(spec: str | None) -> Backend | None:
+    """Build a backend from ``wal:<directory>`` or ``sqlite:<path>``."""
+    if not spec:
+        return None
+    kind, _, location = spec.partition(':')
+    if kind == 'wal':
+        return WALBackend(location)
+    if kind == 'sqlite':
+        return SQLiteBackend(location)
+    raise ValueError(f'Unknown storage backend: {spec}')
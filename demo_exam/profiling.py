@@ -0,0 +1,13 @@
+"""Request profiling for the catalog API, enabled by ``DEMO_EXAM_PROFILING=1``.
+
+The implementation lives in ``instrumentation.profiling``; this module
+holds the catalog's profiler, configured by ``DEMO_EXAM_PROFILE_SLOW_MS``,
+``DEMO_EXAM_PROFILE_RATE`` and ``DEMO_EXAM_PROFILE_SAMPLE``.
+"""
+from instrumentation.profiling import (  # noqa: F401
+    HdrHistogram, ProfiledRoute, ProfilingMiddleware, RequestProfiler, enabled, format_profile, install,
+)
+
+PREFIX = 'DEMO_EXAM'
+ENABLED = enabled(PREFIX)
+profiler = RequestProfiler.from_env(PREFIX)
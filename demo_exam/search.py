@@ -0,0 +1,87 @@
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterator, Set
+
+
+def trigrams(text: str) -> Iterator[str]:
+    return (text[i:i + 3] for i in range(len(text) - 2))
+
+
+def _contains(ids: array, id: int) -> bool:
+    i = bisect_left(ids, id)
+    return i < len(ids) and ids[i] == id
+
+
+class TrigramIndex:
+    """Inverted trigram index over lowercased text for substring search.
+
+    Postings are sorted ``array('q')`` ids, 8 bytes per entry, and the
+    index keeps no copy of the text: ``search`` returns the ids whose
+    text contains every trigram of the query, and the caller confirms
+    the match against the item itself.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings: Dict[str, array] = {}
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def add(self, id: int, text: str):
+        grams = set(trigrams(text.lower()))
+        with self._lock:
+            for gram in grams:
+                ids = self._postings.get(gram)
+                if ids is None:
+                    self._postings[gram] = array('q', (id,))
+                elif ids[-1] < id:
+                    ids.append(id)
+                elif not _contains(ids, id):
+                    ids.insert(bisect_left(ids, id), id)
+            self._len += 1
+
+    def remove(self, id: int, text: str):
+        """Drop ``id``, which was added with ``text``."""
+        grams = set(trigrams(text.lower()))
+        with self._lock:
+            for gram in grams:
+                ids = self._postings.get(gram)
+                if ids is None:
+                    continue
+                i = bisect_left(ids, id)
+                if i < len(ids) and ids[i] == id:
+                    del ids[i]
+                    if not ids:
+                        del self._postings[gram]
+            self._len -= 1
+
+    def estimate(self, query: str) -> int:
+        """Upper bound on the number of matches for a lowercased query.
+
+        Queries shorter than a trigram cannot use the index and estimate
+        as every id, so callers scan instead.
+        """
+        if len(query) < 3:
+            return self._len
+        return min(len(self._postings.get(gram, ())) for gram in trigrams(query))
+
+    def search(self, query: str) -> Set[int]:
+        """Ids whose text may contain the lowercased ``query``.
+
+        ``query`` must be at least three characters long. Every trigram
+        of it occurs in the text of each returned id, but the caller
+        still has to check ``query in text``.
+        """
+        with self._lock:
+            postings = []
+            for gram in set(trigrams(query)):
+                ids = self._postings.get(gram)
+                if not ids:
+                    return set()
+                postings.append(ids)
+            postings.sort(key=len)
+            smallest, rest = postings[0], postings[1:]
+            return {id for id in smallest if all(_contains(ids, id) for ids in rest)}
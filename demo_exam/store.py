@@ -0,0 +1,472 @@
+import math
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from contextlib import contextmanager
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Set
+
+from .persistence import Backend
+from .search import TrigramIndex
+
+
+class InsufficientStock(Exception):
+    """Raised when a sale asks for more units than an item has."""
+
+    def __init__(self, id: int):
+        super().__init__(id)
+        self.id = id
+
+
+class SortedIndex:
+    """Ordered (value, id) pairs supporting inclusive range lookups.
+
+    Pairs live in a list of sorted buckets of at most ``2 * load``
+    entries, with each bucket's largest pair kept in ``_maxes``. An
+    update bisects ``_maxes`` and shifts a single bucket, so re-indexing
+    a quantity change stays cheap however large the catalog grows.
+    """
+
+    def __init__(self, load: int = 1000):
+        self._lock = threading.Lock()
+        self._load = load
+        self._buckets: List[List[tuple]] = []
+        self._maxes: List[tuple] = []
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def add(self, value, id: int):
+        with self._lock:
+            self._add((value, id))
+
+    def _add(self, key: tuple):
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            self._len += 1
+            return
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            i -= 1
+            self._buckets[i].append(key)
+            self._maxes[i] = key
+        else:
+            insort(self._buckets[i], key)
+        self._len += 1
+        bucket = self._buckets[i]
+        if len(bucket) > 2 * self._load:
+            tail = bucket[self._load:]
+            del bucket[self._load:]
+            self._buckets.insert(i + 1, tail)
+            self._maxes[i] = bucket[-1]
+            self._maxes.insert(i + 1, tail[-1])
+
+    def remove(self, value, id: int):
+        with self._lock:
+            self._remove((value, id))
+
+    def _remove(self, key: tuple):
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return
+        bucket = self._buckets[i]
+        j = bisect_left(bucket, key)
+        if j == len(bucket) or bucket[j] != key:
+            return
+        del bucket[j]
+        self._len -= 1
+        if not bucket:
+            del self._buckets[i]
+            del self._maxes[i]
+        elif j == len(bucket):
+            self._maxes[i] = bucket[-1]
+
+    def _locate(self, key: tuple, side) -> tuple:
+        # (bucket, offset) of the insertion point for ``key``, where
+        # ``side`` is bisect_left or bisect_right.
+        i = side(self._maxes, key)
+        if i == len(self._buckets):
+            return i, 0
+        return i, side(self._buckets[i], key)
+
+    def _rank(self, position: tuple) -> int:
+        i, j = position
+        return sum(len(bucket) for bucket in self._buckets[:i]) + j
+
+    def _bounds(self, lo, hi) -> tuple:
+        start = (0, 0) if lo is None else self._locate((lo,), bisect_left)
+        end = (len(self._buckets), 0) if hi is None else self._locate((hi, math.inf), bisect_right)
+        return start, max(start, end)
+
+    def count(self, lo=None, hi=None) -> int:
+        with self._lock:
+            start, end = self._bounds(lo, hi)
+            return self._rank(end) - self._rank(start)
+
+    def ids(self, lo=None, hi=None) -> Iterator[int]:
+        with self._lock:
+            (i, j), (end_i, end_j) = self._bounds(lo, hi)
+            if i == end_i:
+                slices = [self._buckets[i][j:end_j]] if i < len(self._buckets) else []
+            else:
+                slices = [self._buckets[i][j:], *self._buckets[i + 1:end_i]]
+                if end_i < len(self._buckets):
+                    slices.append(self._buckets[end_i][:end_j])
+        return (id for keys in slices for _, id in keys)
+
+
+class ItemStore:
+    """In-memory item catalog indexed by id.
+
+    Items are kept in a dict keyed by id, so lookups, updates and deletes
+    are O(1) and iteration follows insertion (and therefore id) order.
+    Secondary indexes on category, price, discount and quantity, and
+    trigram indexes on title and description, let ``filter`` start from
+    the most selective criterion instead of scanning the whole catalog.
+    An item without a discount never matches a discount bound.
+    """
+
+    def __init__(self, stripes: int = 64, backend: Backend | None = None):
+        # Per-item changes are serialised by striped locks. The write
+        # lock only guards inserts and deletes (the shared id list and id
+        # allocation); each index has its own short lock, so updates to
+        # items on different stripes run in parallel. Readers take no
+        # store locks.
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._write_lock = threading.Lock()
+        self._sets_lock = threading.Lock()
+        self._items: Dict[int, dict] = self._new_table()
+        self._ids: List[int] = []
+        self._next_id = 1
+        self._by_category: Dict[str, Set[int]] = {}
+        self._by_price = SortedIndex()
+        self._by_discount = SortedIndex()
+        self._by_quantity = SortedIndex()
+        self._titles = TrigramIndex()
+        self._descriptions = TrigramIndex()
+        self._backend = None
+        if backend is not None:
+            stored, self._next_id = backend.load()
+            for item in stored:
+                self._insert(item)
+            self._backend = backend
+            backend.start(self._snapshot)
+
+    def _new_table(self) -> Dict[int, dict]:
+        return {}
+
+    def close(self):
+        """Flush pending changes to the backend and stop its writer."""
+        if self._backend is not None:
+            self._backend.close()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(list(self._items.values()))
+
+    def __contains__(self, id: int) -> bool:
+        return id in self._items
+
+    def all(self) -> List[dict]:
+        return list(self._items.values())
+
+    def get(self, id: int) -> dict | None:
+        return self._items.get(id)
+
+    def page(self, after_id: int | None = None, limit: int | None = None) -> List[dict]:
+        """Items with ids greater than ``after_id``, at most ``limit`` of them."""
+        start = 0 if after_id is None else bisect_right(self._ids, after_id)
+        end = None if limit is None else start + limit
+        page = (self._items.get(id) for id in self._ids[start:end])
+        return [item for item in page if item is not None]
+
+    def scan(self, after_id: int | None = None, chunk: int = 1024) -> Iterator[dict]:
+        """Lazily iterate items in id order, a page at a time.
+
+        Each page is located by keyset, so the store may change between
+        pages without invalidating the iterator and memory use stays
+        bounded by ``chunk``.
+        """
+        while True:
+            page = self.page(after_id, chunk)
+            if not page:
+                return
+            yield from page
+            after_id = page[-1]['id']
+
+    def allocate_id(self) -> int:
+        with self._write_lock:
+            return self._allocate_id()
+
+    def _allocate_id(self) -> int:
+        # Ids only grow while the catalog holds items; an empty catalog
+        # starts again from 1, as the list-based implementation did.
+        if not self._items:
+            self._next_id = 1
+        id = self._next_id
+        self._next_id += 1
+        return id
+
+    def create(self, data: dict) -> dict:
+        """Store ``data`` under a freshly allocated id."""
+        with self._write_lock:
+            item = {**data, 'id': self._allocate_id()}
+            self._insert(item)
+            return item
+
+    def create_many(self, rows: List[dict]) -> List[dict]:
+        """Store ``rows`` under a contiguous block of new ids."""
+        with self._write_lock:
+            created = []
+            for data in rows:
+                item = {**data, 'id': self._allocate_id()}
+                self._insert(item)
+                created.append(item)
+            return created
+
+    def add(self, item: dict) -> dict:
+        with self._stripe(item['id']), self._write_lock:
+            self._insert(item)
+            return item
+
+    def update(self, id: int, data: dict) -> dict | None:
+        with self._stripe(id):
+            item = self._items.get(id)
+            if item is None:
+                return None
+            return self._replace(item, data)
+
+    def delete(self, id: int) -> dict | None:
+        with self._stripe(id), self._write_lock:
+            item = self._items.pop(id, None)
+            if item is not None:
+                self._remove(item)
+            return item
+
+    def update_many(self, updates: List[tuple]) -> List[dict | None]:
+        """Apply ``(id, data)`` updates; missing ids yield None."""
+        with self._stripes([id for id, _ in updates]):
+            updated = []
+            for id, data in updates:
+                item = self._items.get(id)
+                updated.append(None if item is None else self._replace(item, data))
+            return updated
+
+    def delete_many(self, ids: List[int]) -> List[dict | None]:
+        """Delete ``ids``; ids that are not stored yield None."""
+        with self._stripes(ids), self._write_lock:
+            deleted = []
+            for id in ids:
+                item = self._items.pop(id, None)
+                if item is not None:
+                    self._remove(item)
+                deleted.append(item)
+            return deleted
+
+    def sell(self, ids: List[int]) -> List[dict]:
+        """Sell one unit per id, all or nothing.
+
+        Unknown ids are skipped. Stock is checked for the whole batch
+        (counting repeated ids) before any quantity changes, and
+        ``InsufficientStock`` leaves the catalog untouched.
+        """
+        with self._stripes(ids):
+            wanted = Counter(id for id in ids if id in self._items)
+            for id, count in wanted.items():
+                if self._items[id]['quantity'] < count:
+                    raise InsufficientStock(id)
+            for id, count in wanted.items():
+                item = self._items[id]
+                self._replace(item, {'quantity': item['quantity'] - count})
+            return [self._items[id] for id in ids if id in wanted]
+
+    def increment(self, quantities: List[tuple]) -> None:
+        """Add each ``(id, quantity)`` delta; unknown ids are skipped."""
+        with self._stripes([id for id, _ in quantities]):
+            for id, quantity in quantities:
+                item = self._items.get(id)
+                if item is not None:
+                    self._replace(item, {'quantity': item['quantity'] + quantity})
+
+    def _stripe(self, id: int) -> threading.Lock:
+        return self._locks[hash(id) % len(self._locks)]
+
+    @contextmanager
+    def _stripes(self, ids: Iterable[int]):
+        # Acquire in a fixed order so overlapping batches cannot deadlock.
+        locks = sorted({hash(id) % len(self._locks) for id in ids})
+        for i in locks:
+            self._locks[i].acquire()
+        try:
+            yield
+        finally:
+            for i in reversed(locks):
+                self._locks[i].release()
+
+    def _insert(self, item: dict):
+        id = item['id']
+        self._items[id] = item
+        if not self._ids or self._ids[-1] < id:
+            self._ids.append(id)
+        else:
+            insort(self._ids, id)
+        self._index(item)
+        if self._backend is not None:
+            self._backend.append('put', item)
+
+    def _remove(self, item: dict):
+        # The caller has already popped the item from ``_items``.
+        del self._ids[bisect_left(self._ids, item['id'])]
+        self._unindex(item)
+        if self._backend is not None:
+            self._backend.append('delete', item['id'])
+
+    def _replace(self, item: dict, data: dict) -> dict:
+        # Items are never mutated in place: readers holding the old dict
+        # keep a consistent snapshot while the new one is published.
+        new_item = {**item, **data}
+        # Only re-index the fields that actually change, so that quantity
+        # updates do not rebuild the text indexes.
+        changed = {k for k in data if k not in item or item[k] != new_item[k]}
+        # The caller holds the item's stripe; the item is published before
+        # its record is numbered, which ``_snapshot`` relies on.
+        self._unindex(item, changed)
+        self._items[item['id']] = new_item
+        self._index(new_item, changed)
+        if self._backend is not None:
+            self._backend.append('put', new_item)
+        return new_item
+
+    def _snapshot(self) -> tuple:
+        # Take seq before the items: every change numbered up to seq is
+        # already published, and a newer one that slips into the copy is
+        # also replayed from the log, which puts the same item again.
+        with self._write_lock:
+            seq = self._backend.seq
+            return seq, list(self._items.values()), self._next_id
+
+    def _index(self, item: dict, fields: Set[str] | None = None):
+        id = item['id']
+        if fields is None or 'title' in fields:
+            self._titles.add(id, item['title'])
+        if fields is None or 'description' in fields:
+            self._descriptions.add(id, item['description'])
+        if fields is None or 'category' in fields:
+            with self._sets_lock:
+                self._by_category.setdefault(item['category'].lower(), set()).add(id)
+        if fields is None or 'price' in fields:
+            self._by_price.add(item['price'], id)
+        if fields is None or 'discount' in fields:
+            if item['discount'] is not None:
+                self._by_discount.add(item['discount'], id)
+        if fields is None or 'quantity' in fields:
+            self._by_quantity.add(item['quantity'], id)
+
+    def _unindex(self, item: dict, fields: Set[str] | None = None):
+        id = item['id']
+        if fields is None or 'title' in fields:
+            self._titles.remove(id, item['title'])
+        if fields is None or 'description' in fields:
+            self._descriptions.remove(id, item['description'])
+        if fields is None or 'category' in fields:
+            category = item['category'].lower()
+            with self._sets_lock:
+                ids = self._by_category.get(category)
+                if ids is not None:
+                    ids.discard(id)
+                    if not ids:
+                        del self._by_category[category]
+        if fields is None or 'price' in fields:
+            self._by_price.remove(item['price'], id)
+        if fields is None or 'discount' in fields:
+            if item['discount'] is not None:
+                self._by_discount.remove(item['discount'], id)
+        if fields is None or 'quantity' in fields:
+            self._by_quantity.remove(item['quantity'], id)
+
+    def filter(self,
+               title: str | None = None,
+               description: str | None = None,
+               category: str | None = None,
+               price_from: float | None = None,
+               price_to: float | None = None,
+               discount_from: float | None = None,
+               discount_to: float | None = None,
+               quantity_from: float | None = None,
+               quantity_to: float | None = None,
+               after_id: int | None = None,
+               limit: int | None = None) -> List[dict]:
+        return list(islice(self.iter_filter(title, description, category, price_from, price_to,
+                                            discount_from, discount_to, quantity_from, quantity_to,
+                                            after_id), limit))
+
+    def iter_filter(self,
+                    title: str | None = None,
+                    description: str | None = None,
+                    category: str | None = None,
+                    price_from: float | None = None,
+                    price_to: float | None = None,
+                    discount_from: float | None = None,
+                    discount_to: float | None = None,
+                    quantity_from: float | None = None,
+                    quantity_to: float | None = None,
+                    after_id: int | None = None) -> Iterator[dict]:
+        # Falsy bounds (None, 0, '') disable a criterion, exactly as the
+        # original per-item predicate chain did.
+        title = title.lower() if title else title
+        description = description.lower() if description else description
+        candidates = self._candidates(title, description, category, price_from, price_to,
+                                      discount_from, discount_to, quantity_from, quantity_to)
+        if candidates is None:
+            source: Iterable[dict] = self.scan(after_id)
+        else:
+            if after_id is not None:
+                candidates = [id for id in candidates if id > after_id]
+            # A single get per id: a delete racing with the stream just drops the item
+            source = (item for item in map(self._items.get, sorted(candidates)) if item is not None)
+        category = category.lower() if category else category
+        for item in source:
+            if (
+                (not title or title in item['title'].lower())
+                and (not description or description in item['description'].lower())
+                and (not category or category == item['category'].lower())
+                and (not price_from or price_from <= item['price'])
+                and (not price_to or price_to >= item['price'])
+                and (not (discount_from or discount_to) or item['discount'] is not None)
+                and (not discount_from or discount_from <= item['discount'])
+                and (not discount_to or discount_to >= item['discount'])
+                and (not quantity_from or quantity_from <= item['quantity'])
+                and (not quantity_to or quantity_to >= item['quantity'])
+            ):
+                yield item
+
+    def _candidates(self, title, description, category, price_from, price_to,
+                    discount_from, discount_to, quantity_from, quantity_to) -> Set[int] | None:
+        """Return ids matched by the most selective index, or None to scan."""
+        options = []
+        for index, query in ((self._titles, title), (self._descriptions, description)):
+            if query:
+                options.append((index.estimate(query),
+                                lambda index=index, query=query: index.search(query)))
+        if category:
+            ids = self._by_category.get(category.lower(), set())
+            options.append((len(ids), lambda: set(ids)))
+        for index, lo, hi in ((self._by_price, price_from, price_to),
+                              (self._by_quantity, quantity_from, quantity_to)):
+            if lo or hi:
+                lo, hi = lo or None, hi or None
+                options.append((index.count(lo, hi),
+                                lambda index=index, lo=lo, hi=hi: set(index.ids(lo, hi))))
+        if discount_from or discount_to:
+            lo, hi = discount_from or None, discount_to or None
+            options.append((self._by_discount.count(lo, hi), lambda: set(self._by_discount.ids(lo, hi))))
+        if not options:
+            return None
+        size, build = min(options, key=lambda option: option[0])
+        if size >= len(self._items):
+            return None
+        return build()
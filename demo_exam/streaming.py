@@ -0,0 +1,48 @@
+import json
+from enum import Enum
+from typing import Iterable, Iterator
+
+from fastapi.responses import StreamingResponse
+
+
+class StreamFormat(str, Enum):
+    ndjson = 'ndjson'
+    json = 'json'
+
+
+def _dumps(item: dict) -> str:
+    # Same encoder settings as FastAPI's JSONResponse.
+    return json.dumps(item, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+
+
+def _ndjson(rows: Iterable[dict], batch: int) -> Iterator[bytes]:
+    chunk = []
+    for row in rows:
+        chunk.append(_dumps(row))
+        if len(chunk) >= batch:
+            yield ('\n'.join(chunk) + '\n').encode()
+            chunk = []
+    if chunk:
+        yield ('\n'.join(chunk) + '\n').encode()
+
+
+def _json_array(rows: Iterable[dict], batch: int) -> Iterator[bytes]:
+    yield b'['
+    separator = ''
+    chunk = []
+    for row in rows:
+        chunk.append(_dumps(row))
+        if len(chunk) >= batch:
+            yield (separator + ','.join(chunk)).encode()
+            separator = ','
+            chunk = []
+    if chunk:
+        yield (separator + ','.join(chunk)).encode()
+    yield b']'
+
+
+def stream_items(rows: Iterable[dict], format: StreamFormat, batch: int = 256) -> StreamingResponse:
+    """Encode ``rows`` incrementally instead of building the whole body."""
+    if format == StreamFormat.ndjson:
+        return StreamingResponse(_ndjson(rows, batch), media_type='application/x-ndjson')
+    return StreamingResponse(_json_array(rows, batch), media_type='application/json')
@@ -1,6 +1,12 @@
 from fastapi.testclient import TestClient
 from .main import app
+from .persistence import SQLiteBackend, WALBackend
+from .columnar import ColumnarItemStore
+from .store import InsufficientStock, ItemStore, SortedIndex
 # from .main_solved import app, items
+import json
+import pytest
+from concurrent.futures import ThreadPoolExecutor
 from pytest import fixture
 
 client = TestClient(app)
@@ -232,4 +238,438 @@ def test_increase_quantity(create_items):
     assert response.json()[0]["id"] == 1
     assert response.json()[0]["quantity"] == test_items[0]["quantity"]+20
     assert response.json()[1]["id"] == 2
-    assert response.json()[1]["quantity"] == test_items[1]["quantity"]+5
\ No newline at end of file
+    assert response.json()[1]["quantity"] == test_items[1]["quantity"]+5
+
+def test_create_item_after_delete(create_items):
+    response = client.delete("/items/3")
+    assert response.status_code == 200
+
+    response = client.post("/items", json=test_items[0])
+    assert response.status_code == 200
+    assert response.json()["id"] == 4
+
+    response = client.get("/items/3")
+    assert response.status_code == 404
+    assert client.get("/items/4").json()["id"] == 4
+
+
+def linear_filter(catalog, title=None, description=None, category=None,
+                  price_from=None, price_to=None, discount_from=None,
+                  discount_to=None, quantity_from=None, quantity_to=None):
+    return [
+        item for item in catalog
+        if (not title or title.lower() in item['title'].lower())
+        and (not description or description.lower() in item['description'].lower())
+        and (not category or category.lower() == item['category'].lower())
+        and (not price_from or price_from <= item['price'])
+        and (not price_to or price_to >= item['price'])
+        and (not (discount_from or discount_to) or item['discount'] is not None)
+        and (not discount_from or discount_from <= item['discount'])
+        and (not discount_to or discount_to >= item['discount'])
+        and (not quantity_from or quantity_from <= item['quantity'])
+        and (not quantity_to or quantity_to >= item['quantity'])
+    ]
+
+
+def make_store(count, store_class=ItemStore):
+    store = store_class()
+    for i in range(count):
+        store.add({
+            "id": store.allocate_id(),
+            "title": f"Item {i}",
+            "description": f"Description {i % 7}",
+            "category": ["Book", "MAGAZINE", "book", "Toy"][i % 4],
+            "price": float(i % 50 * 10),
+            "discount": float(i % 5),
+            "quantity": i % 13,
+        })
+    return store
+
+
+def test_store_filter_matches_linear_scan():
+    store = make_store(500)
+    for id in range(1, 500, 3):
+        store.update(id, {"quantity": id % 17, "price": float(id % 31)})
+    for id in range(2, 500, 11):
+        store.delete(id)
+    for id in range(5, 500, 50):
+        store.update(id, {"title": f"Renamed {id}"})
+    queries = [
+        {},
+        {"category": "BOOK"},
+        {"category": "missing"},
+        {"price_from": 100, "price_to": 250},
+        {"price_from": 0, "price_to": 30},
+        {"discount_from": 2, "discount_to": 3},
+        {"quantity_from": 5, "quantity_to": 5, "category": "toy"},
+        {"title": "item 1", "price_to": 400},
+        {"description": "description 3", "quantity_from": 12},
+        {"title": "m 4"},
+        {"title": "em 4"},
+        {"title": "ITEM 49"},
+        {"title": "nothing like this"},
+        {"title": "renamed", "description": "ion"},
+    ]
+    for query in queries:
+        assert store.filter(**query) == linear_filter(store.all(), **query)
+
+
+def test_store_filter_skips_items_without_discount():
+    store = make_store(10)
+    store.update(3, {"discount": None})
+    store.update(4, {"discount": None})
+    for query in ({"category": "toy", "discount_from": 1}, {"discount_from": 1}, {"discount_to": 3},
+                  {"title": "item", "discount_to": 3}):
+        assert store.filter(**query) == linear_filter(store.all(), **query)
+        assert all(item["id"] not in (3, 4) for item in store.filter(**query))
+
+
+def test_sorted_index_buckets_match_sorted_list():
+    index = SortedIndex(load=4)
+    expected = []
+    for id in range(200):
+        index.add(id * 7 % 23, id)
+        expected.append((id * 7 % 23, id))
+    for id in range(0, 200, 3):
+        index.remove(id * 7 % 23, id)
+        expected.remove((id * 7 % 23, id))
+    index.remove(99, 1)
+    expected.sort()
+    assert len(index) == len(expected)
+    for lo, hi in ((None, None), (5, 5), (3, 17), (None, 0), (22, None), (30, None), (10, 2)):
+        ids = [id for value, id in expected if (lo is None or value >= lo) and (hi is None or value <= hi)]
+        assert list(index.ids(lo, hi)) == ids
+        assert index.count(lo, hi) == len(ids)
+
+
+def test_get_items_paginated(create_items):
+    response = client.get("/items?limit=2")
+    assert response.status_code == 200
+    assert response.json() == test_items[:2]
+
+    response = client.get("/items?limit=2&after_id=2")
+    assert response.status_code == 200
+    assert response.json() == test_items[2:]
+
+    response = client.get("/items?after_id=3")
+    assert response.status_code == 200
+    assert response.json() == []
+
+    response = client.get("/items?limit=0")
+    assert response.status_code == 422
+
+
+def test_filter_items_paginated(create_items):
+    response = client.get("/items/filter/?category=book&limit=1")
+    assert response.status_code == 200
+    assert response.json() == test_items[:1]
+
+    response = client.get("/items/filter/?category=book&limit=1&after_id=1")
+    assert response.status_code == 200
+    assert response.json() == test_items[1:2]
+
+    response = client.get("/items/filter/?price_from=150&after_id=2")
+    assert response.status_code == 200
+    assert response.json() == test_items[2:]
+
+    response = client.get("/items/filter/?limit=0")
+    assert response.status_code == 422
+
+
+def test_get_items_streamed(create_items):
+    response = client.get("/items?stream=ndjson")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == test_items
+
+    response = client.get("/items?stream=json&after_id=1")
+    assert response.status_code == 200
+    assert response.json() == test_items[1:]
+
+    response = client.get("/items/filter/?stream=json&category=book&limit=1")
+    assert response.status_code == 200
+    assert response.json() == test_items[:1]
+
+
+def test_store_scan_survives_deletes():
+    store = make_store(50)
+    seen = []
+    for item in store.scan(chunk=8):
+        seen.append(item["id"])
+        if item["id"] == 1:
+            for id in range(20, 31):
+                store.delete(id)
+    assert seen == list(range(1, 20)) + list(range(31, 51))
+
+
+def test_sale_is_all_or_nothing(create_items):
+    new_item = test_items[1].copy()
+    new_item["quantity"] = 1
+    client.put("/items/2", json=new_item)
+
+    response = client.post("/sale", json={"ids": [1, 2, 2]})
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Item not found"}
+    assert client.get("/items/1").json()["quantity"] == test_items[0]["quantity"]
+    assert client.get("/items/2").json()["quantity"] == 1
+
+    response = client.post("/sale", json={"ids": [1, 1, 2, 100]})
+    assert response.status_code == 200
+    assert response.json()["message"] == "Items sold"
+    assert [item["id"] for item in response.json()["items"]] == [1, 1, 2]
+    assert client.get("/items/1").json()["quantity"] == test_items[0]["quantity"] - 2
+    assert client.get("/items/2").json()["quantity"] == 0
+
+    response = client.get("/sale/1,3")
+    assert response.status_code == 200
+    assert [item["quantity"] for item in response.json()["items"]] == [7, 19]
+
+
+def test_store_concurrent_sales_and_increments():
+    store = make_store(20)
+    for id in range(1, 21):
+        store.update(id, {"quantity": 0})
+    sold = []
+
+    def work(n):
+        ids = [n % 20 + 1, (n * 7) % 20 + 1]
+        store.increment([(id, 2) for id in ids])
+        try:
+            sold.extend(store.sell(ids + ids[:1]))
+        except InsufficientStock:
+            pass
+
+    with ThreadPoolExecutor(16) as pool:
+        list(pool.map(work, range(5000)))
+
+    for id in range(1, 21):
+        incremented = sum(2 for n in range(5000) for i in (n % 20 + 1, (n * 7) % 20 + 1) if i == id)
+        sold_count = sum(1 for item in sold if item["id"] == id)
+        assert store.get(id)["quantity"] == incremented - sold_count
+        assert store.get(id)["quantity"] >= 0
+
+
+def test_concurrent_requests(create_items):
+    def work(n):
+        if n % 3:
+            return client.get(f"/increment/{n % 3}1").status_code
+        return client.post("/sale", json={"ids": [1, 2]}).status_code
+
+    def create(n):
+        return client.post("/items", json=test_items[2]).json()["id"]
+
+    with ThreadPoolExecutor(16) as pool:
+        results = list(pool.map(work, range(1500)))
+        ids = list(pool.map(create, range(200)))
+
+    assert len(set(ids)) == len(ids) == 200
+    sales = results[::3].count(200)
+    assert sales + results[::3].count(404) == 500
+    assert client.get("/items/1").json()["quantity"] == test_items[0]["quantity"] + 500 - sales
+    assert client.get("/items/2").json()["quantity"] == test_items[1]["quantity"] + 500 - sales
+
+
+def test_bulk_endpoints(create_items):
+    rows = [test_items[0], {"title": "broken"}, test_items[2]]
+    response = client.post("/items/bulk", json=rows)
+    assert response.status_code == 200
+    assert [item["id"] for item in response.json()["items"]] == [4, 5]
+    assert [error["index"] for error in response.json()["errors"]] == [1]
+
+    body = "\n".join(json.dumps(row) for row in [test_items[1], test_items[1]]) + "\nnot json\n"
+    response = client.post("/items/bulk", content=body, headers={"content-type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert [item["id"] for item in response.json()["items"]] == [6, 7]
+    assert [error["index"] for error in response.json()["errors"]] == [2]
+
+    updates = [{**test_items[0], "id": 4, "quantity": 99}, {**test_items[0], "id": 100}]
+    response = client.put("/items/bulk", json=updates)
+    assert response.status_code == 200
+    assert response.json()["items"] == [updates[0]]
+    assert response.json()["errors"] == [{"index": 1, "detail": "Item not found"}]
+    assert client.get("/items/4").json()["quantity"] == 99
+
+    response = client.request("DELETE", "/items/bulk", json=[4, 5, 100, "x"])
+    assert response.status_code == 200
+    assert response.json()["deleted"] == [4, 5]
+    assert [error["index"] for error in response.json()["errors"]] == [2, 3]
+    assert client.get("/items/5").status_code == 404
+
+    response = client.post("/items/bulk", json={"title": "not a list"})
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize("backend", ["wal", "sqlite"])
+def test_store_persistence(tmp_path, backend):
+    def open_store():
+        if backend == "wal":
+            return ItemStore(backend=WALBackend(str(tmp_path), snapshot_every=7))
+        return ItemStore(backend=SQLiteBackend(str(tmp_path / "items.db")))
+
+    store = open_store()
+    created = store.create_many([{k: v for k, v in item.items() if k != "id"} for item in test_items] * 5)
+    store.sell([1, 2, 2])
+    store.update(3, {"title": "Renamed"})
+    store.delete_many([4, 15])
+    expected = store.all()
+    store.close()
+
+    store = open_store()
+    assert store.all() == expected
+    assert store.filter(title="renamed") == [store.get(3)]
+    assert store.create(test_items[0])["id"] == len(created) + 1
+    store.close()
+
+
+@pytest.mark.parametrize("backend", ["wal", "sqlite"])
+def test_store_persistence_concurrent_updates(tmp_path, backend):
+    def open_store():
+        if backend == "wal":
+            return ItemStore(backend=WALBackend(str(tmp_path), snapshot_every=50))
+        return ItemStore(backend=SQLiteBackend(str(tmp_path / "items.db")))
+
+    store = open_store()
+    store.create_many([{k: v for k, v in item.items() if k != "id"} for item in test_items] * 20)
+
+    def work(n):
+        store.increment([(n % 60 + 1, 1), ((n * 7) % 60 + 1, 2)])
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(work, range(2000)))
+    expected = store.all()
+    store.close()
+
+    store = open_store()
+    assert store.all() == expected
+    assert store.filter(quantity_from=1) == linear_filter(expected, quantity_from=1)
+    store.close()
+
+
+def test_columnar_store_matches_item_store():
+    stores = [make_store(3000, ItemStore), make_store(3000, ColumnarItemStore)]
+    for store in stores:
+        for id in range(1, 3000, 3):
+            store.update(id, {"quantity": id % 17, "category": "Poster"})
+        store.delete_many(list(range(2, 3000, 2)))
+        store.sell([1, 3, 3])
+        store.update(7, {"discount": None})
+        store.create(test_items[1])
+    assert stores[0].all() == stores[1].all()
+    assert stores[0].page(after_id=100, limit=5) == stores[1].page(after_id=100, limit=5)
+    queries = [
+        {},
+        {"category": "poster", "quantity_from": 3},
+        {"price_from": 100, "price_to": 250, "after_id": 1000},
+        {"category": "book", "discount_from": 2, "discount_to": 3},
+        {"title": "item 1", "description": "ion 3"},
+        {"category": "Book", "discount_from": 5},
+        {"category": "toy", "discount_to": 3},
+    ]
+    for query in queries:
+        assert stores[0].filter(**query) == stores[1].filter(**query)
+    for query in ({"title": "item 7", "discount_to": 3}, {"title": "item", "discount_from": 1}):
+        assert stores[0].filter(**query) == stores[1].filter(**query)
+        assert all(item["id"] != 7 for item in stores[1].filter(**query))
+
+
+def test_fast_serialization_matches_response_model(create_items, monkeypatch):
+    from . import serialization
+
+    fast = [client.get(url).json() for url in ("/items", "/items/2", "/increment/20")]
+    monkeypatch.setattr(serialization, "FAST_SERIALIZATION", False)
+    validated = [client.get(url).json() for url in ("/items", "/items/2", "/increment/20")]
+    assert fast == validated
+
+    schema = client.get("/openapi.json").json()
+    response = schema["paths"]["/items"]["get"]["responses"]["200"]["content"]["application/json"]
+    assert response["schema"]["items"] == {"$ref": "#/components/schemas/Item"}
+
+
+def test_metrics_exposes_request_latency(create_items):
+    client.get("/items/1")
+    client.get("/no/such/path")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.text.splitlines()
+    labels = 'method="GET",route="/items/{id}",status="200"'
+    assert f'demo_exam_request_duration_seconds_bucket{{{labels},le="+Inf"}}' in " ".join(lines)
+    assert any(line.startswith(f"demo_exam_requests_total{{{labels}}} ") for line in lines)
+    assert any('route="<unmatched>",status="404"' in line for line in lines)
+    assert "demo_exam_items 3" in lines
+
+
+def test_request_metrics_buckets_are_cumulative():
+    from instrumentation.metrics import RequestMetrics
+
+    metrics = RequestMetrics(buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.5, 0.5, 5.0):
+        metrics.observe("GET", '/a"b', 200, seconds)
+    lines = metrics.render("test")
+    labels = 'method="GET",route="/a\\"b",status="200"'
+    assert f'test_request_duration_seconds_bucket{{{labels},le="0.1"}} 1' in lines
+    assert f'test_request_duration_seconds_bucket{{{labels},le="1.0"}} 3' in lines
+    assert f'test_request_duration_seconds_bucket{{{labels},le="+Inf"}} 4' in lines
+    assert f"test_request_duration_seconds_count{{{labels}}} 4" in lines
+    assert f"test_requests_total{{{labels}}} 4" in lines
+
+
+def test_hdr_histogram_percentiles():
+    from .profiling import HdrHistogram
+
+    histogram = HdrHistogram()
+    for micros in range(1, 10001):
+        histogram.record(micros / 1e6)
+    p50, p99 = histogram.percentiles(0.5, 0.99)
+    assert abs(p50 - 0.005) / 0.005 < 0.01
+    assert abs(p99 - 0.0099) / 0.0099 < 0.01
+    assert histogram.summary()["count"] == 10000
+    assert histogram.summary()["max_ms"] == 10.0
+
+
+def test_profiling_records_phases_and_slow_requests():
+    import time
+    from fastapi import FastAPI
+    from . import profiling
+
+    profiler = profiling.RequestProfiler(slow_threshold=0.05, profile_rate=1.0, sample_rate=1.0)
+    profiled = FastAPI()
+    profiling.install(profiled, profiler)
+
+    @profiled.get("/slow/{id}")
+    def slow_endpoint(id: int):
+        time.sleep(0.12)
+        return {"id": id}
+
+    @profiled.get("/fast")
+    async def fast_endpoint():
+        return {"ok": True}
+
+    profiled_client = TestClient(profiled)
+    for _ in range(2):
+        assert profiled_client.get("/slow/1").json() == {"id": 1}
+        assert profiled_client.get("/fast").json() == {"ok": True}
+    assert profiled_client.get("/slow/x").status_code == 422
+
+    report = profiler.report()
+    routes = {route["route"]: route for route in report["routes"]}
+    assert routes["/slow/{id}"]["total"]["count"] == 3
+    assert routes["/slow/{id}"]["handler"]["count"] == 2
+    assert routes["/slow/{id}"]["handler"]["p50_ms"] >= 120
+    assert routes["/fast"]["serialization"]["count"] == 2
+
+    slow = report["slow"]
+    assert [entry["route"] for entry in slow] == ["/slow/{id}", "/slow/{id}"]
+    assert slow[0]["phases_ms"]["handler"] >= 120
+    assert "slow_endpoint" in slow[0]["stack"]
+    # The route is known to be slow after the first request, so the second is profiled
+    assert slow[0]["profile"] is None
+    assert "slow_endpoint" in slow[1]["profile"]
+
+    profiler.reset()
+    assert profiler.report()["routes"] == []
+
+
+def test_profile_endpoints_exist_only_when_profiling_is_enabled():
+    assert client.get("/admin/profile").status_code == 404
+    assert client.post("/admin/profile/reset").status_code == 404
@@ -0,0 +1,7 @@
+"""Request instrumentation shared by ``demo_exam`` and ``OldMonitorProject``.
+
+``metrics`` renders Prometheus text for request latencies and ``profiling``
+breaks requests down by phase. Both are plain ASGI middleware plus small
+data structures, so either application can install them with its own
+names and environment variables.
+"""